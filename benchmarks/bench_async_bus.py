@@ -0,0 +1,86 @@
+# Benchmark: AsyncEventBus against InMemoryEventBus with I/O-bound handlers.
+#
+# The handlers wait for a simulated network call: `await asyncio.sleep()` on the
+# AsyncEventBus, `time.sleep()` on the InMemoryEventBus.
+#
+# Usage: python -m benchmarks.bench_async_bus [--messages N] [--handler-ms MS]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.async_bus import AsyncEventBus
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def _messages(count: int) -> list[Message]:
+    return [Message(source_type="email", source_id=str(i), content="x" * 1024) for i in range(count)]
+
+
+def _measure(bus, handler, messages: int, done: threading.Event) -> float:
+    bus.subscribe("email", handler)
+    bus.start()
+    batch = _messages(messages)
+
+    started = time.perf_counter()
+    for message in batch:
+        bus.publish("email", message)
+    done.wait()
+    elapsed = time.perf_counter() - started
+    bus.stop()
+
+    return messages / elapsed
+
+
+def run_memory(workers: int, messages: int, handler_ms: float) -> float:
+    done = threading.Event()
+    handled = 0
+    lock = threading.Lock()
+
+    def handler(msg):
+        nonlocal handled
+        time.sleep(handler_ms / 1000.0)
+        with lock:
+            handled += 1
+            if handled == messages:
+                done.set()
+
+    return _measure(InMemoryEventBus(default_workers=workers), handler, messages, done)
+
+
+def run_async(concurrency: int, messages: int, handler_ms: float) -> float:
+    done = threading.Event()
+    handled = 0
+
+    async def handler(msg):
+        nonlocal handled
+        await asyncio.sleep(handler_ms / 1000.0)
+        handled += 1
+        if handled == messages:
+            done.set()
+
+    return _measure(AsyncEventBus(concurrency=concurrency), handler, messages, done)
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="AsyncEventBus against InMemoryEventBus with I/O-bound handlers")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--handler-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{'bus':<32} {'msg/s':>10}")
+    for workers in (1, 16):
+        print(f"{f'InMemoryEventBus, {workers} workers':<32} {run_memory(workers, args.messages, args.handler_ms):>10.0f}")
+    for concurrency in (16, 256):
+        print(f"{f'AsyncEventBus, concurrency {concurrency}':<32} "
+              f"{run_async(concurrency, args.messages, args.handler_ms):>10.0f}")
@@ -0,0 +1,82 @@
+# Benchmark: Record size, memory and CPU cost of the claim check.
+#
+# Publishes messages with large content through a ClaimCheck and compares the size of the Kafka records and
+# the memory held per in-flight message with those of the plain messages. Also reports the time to check
+# a message in, and to check it out and read its content.
+#
+# Usage: python -m benchmarks.bench_claim_check [--messages N] [--size BYTES] [--threshold BYTES]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import tempfile
+import time
+import tracemalloc
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.claim_check import ClaimCheck
+from soma.eventbus.codec import JsonCodec
+
+
+def held(create) -> int:
+    """
+    :return: The memory in bytes allocated by `create` and still held by its result.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = create()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Record size, memory and CPU cost of the claim check")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--threshold", type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    line = "Content-Type: text/plain; charset=utf-8 and some more text of a typical raw email\n"
+    body = (line * (args.size // len(line) + 1))[:args.size]
+    messages = [
+        Message(agent_name="bench", source_type="email", source_id=f"<{i}@example.com>", subject=f"Subject {i}",
+                content=f"{i}\n{body}", timestamp="2025-06-01T12:00:00Z", metadata={"folder": "INBOX", "uid": i})
+        for i in range(args.messages)
+    ]
+    codec = JsonCodec()
+
+    with tempfile.TemporaryDirectory() as directory:
+        claim_check = ClaimCheck(directory, threshold=args.threshold)
+
+        started = time.perf_counter()
+        checked = claim_check.check_in(messages)
+        check_in = (time.perf_counter() - started) / len(messages) * 1e6
+
+        started = time.perf_counter()
+        for message in claim_check.check_out(checked):
+            _ = message.content
+        check_out = (time.perf_counter() - started) / len(messages) * 1e6
+
+        plain_record = sum(len(codec.encode(message)) for message in messages) / len(messages)
+        claimed_record = sum(len(codec.encode(message)) for message in checked) / len(messages)
+        # Memory of messages as they are decoded from records and held in queues
+        records = [codec.encode(message) for message in messages]
+        plain_memory = held(lambda: [codec.decode(record) for record in records]) / len(messages)
+        records = [codec.encode(message) for message in checked]
+        claimed_memory = held(lambda: [codec.decode(record) for record in records]) / len(messages)
+        claim_check.store.close()
+
+    print(f"{'per message':<24} {'plain':>12} {'claim check':>12}")
+    print(f"{'Kafka record bytes':<24} {plain_record:>12.0f} {claimed_record:>12.0f}")
+    print(f"{'in-flight memory bytes':<24} {plain_memory:>12.0f} {claimed_memory:>12.0f}")
+    print()
+    print(f"check in:                {check_in:.0f} µs")
+    print(f"check out and read:      {check_out:.0f} µs")
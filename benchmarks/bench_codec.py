@@ -0,0 +1,67 @@
+# Benchmark: Encoding and decoding cost of the message codecs.
+#
+# Compares the codecs with the serialization KafkaEventBus used before codecs were introduced:
+# json.dumps(message.model_dump()) to encode, Message(**json.loads(...)) to decode.
+# Codecs whose package is not installed are skipped.
+#
+# Usage: python -m benchmarks.bench_codec [--messages N] [--size BYTES]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import json
+import logging
+import time
+from typing import Callable, List
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.codec import CODECS
+
+
+def measure(function: Callable, items: List) -> float:
+    """
+    Apply a function to all items.
+    :return: Time per item in microseconds.
+    """
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - started) / len(items) * 1e6
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Encoding and decoding cost of the message codecs")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    messages = [
+        Message(agent_name="bench", source_type="email", source_id=f"<{i}@example.com>", subject=f"Subject {i}",
+                content="x" * args.size, timestamp="2025-06-01T12:00:00Z", metadata={"folder": "INBOX", "uid": i})
+        for i in range(args.messages)
+    ]
+
+    candidates = [(
+        "json.dumps + Message(**)",
+        lambda message: json.dumps(message.model_dump()).encode("utf-8"),
+        lambda data: Message(**json.loads(data.decode("utf-8"))),
+    )]
+    for name, codec_class in CODECS.items():
+        try:
+            codec = codec_class()
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        candidates.append((name, codec.encode, codec.decode))
+
+    print(f"{'codec':<26} {'encode µs':>10} {'decode µs':>10} {'bytes':>8}")
+    for name, encode, decode in candidates:
+        encoded = [encode(message) for message in messages]
+        encode_time = measure(encode, messages)
+        decode_time = measure(decode, encoded)
+        print(f"{name:<26} {encode_time:>10.2f} {decode_time:>10.2f} {len(encoded[0]):>8}")
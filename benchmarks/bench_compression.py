@@ -0,0 +1,88 @@
+# Benchmark: Compression ratio and CPU cost of payload compression.
+#
+# Compresses a raw email and a serialized Mastodon post with each available codec, and reports the ratio of
+# content size to record size, and the time to compress a message and to decompress it on first access.
+# Codecs whose package is not installed are skipped.
+#
+# Usage: python -m benchmarks.bench_compression [--messages N] [--size BYTES]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import json
+import logging
+import time
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.codec import JsonCodec
+from soma.eventbus.compression import Compression, CODECS
+
+EMAIL = """Received: from mail-out.github.com (mail-out.github.com [192.30.252.192])
+Date: Mon, 2 Jun 2025 12:00:00 -0700
+From: Dependabot <notifications@github.com>
+To: soma/soma <soma@noreply.github.com>
+Subject: [soma/soma] Bump requests from 2.31.0 to 2.32.0 (PR #{i})
+Content-Type: text/plain; charset=UTF-8
+
+Bumps [requests](https://github.com/psf/requests) from 2.31.0 to 2.32.0.
+Release notes, changelog and commits are included below. You can trigger a rebase of this PR by commenting
+`@dependabot rebase`. You can view, comment on, or merge this pull request online at:
+https://github.com/soma/soma/pull/{i}
+"""
+
+POST = {
+    "id": "{i}", "created_at": "2025-06-02T12:00:00.000Z", "visibility": "public", "language": "en",
+    "uri": "https://mastodon.social/users/soma/statuses/{i}", "url": "https://mastodon.social/@soma/{i}",
+    "replies_count": 0, "reblogs_count": 3, "favourites_count": 12,
+    "content": "<p>A new release of SOMA is available, with batched delivery and Kafka metrics.</p>",
+    "account": {"id": "1", "username": "soma", "acct": "soma", "display_name": "SOMA",
+                "note": "<p>Self-organizing message agents</p>", "url": "https://mastodon.social/@soma",
+                "avatar": "https://files.mastodon.social/accounts/avatars/000/000/001/original/avatar.png",
+                "followers_count": 100, "following_count": 10, "statuses_count": 1000},
+    "media_attachments": [], "mentions": [], "tags": [{"name": "release", "url": "https://mastodon.social/tags/release"}],
+}
+
+
+def payloads(size: int):
+    """
+    :return: Raw email and Mastodon payloads of about `size` characters, by name.
+    """
+    email = "".join(EMAIL.replace("{i}", str(i)) for i in range(size // len(EMAIL) + 1))[:size]
+    posts = json.dumps([{**POST, "id": str(i)} for i in range(size // len(json.dumps(POST)) + 1)])[:size]
+    return {"email": email, "mastodon": posts}
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Compression ratio and CPU cost of payload compression")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=32 * 1024)
+    args = parser.parse_args()
+
+    codec = JsonCodec()
+    print(f"{'payload':<10} {'codec':<6} {'ratio':>6} {'compress µs':>12} {'decompress µs':>14}")
+    for name, content in payloads(args.size).items():
+        messages = [Message(agent_name="bench", source_type=name, source_id=str(i), content=content)
+                    for i in range(args.messages)]
+        for codec_name in CODECS:
+            try:
+                compression = Compression(codec=codec_name, min_ratio=0)
+            except ImportError as e:
+                print(f"Skipping {codec_name}: {e}")
+                continue
+
+            started = time.perf_counter()
+            compressed = compression.compress(messages)
+            compress_time = (time.perf_counter() - started) / len(messages) * 1e6
+
+            started = time.perf_counter()
+            for message in Compression.decompress(compressed):
+                _ = message.content
+            decompress_time = (time.perf_counter() - started) / len(messages) * 1e6
+
+            ratio = len(codec.encode(messages[0])) / len(codec.encode(compressed[0]))
+            print(f"{name:<10} {codec_name:<6} {ratio:>6.1f} {compress_time:>12.0f} {decompress_time:>14.0f}")
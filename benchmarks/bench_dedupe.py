@@ -0,0 +1,97 @@
+# Benchmark: Memory use and lookup cost of the deduplicator.
+#
+# Records N distinct IDs, reports the memory of the Bloom filter and the LRU set per million IDs, and the
+# cost per message of filtering new IDs, duplicates found in the LRU set, and duplicates only found in the
+# SQLite store. Messages are filtered in batches, as by the buses and the ingest filter.
+#
+# Usage: python -m benchmarks.bench_dedupe [--ids N] [--lru-size N] [--error-rate P] [--batch N]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Iterator, List
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.dedupe import Deduplicator, SqliteDedupeStore
+
+
+def batches(start: int, stop: int, size: int) -> Iterator[List[Message]]:
+    """
+    Generate messages with consecutive IDs, so the messages need not be kept in memory.
+    """
+    for first in range(start, stop, size):
+        yield [Message(agent_name="bench", source_type="email", source_id=f"<{i}@example.com>", content="")
+               for i in range(first, min(first + size, stop))]
+
+
+def measure(dedupe: Deduplicator, start: int, stop: int, size: int) -> float:
+    """
+    Filter the messages with the given IDs.
+    :return: Time per message in microseconds, excluding the creation of the messages.
+    """
+    elapsed = 0.0
+    for batch in batches(start, stop, size):
+        started = time.perf_counter()
+        dedupe.filter(batch)
+        elapsed += time.perf_counter() - started
+    return elapsed / (stop - start) * 1e6
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Memory use and lookup cost of the deduplicator")
+    parser.add_argument("--ids", type=int, default=1_000_000)
+    parser.add_argument("--lru-size", type=int, default=100_000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    # Memory
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dedupe = Deduplicator(capacity=args.ids, error_rate=args.error_rate, lru_size=args.lru_size)
+    bloom_bytes = tracemalloc.get_traced_memory()[0] - before
+    for batch in batches(0, args.lru_size, 1000):
+        dedupe.filter(batch)
+    lru_bytes = tracemalloc.get_traced_memory()[0] - before - bloom_bytes
+    tracemalloc.stop()
+
+    print(f"Bloom filter: {dedupe._current.hashes} hashes, "
+          f"{bloom_bytes / args.ids * 1e6 / 2 ** 20:.2f} MiB per million IDs and generation (two generations)")
+    print(f"LRU set:      {lru_bytes / args.lru_size:.0f} bytes per ID, "
+          f"{lru_bytes / 2 ** 20:.1f} MiB for {args.lru_size} IDs")
+
+    # Lookup cost, in memory
+    dedupe = Deduplicator(capacity=args.ids, error_rate=args.error_rate, lru_size=args.lru_size)
+    insert = measure(dedupe, 0, args.ids, args.batch)
+    duplicate = measure(dedupe, args.ids - args.lookups, args.ids, args.batch)
+    new = measure(dedupe, args.ids, args.ids + args.lookups, args.batch)
+
+    # Lookup cost, with the SQLite store
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteDedupeStore(os.path.join(directory, "seen.db"))
+        stored = Deduplicator(capacity=args.ids, error_rate=args.error_rate, lru_size=args.lru_size, store=store)
+        store_insert = measure(stored, 0, args.ids, args.batch)
+        # The oldest IDs dropped out of the LRU set and are only found in the store
+        store_duplicate = measure(stored, 0, args.lookups, args.batch)
+        db_bytes = os.path.getsize(store.path) + os.path.getsize(store.path + "-wal")
+        store.close()
+
+    print()
+    print(f"{'µs per message':<40} {'memory':>8} {'sqlite':>8}")
+    print(f"{'record new ID':<40} {insert:>8.2f} {store_insert:>8.2f}")
+    print(f"{'new ID (Bloom filter miss)':<40} {new:>8.2f} {'':>8}")
+    print(f"{'duplicate in LRU set':<40} {duplicate:>8.2f} {'':>8}")
+    print(f"{'duplicate only in store':<40} {'':>8} {store_duplicate:>8.2f}")
+    print()
+    print(f"SQLite store: {db_bytes / args.ids * 1e6 / 2 ** 20:.0f} MiB per million IDs on disk")
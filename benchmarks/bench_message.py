@@ -0,0 +1,92 @@
+# Benchmark: Construction, copy and fan-out cost of mutable and frozen messages.
+#
+# Construction compares the validating constructors with the trusted path of FrozenMessage. Copies compare
+# clone() as implemented before frozen messages (validating a new Message) with the current clone() and
+# with_metadata(). Fan-out delivers each message to N subscribers, which today must each get a copy if any
+# subscriber may change the message; a frozen message is shared.
+#
+# Usage: python -m benchmarks.bench_message [--messages N] [--size BYTES] [--subscribers N]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import time
+from typing import Callable, List
+
+import structlog
+
+from soma.core.contracts.message import Message, FrozenMessage
+
+
+def measure(function: Callable, items: List) -> float:
+    """
+    Apply a function to all items.
+    :return: Time per item in microseconds.
+    """
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - started) / len(items) * 1e6
+
+
+def clone_before(message: Message) -> Message:
+    """
+    clone() as implemented before frozen messages.
+    """
+    return Message(
+        source_type=message.source_type,
+        source_id=message.source_id,
+        subject=message.subject,
+        content=message.content,
+        timestamp=message.timestamp,
+        metadata=message.metadata.copy()
+    )
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Construction, copy and fan-out cost of messages")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--subscribers", type=int, default=8)
+    args = parser.parse_args()
+
+    fields = [
+        dict(agent_name="bench", source_type="email", source_id=f"<{i}@example.com>", subject=f"Subject {i}",
+             content="x" * args.size, timestamp="2025-06-01T12:00:00Z",
+             metadata={"folder": "INBOX", "uid": i, "from": "sender@example.com", "to": "soma@example.com"})
+        for i in range(args.messages)
+    ]
+    messages = [Message(**f) for f in fields]
+    frozen = [message.freeze() for message in messages]
+    handler = [lambda msg: None] * args.subscribers
+
+    def fan_out_copies(message: Message):
+        for subscriber in handler:
+            subscriber(message.clone())
+
+    def fan_out_shared(message: FrozenMessage):
+        for subscriber in handler:
+            subscriber(message)
+
+    rows = [
+        ("construct", "Message(**fields)", measure(lambda f: Message(**f), fields)),
+        ("construct", "FrozenMessage(**fields)", measure(lambda f: FrozenMessage(**f), fields)),
+        ("construct", "FrozenMessage.trusted(**fields)", measure(lambda f: FrozenMessage.trusted(**f), fields)),
+        ("construct", "Message.freeze()", measure(Message.freeze, messages)),
+        ("copy", "clone() before", measure(clone_before, messages)),
+        ("copy", "Message.clone()", measure(Message.clone, messages)),
+        ("copy", "Message.with_metadata()", measure(lambda msg: msg.with_metadata(seen=True), messages)),
+        ("copy", "FrozenMessage.with_metadata()", measure(lambda msg: msg.with_metadata(seen=True), frozen)),
+        ("fan-out", f"clone() before per subscriber ({args.subscribers})",
+         measure(lambda msg: [subscriber(clone_before(msg)) for subscriber in handler], messages)),
+        ("fan-out", f"Message.clone() per subscriber ({args.subscribers})", measure(fan_out_copies, messages)),
+        ("fan-out", f"FrozenMessage shared ({args.subscribers})", measure(fan_out_shared, frozen)),
+    ]
+
+    print(f"{'':<10} {'':<46} {'µs':>8}")
+    for group, name, elapsed in rows:
+        print(f"{group:<10} {name:<46} {elapsed:>8.2f}")
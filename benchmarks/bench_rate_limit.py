@@ -0,0 +1,134 @@
+# Benchmark: Cost of rate limit checks at 100k checks per second.
+#
+# Runs N checks through PolicyManager.enforce_rate_limit() against a topic limited to `rate` events per
+# second, from one and from several threads, and reports the cost per check and the share of admitted
+# events. For comparison, the same checks run against a sliding window of timestamps, which PolicyManager
+# used before, and whose cost grows with the rate. Finally, the limits are shared through each rate limit
+# store, leasing tokens in batches of `batch` times the rate; the report includes the store calls per check.
+#
+# Usage: python -m benchmarks.bench_rate_limit [--checks N] [--rate R] [--threads N] [--batch B]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+import structlog
+
+from soma.core.contracts.policy import AccessPolicy
+from soma.core.policy_manager import PolicyManager
+from soma.core.rate_limit_store import (LocalRateLimitStore, NetworkRateLimitStore, RateLimitServer,
+                                        RateLimitStore, SharedMemoryRateLimitStore)
+
+
+class CountingStore(RateLimitStore):
+    """
+    Counts the calls to another store.
+    """
+
+    def __init__(self, store: RateLimitStore):
+        self.store = store
+        self.calls = 0
+
+    def take(self, key: str, rate: float, count: int) -> int:
+        self.calls += 1
+        return self.store.take(key, rate, count)
+
+    def usage(self, key: str, rate: float) -> float:
+        return self.store.usage(key, rate)
+
+
+class SlidingWindow:
+    """
+    The previous limiter: a list of the timestamps of the last second, rebuilt on every check.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.timestamps: List[float] = []
+
+    def enforce_rate_limit(self, agent: str, topic: str) -> bool:
+        now = time.time()
+        self.timestamps = [ts for ts in self.timestamps if now - ts < 1.0]
+        if len(self.timestamps) < self.rate:
+            self.timestamps.append(now)
+            return True
+        return False
+
+
+def measure(check: Callable[[str, str], bool], checks: int, threads: int) -> tuple:
+    """
+    Run the checks, split over the threads.
+    :return: Time per check in microseconds, and the number of admitted events.
+    """
+    admitted = [0] * threads
+
+    def run(n: int):
+        count = 0
+        for _ in range(checks // threads):
+            count += check("bench", "email")
+        admitted[n] = count
+
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return elapsed / checks * 1e6, sum(admitted), elapsed
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="Cost of rate limit checks at 100k checks per second")
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--rate", type=int, default=100_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--window-checks", type=int, default=20_000,
+                        help="Checks against the sliding window, which is much slower")
+    parser.add_argument("--batch", type=float, default=0.1)
+    args = parser.parse_args()
+
+    def limited(store: Optional[RateLimitStore] = None) -> Callable[[str, str], bool]:
+        return PolicyManager([
+            AccessPolicy(agent_name="bench", allowed_publish_topics=["email"],
+                         rate_limit_per_topic={"email": args.rate}, max_publish_rate_per_second=args.rate * 2),
+        ], rate_limit_store=store, rate_limit_batch=args.batch).enforce_rate_limit
+
+    def unlimited() -> Callable[[str, str], bool]:
+        return PolicyManager([AccessPolicy(agent_name="other", allowed_publish_topics=["email"])]).enforce_rate_limit
+
+    # Each run starts with full buckets, so the admitted share is the burst plus the refill during the run
+    print(f"{'limiter':<28} {'threads':>7} {'µs/check':>9} {'checks/s':>10} {'admitted':>9}")
+    for name, check, checks, threads in [
+        ("token bucket", limited(), args.checks, 1),
+        ("token bucket", limited(), args.checks, args.threads),
+        ("no limit configured", unlimited(), args.checks, 1),
+        ("sliding window (previous)", SlidingWindow(args.rate).enforce_rate_limit, args.window_checks, 1),
+    ]:
+        per_check, admitted, elapsed = measure(check, checks, threads)
+        print(f"{name:<28} {threads:>7} {per_check:>9.2f} {checks / elapsed:>10.0f} {admitted / checks:>8.0%}")
+
+    shm = SharedMemoryRateLimitStore(f"soma-bench-{uuid.uuid4().hex[:8]}", create=True)
+    server = RateLimitServer()
+    server.start()
+    network = NetworkRateLimitStore(server.server_address)
+    try:
+        print()
+        print(f"{'store':<28} {'threads':>7} {'µs/check':>9} {'checks/s':>10} {'admitted':>9} {'calls/check':>12}")
+        for name, store in [("local", LocalRateLimitStore()), ("shared memory", shm), ("network (local server)", network)]:
+            counting = CountingStore(store)
+            per_check, admitted, elapsed = measure(limited(counting), args.checks, 1)
+            print(f"{name:<28} {1:>7} {per_check:>9.2f} {args.checks / elapsed:>10.0f} "
+                  f"{admitted / args.checks:>8.0%} {counting.calls / args.checks:>12.4f}")
+    finally:
+        network.close()
+        server.stop()
+        shm.close()
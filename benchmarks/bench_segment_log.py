@@ -0,0 +1,73 @@
+# Benchmark: InMemoryEventBus throughput with and without the durable segment log.
+#
+# Messages are published to a single topic and handled by a subscriber that only counts them,
+# so the numbers show the cost of writing, acknowledging and flushing the log.
+#
+# Usage: python -m benchmarks.bench_segment_log [--messages N] [--size BYTES]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import tempfile
+import threading
+import time
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def run(messages: int, size: int, **kwargs) -> float:
+    """
+    Publish `messages` messages and measure the time until all are handled.
+    :return: Throughput in messages per second.
+    """
+    done = threading.Event()
+    handled = 0
+
+    def handler(msg):
+        nonlocal handled
+        handled += 1
+        if handled == messages:
+            done.set()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if kwargs:
+            kwargs["log_dir"] = directory
+        bus = InMemoryEventBus(**kwargs)
+        bus.subscribe("email", handler)
+        bus.start()
+
+        payload = "x" * size
+        started = time.perf_counter()
+        for i in range(messages):
+            bus.publish("email", Message(source_type="email", source_id=str(i), content=payload))
+        done.wait()
+        elapsed = time.perf_counter() - started
+        bus.stop()
+        if bus.log:
+            bus.log.close()
+
+    return messages / elapsed
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="InMemoryEventBus throughput with and without segment log")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=1024)
+    args = parser.parse_args()
+
+    modes = [
+        ("in-memory", {}),
+        ("log, no fsync", dict(log_fsync_messages=0, log_fsync_interval=None)),
+        ("log, fsync every 1000", dict(log_fsync_messages=1000, log_fsync_interval=1.0)),
+        ("log, fsync every 100", dict(log_fsync_messages=100, log_fsync_interval=1.0)),
+    ]
+    print(f"{'mode':<24} {'msg/s':>10}")
+    for name, options in modes:
+        print(f"{name:<24} {run(args.messages, args.size, **options):>10.0f}")
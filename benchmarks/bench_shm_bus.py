@@ -0,0 +1,147 @@
+# Benchmark: SharedMemoryEventBus throughput and latency between two processes.
+#
+# Throughput: the parent process (node 0) publishes messages that are all routed to
+# a child process (node 1). For comparison, the same messages are sent through a
+# multiprocessing.Queue and republished on an InMemoryEventBus in the child.
+# Latency: the child answers every "ping" with a "pong" routed back to the parent;
+# the one-way latency is half the round trip time.
+#
+# Usage: python -m benchmarks.bench_shm_bus [--messages N] [--size BYTES] [--pings N]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+import zlib
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.shm_bus import SharedMemoryEventBus
+
+
+def _key_for(node: int, nodes: int = 2) -> str:
+    """
+    Find a key that is routed to the given node.
+    """
+    i = 0
+    while zlib.crc32(f"key-{i}".encode("utf-8")) % nodes != node:
+        i += 1
+    return f"key-{i}"
+
+
+def _child(name: str, messages: int, done, ready):
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    bus = SharedMemoryEventBus(name, node_id=1, nodes=2)
+    handled = 0
+    back = _key_for(0)
+
+    def count(msg):
+        nonlocal handled
+        handled += 1
+        if handled == messages:
+            done.set()
+
+    def pong(msg):
+        bus.publish("pong", msg, key=back)
+
+    bus.subscribe("bench", count)
+    bus.subscribe("ping", pong)
+    bus.start()
+    ready.set()
+    done.wait()
+    # Keep the rings alive until the parent finished the latency test
+    time.sleep(0.5 + messages / 1e6)
+    bus.close()
+
+
+def _queue_child(q, messages: int, ready):
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    done = threading.Event()
+    handled = 0
+
+    def count(msg):
+        nonlocal handled
+        handled += 1
+        if handled == messages:
+            done.set()
+
+    bus = InMemoryEventBus()
+    bus.subscribe("bench", count)
+    bus.start()
+    ready.set()
+    for _ in range(messages):
+        bus.publish("bench", Message.model_validate_json(q.get()))
+    done.wait()
+    bus.stop()
+
+
+def run_queue(messages: int, size: int) -> float:
+    ctx = multiprocessing.get_context("spawn")
+    q = ctx.Queue(maxsize=10000)
+    ready = ctx.Event()
+    p = ctx.Process(target=_queue_child, args=(q, messages, ready))
+    p.start()
+    ready.wait()
+    payload = "x" * size
+    started = time.perf_counter()
+    for i in range(messages):
+        q.put(Message(source_type="bench", source_id=str(i), content=payload).model_dump_json())
+    p.join()
+    return messages / (time.perf_counter() - started)
+
+
+def run_shm(messages: int, size: int, pings: int) -> tuple[float, list[float]]:
+    ctx = multiprocessing.get_context("spawn")
+    name = f"soma-bench-{uuid.uuid4().hex[:8]}"
+    bus = SharedMemoryEventBus(name, node_id=0, nodes=2)
+    done, ready = ctx.Event(), ctx.Event()
+    p = ctx.Process(target=_child, args=(name, messages, done, ready))
+    p.start()
+    ready.wait()
+
+    pong = threading.Event()
+    bus.subscribe("pong", lambda msg: pong.set())
+    bus.start()
+
+    key = _key_for(1)
+    payload = "x" * size
+    started = time.perf_counter()
+    for i in range(messages):
+        bus.publish("bench", Message(source_type="bench", source_id=str(i), content=payload), key=key)
+    done.wait()
+    throughput = messages / (time.perf_counter() - started)
+
+    latencies = []
+    for i in range(pings):
+        pong.clear()
+        sent = time.perf_counter()
+        bus.publish("ping", Message(source_type="bench", source_id=str(i), content=payload), key=key)
+        pong.wait()
+        latencies.append((time.perf_counter() - sent) / 2)
+
+    p.join()
+    bus.close()
+    return throughput, sorted(latencies)
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="SharedMemoryEventBus throughput and latency between two processes")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--pings", type=int, default=1000)
+    args = parser.parse_args()
+
+    throughput, latencies = run_shm(args.messages, args.size, args.pings)
+    print(f"SharedMemoryEventBus:                     {throughput:>10.0f} msg/s")
+    print(f"multiprocessing.Queue + InMemoryEventBus: {run_queue(args.messages, args.size):>10.0f} msg/s")
+    print(f"one-way latency p50: {latencies[len(latencies) // 2] * 1e6:.0f} us, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} us")
@@ -0,0 +1,63 @@
+# Benchmark: InMemoryEventBus throughput with 1, 4 and 16 workers per topic.
+#
+# Handlers simulate I/O-bound work (network calls, storage writes) by sleeping,
+# which releases the GIL just like blocking I/O does.
+#
+# Usage: python -m benchmarks.bench_worker_pools [--messages N] [--handler-ms MS]
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import argparse
+import logging
+import threading
+import time
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def run(workers: int, messages: int, handler_ms: float) -> float:
+    """
+    Publish `messages` messages to a single topic and measure the time until all are handled.
+    :return: Throughput in messages per second.
+    """
+    done = threading.Event()
+    handled = 0
+    lock = threading.Lock()
+
+    def handler(msg):
+        nonlocal handled
+        time.sleep(handler_ms / 1000.0)
+        with lock:
+            handled += 1
+            if handled == messages:
+                done.set()
+
+    bus = InMemoryEventBus(workers={"email": workers})
+    bus.subscribe("email", handler)
+    bus.start()
+
+    started = time.perf_counter()
+    for i in range(messages):
+        bus.publish("email", Message(source_type="email", source_id=str(i), content="x" * 1024))
+    done.wait()
+    elapsed = time.perf_counter() - started
+    bus.stop()
+
+    return messages / elapsed
+
+
+if __name__ == "__main__":
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    parser = argparse.ArgumentParser(description="InMemoryEventBus throughput per number of topic workers")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--handler-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'msg/s':>10}")
+    for n in (1, 4, 16):
+        print(f"{n:>8} {run(n, args.messages, args.handler_ms):>10.0f}")
@@ -167,9 +167,7 @@ class GitHubMailAgent(EventSubscriber, EventProducer, SupportsHealthCheck):
 
                 message.metadata["defined_in"] = match.group(1).strip()
                 message.metadata["suggested_update"] = match.group(2).strip()
-                message_clone = message.clone()
-                message_clone.content = ""
-                self._publish(message_clone)
+                self._publish(message.freeze(content=""))
             else:
                 self.logger.warning("No vulnerability locations found in security advisory", **self._log_data(message, mail))
 
@@ -227,7 +225,7 @@ class GitHubMailAgent(EventSubscriber, EventProducer, SupportsHealthCheck):
                     message.metadata["defined_in"] = self._extract(deps[dep], "Defined in")
                     message.metadata["vulnerabilities"] = self._extract(deps[dep], "Vulnerabilities")
                     message.metadata["suggested_update"] = self._extract(deps[dep], "Suggested update")
-                    self._publish(message.clone())
+                    self._publish(message)
 
     def _handle_ci_activity(self, mail, message):
         """
@@ -263,8 +261,9 @@ class GitHubMailAgent(EventSubscriber, EventProducer, SupportsHealthCheck):
             self.logger.error("Event bus is not set. Cannot publish message.", **self._log_data(message))
             raise ValueError("Event bus is not set. Cannot publish message.")
 
-        repository = message.metadata.get("repository_url", "")
-        message.metadata["repository"] = repository.replace("https://github.com/", "")
+        # The agent keeps changing its working message while it publishes, so subscribers get a frozen snapshot
+        repository = message.metadata.get("repository_url", "").replace("https://github.com/", "")
+        message = message.freeze(metadata={**message.metadata, "repository": repository})
 
         topic = self.output_prefix + message.source_type
         key = message.metadata.get('repository', 'unknown/unknown')
@@ -4,14 +4,52 @@
 # :license: MIT License
 
 from abc import ABC, abstractmethod
-from typing import Union, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+from typing import Union, Callable, Optional, Sequence, List, Tuple
 import queue
 
 from soma.core.contracts.message import Message
 from soma.core.policy_manager import PolicyManager
-from soma.eventbus.metrics import RATE_LIMIT_COUNTER, RATE_LIMIT_USAGE
+from soma.eventbus.claim_check import ClaimCheck
+from soma.eventbus.compression import Compression
+from soma.eventbus.dedupe import Deduplicator
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.timing_wheel import Scheduler, default_scheduler
+from soma.eventbus.topic_matcher import TopicMatcher, TopicPattern
+from soma.eventbus.metrics import RATE_LIMIT_COUNTER, RATE_LIMIT_USAGE, EVENT_LATENCY, EVENT_COUNT, EVENT_ERRORS, \
+    RETRIES, DEAD_LETTERS
 
-Subscriber = Union[Callable[[dict], None], 'EventSubscriber']
+Subscriber = Union[Callable[[dict], None], 'EventSubscriber', 'AsyncEventSubscriber']
+
+
+class _Completion:
+    """
+    Counts the delivery attempts of a message that are running or scheduled. The message is done when none is
+    left, i.e. when all subscribers handled it, or failed without another attempt.
+    """
+    __slots__ = ("pending", "finish", "_lock")
+
+    def __init__(self, finish: Callable[[], None]):
+        """
+        :param finish: Called when the message is done after a retry.
+        """
+        self.pending = 1  # The first delivery
+        self.finish = finish
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self.pending += 1
+
+    def release(self) -> bool:
+        """
+        :return: True if this was the last pending attempt.
+        """
+        with self._lock:
+            self.pending -= 1
+            return self.pending == 0
 
 
 class EventBus(ABC):
@@ -21,23 +59,52 @@ class EventBus(ABC):
     Abstract base class for event bus implementations.
     """
     queues: dict[str, 'queue.Queue']  # Dictionary to hold topic queues
+    subscribers: dict[str, list['Subscriber']]  # Dictionary to hold the subscribers of each literal topic
+    topic_matcher: TopicMatcher  # Resolves the subscribers of a topic, including pattern subscriptions
+    retry: Optional[RetryPolicy] = None  # Retry policy of subscribers without their own; None drops failed messages
+    retry_policies: dict[int, RetryPolicy]  # Retry policies by id of the subscriber
+    dead_letter_prefix: str = "dead_letter."  # Prefix of the dead-letter topic of each topic
+    scheduler: Optional[Scheduler] = None  # Timing wheel for retries and delayed messages; None uses the shared one
+    retry_workers: int = 4  # Number of threads running retries
+    deduplicator: Optional[Deduplicator] = None  # Drops messages whose source_id was delivered before; None disables
+    claim_check: Optional[ClaimCheck] = None  # Moves large content to a blob store while messages are in transit
+    compression: Optional[Compression] = None  # Compresses large content while messages are in transit
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
 
     @abstractmethod
-    def publish(self, topic: str, message: Message, key: str | None = None):
+    def publish(self, topic: str, message: Message, key: str | None = None, delay: Optional[float] = None):
         """
         Publish a message to a specific topic on the event bus.
         :param topic: The topic to which the message should be published.
         :param message: The message to be published.
         :param key: Optional key for the message, used for routing or identification purposes.
+        :param delay: Optional time in seconds after which the message is published. Delayed messages are kept
+                      in memory until then.
         :return: None
         """
         ...
 
+    def publish_many(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Publish a batch of messages to a specific topic on the event bus.
+        Implementations should override this to check policies once per batch and enqueue or send the batch in bulk.
+        The default implementation publishes the messages one by one.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :param keys: Optional keys for the messages, in the same order as the messages.
+        :return: None
+        """
+        keys = self._batch_keys(messages, keys)
+        for message, key in zip(messages, keys):
+            self.publish(topic, message, key=key)
+
     @abstractmethod
-    def subscribe(self, topic: str, handler: 'Subscriber'):
+    def subscribe(self, topic: TopicPattern, handler: 'Subscriber'):
         """
         Subscribe to a specific topic on the event bus with a handler function.
-        :param topic: The topic to which the handler should subscribe.
+        :param topic: The topic to which the handler should subscribe. Wildcard patterns like `github.*` or `github.#`
+                      and compiled regular expressions subscribe to all matching topics, including topics created later.
         :param handler: A callable function that will be invoked when a message is published to the topic.
         :return: None
         """
@@ -82,7 +149,290 @@ class EventBus(ABC):
 
         return None
 
-    def check_subscribe_policy(self, topic: str, handler: 'Subscriber'):
+    def check_publish_policy_many(self, topic: str, messages: Sequence[Message]) -> Tuple[List[int], List[str]]:
+        """
+        Check the publish policy for a batch of messages.
+        Permissions and rate limits are evaluated once per publishing agent instead of once per message.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :return: The indices of the admitted messages and a list of policy violations.
+        """
+        if not self.policy_manager:
+            return list(range(len(messages))), []
+
+        by_agent: dict[str, List[int]] = {}
+        for i, message in enumerate(messages):
+            by_agent.setdefault(getattr(message, "agent_name", "anonymous_agent"), []).append(i)
+
+        admitted: List[int] = []
+        violations: List[str] = []
+        for agent_name, indices in by_agent.items():
+            if not self.policy_manager.is_allowed(agent_name, topic, direction="publish"):
+                violations.append(f"[Policy] PUBLISH DENIED: {agent_name} not allowed to publish to '{topic}'")
+                continue
+
+            granted = self.policy_manager.enforce_rate_limit_batch(agent_name, topic, len(indices))
+            admitted.extend(indices[:granted])
+            if granted < len(indices):
+                RATE_LIMIT_COUNTER.labels(agent=agent_name, topic=topic).inc(len(indices) - granted)
+                current_usage = self.policy_manager.get_usage_ratio(agent_name, topic)
+                RATE_LIMIT_USAGE.labels(agent=agent_name, topic=topic).set(current_usage)
+                violations.append(f"[Policy] RATE LIMIT: {agent_name} publishing too fast to '{topic}', "
+                                  f"{len(indices) - granted} of {len(indices)} messages dropped")
+
+        admitted.sort()
+        return admitted, violations
+
+    @staticmethod
+    def _batch_keys(messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]]) -> Sequence[Optional[str]]:
+        """
+        Validate the keys passed to publish_many().
+        :param messages: The messages of the batch.
+        :param keys: The keys of the batch or None.
+        :return: One key per message.
+        """
+        if keys is None:
+            return [None] * len(messages)
+        if len(keys) != len(messages):
+            raise ValueError(f"Got {len(keys)} keys for {len(messages)} messages")
+        return keys
+
+    def deliver(self, topic: str, messages: Sequence[Message],
+                on_done: Optional[Callable[[Sequence[int]], None]] = None):
+        """
+        Invoke the registered handlers of a topic with the messages taken from the topic.
+        Subscribers implementing `handle_batch()` receive the messages in a single call,
+        all other handlers are invoked once per message.
+        Failed messages are retried according to the retry policy of the subscriber.
+        With a deduplicator, messages delivered on the topic before are dropped. Messages are recorded as
+        delivered after the handlers returned, so a message is delivered again if handling it was interrupted.
+        With a claim check, content moved to the blob store is read when a subscriber accesses it, and the
+        reference of each message is released when the message is done. Compressed content is decompressed when
+        a subscriber accesses it.
+        :param topic: The topic the messages were taken from.
+        :param messages: The messages to deliver.
+        :param on_done: Optional callable invoked with the indices of messages that are done: handled by all
+                        subscribers, dropped as duplicates, or failed without another attempt pending. Messages
+                        done after a retry are reported later, from the retry executor. A pending retry that is
+                        lost, e.g. because the process stops, never reports its message.
+        :return: None
+        """
+        received = messages
+        if self.compression is not None:
+            messages = self.compression.decompress(messages)
+        claim_check = self.claim_check
+        if claim_check is not None:
+            messages = claim_check.check_out(messages)
+
+        def finish(done: Sequence[int]):
+            if claim_check is not None:
+                claim_check.release([received[i] for i in done])
+            if on_done is not None and done:
+                on_done(done)
+
+        completions = None
+        if on_done is not None or claim_check is not None:
+            completions = [_Completion(lambda i=i: finish([i])) for i in range(len(messages))]
+        try:
+            self._deliver(topic, messages, completions)
+        finally:
+            if completions is not None:
+                finish([i for i, completion in enumerate(completions) if completion.release()])
+
+    def _encode(self, topic: str, messages: Sequence[Message]) -> Sequence[Message]:
+        """
+        Apply the claim check and compression to messages before they are queued or sent.
+        :return: The messages to queue or send, in the same order.
+        """
+        if self.claim_check is not None:
+            messages = self.claim_check.check_in(messages, topic)
+        if self.compression is not None:
+            messages = self.compression.compress(messages, topic)
+        return messages
+
+    def _deliver(self, topic: str, messages: Sequence[Message], completions: Optional[List[_Completion]] = None):
+        if self.deduplicator is not None:
+            passed = self.deduplicator.filter(messages, scope=topic, remember=False)
+            if completions is not None and len(passed) < len(messages):
+                by_message = {id(message): completion for message, completion in zip(messages, completions)}
+                completions = [by_message[id(message)] for message in passed]
+            messages = passed
+            if not messages:
+                return
+
+        for subscriber in self.subscribers_for(topic):
+            if len(messages) > 1 and EventSubscriber.handles_batches(subscriber):
+                agent_name = self._agent_name(subscriber)
+                try:
+                    with EVENT_LATENCY.labels(topic=topic, agent=agent_name).time():
+                        subscriber.handle_batch(messages)
+
+                        EVENT_COUNT.labels(topic=topic, agent=agent_name).inc(len(messages))
+                except Exception as e:
+                    self.logger.error("Batch handler failed", topic=topic, agent=agent_name, messages=len(messages),
+                                      error=str(e))
+                    EVENT_ERRORS.labels(topic=topic, agent=agent_name).inc()
+                    # It is unknown which messages failed, so each is retried on its own
+                    for i, msg in enumerate(messages):
+                        self._handler_failed(topic, subscriber, msg, 1, e, completions[i] if completions else None)
+                continue
+
+            for i, msg in enumerate(messages):
+                self._invoke(topic, subscriber, msg, completion=completions[i] if completions else None)
+
+        if self.deduplicator is not None:
+            self.deduplicator.remember(messages, scope=topic)
+
+    def _invoke(self, topic: str, subscriber: 'Subscriber', msg: Message, attempt: int = 1,
+                completion: Optional[_Completion] = None):
+        """
+        Invoke a single subscriber with a message and record metrics.
+        :param topic: The topic the message was taken from.
+        :param subscriber: The subscriber.
+        :param msg: The message.
+        :param attempt: The number of the delivery attempt, starting at 1.
+        :param completion: Optional completion of the message, held by a scheduled retry.
+        :return: None
+        """
+        agent_name = self._agent_name(subscriber)
+        try:
+            with EVENT_LATENCY.labels(topic=topic, agent=agent_name).time():
+                if isinstance(subscriber, EventSubscriber):
+                    subscriber.handle(msg)
+                else:
+                    subscriber(msg)
+
+                EVENT_COUNT.labels(topic=topic, agent=agent_name).inc()
+        except Exception as e:
+            self.logger.error("Handler failed", topic=topic, agent=agent_name, error=str(e))
+            EVENT_ERRORS.labels(topic=topic, agent=agent_name).inc()
+            self._handler_failed(topic, subscriber, msg, attempt, e, completion)
+
+    @staticmethod
+    def _agent_name(subscriber: 'Subscriber') -> str:
+        return getattr(subscriber, "__name__", None) or getattr(subscriber, "name", "unknown")
+
+    def _handler_failed(self, topic: str, subscriber: 'Subscriber', msg: Message, attempt: int, error: Exception,
+                        completion: Optional[_Completion] = None):
+        """
+        Schedule another attempt to deliver a message to a subscriber, or move the message to the dead-letter topic
+        after the last attempt. Without a retry policy, the message is dropped.
+        :param topic: The topic the message was taken from.
+        :param subscriber: The subscriber that failed.
+        :param msg: The message.
+        :param attempt: The number of the failed attempt, starting at 1.
+        :param error: The error raised by the subscriber.
+        :param completion: Optional completion of the message, held until the scheduled attempt ran.
+        :return: None
+        """
+        policy = getattr(self, "retry_policies", {}).get(id(subscriber), self.retry)
+        if policy is None:
+            return
+
+        agent_name = self._agent_name(subscriber)
+        if attempt < policy.max_attempts:
+            RETRIES.labels(topic=topic, agent=agent_name).inc()
+            if completion is not None:
+                completion.hold()
+            self._later(policy.backoff(attempt),
+                        lambda: self._redeliver(topic, subscriber, msg, attempt + 1, completion))
+            return
+
+        if policy.dead_letter:
+            DEAD_LETTERS.labels(topic=topic, agent=agent_name).inc()
+            dead_letter = {"topic": topic, "agent": agent_name, "attempts": attempt, "error": str(error)}
+            self._publish_unchecked(self.dead_letter_prefix + topic, msg.with_metadata(dead_letter=dead_letter))
+
+    def _redeliver(self, topic: str, subscriber: 'Subscriber', msg: Message, attempt: int,
+                   completion: Optional[_Completion] = None):
+        """
+        Run another delivery attempt. Called on the scheduler thread, so the attempt is handed to the retry executor.
+        :return: None
+        """
+        def run():
+            try:
+                self._invoke(topic, subscriber, msg, attempt, completion)
+            finally:
+                if completion is not None and completion.release():
+                    completion.finish()
+
+        self._submit(run)
+
+    def _later(self, delay: float, callback: Callable[[], None]):
+        """
+        Run a non-blocking callback on the scheduler thread after `delay` seconds.
+        :return: None
+        """
+        (self.scheduler or default_scheduler()).call_later(delay, callback)
+
+    def _submit(self, callback: Callable[[], None]):
+        """
+        Run a callback on the retry executor, a thread pool of `retry_workers` threads created on first use.
+        :return: None
+        """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.retry_workers,
+                                                        thread_name_prefix="soma-retry")
+
+        def run():
+            try:
+                callback()
+            except Exception as e:
+                self.logger.exception("Scheduled task failed", error=str(e))
+
+        self._executor.submit(run)
+
+    def _stop_executor(self):
+        """
+        Shut down the retry executor, if it was created. Queued retries are cancelled, running ones complete in
+        the background. Retries and delayed messages due later start a new executor.
+        :return: None
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _publish_unchecked(self, topic: str, message: Message, key: Optional[str] = None):
+        """
+        Publish a message without checking policies, e.g. a dead letter or a delayed message that was checked before.
+        Implementations should override this; the default implementation calls publish().
+        :return: None
+        """
+        self.publish(topic, message, key=key)
+
+    def _publish_later(self, delay: float, topic: str, message: Message, key: Optional[str] = None):
+        """
+        Publish a message after `delay` seconds, without checking policies again.
+        :return: None
+        """
+        self._later(delay, lambda: self._submit(lambda: self._publish_unchecked(topic, message, key)))
+
+    def subscribers_for(self, topic: str) -> Sequence['Subscriber']:
+        """
+        Get the subscribers of a topic, including subscribers of matching patterns.
+        :param topic: The topic name.
+        :return: The subscribers in the order they subscribed.
+        """
+        return self.topic_matcher.match(topic)
+
+    def _add_subscriber(self, topic: TopicPattern, handler: 'Subscriber', retry: Optional[RetryPolicy] = None):
+        """
+        Register a subscriber for a topic or pattern.
+        :param topic: The topic name, wildcard pattern or compiled regular expression.
+        :param handler: The subscriber.
+        :param retry: Optional retry policy for this subscriber, overriding the retry policy of the bus.
+        :return: None
+        """
+        if retry is not None:
+            self.retry_policies[id(handler)] = retry
+        if not TopicMatcher.is_pattern(topic):
+            self.subscribers.setdefault(topic, []).append(handler)
+        self.topic_matcher.add(topic, handler)
+
+    def check_subscribe_policy(self, topic: TopicPattern, handler: 'Subscriber'):
         """
         Handle policy violations for subscribing.
         :param topic: The topic related to the policy violation.
@@ -90,11 +440,13 @@ class EventBus(ABC):
         :return: None or a string indicating the policy violation.
         """
         if self.policy_manager:
-            agent_name = getattr(handler, "name", "anonymous_agent") if isinstance(handler, EventSubscriber) else getattr(
+            agent_name = getattr(handler, "name", "anonymous_agent") if isinstance(
+                handler, (EventSubscriber, AsyncEventSubscriber)) else getattr(
                 handler, "__name__", "unnamed_handler")
 
             if not self.policy_manager.is_allowed(agent_name, topic, direction="subscribe"):
-                return f"[Policy] SUBSCRIBE DENIED: {agent_name} not allowed to subscribe to '{topic}'"
+                name = topic.pattern if isinstance(topic, re.Pattern) else topic
+                return f"[Policy] SUBSCRIBE DENIED: {agent_name} not allowed to subscribe to '{name}'"
 
         return None
 
@@ -106,3 +458,34 @@ class EventSubscriber(ABC):
     @abstractmethod
     def handle(self, msg: Message) -> None:
         ...
+
+    def handle_batch(self, messages: Sequence[Message]) -> None:
+        """
+        Handle several messages of the same topic at once.
+        Override this to amortize per-call costs, e.g. storage writes or API calls.
+        The event bus only calls it when it is overridden, otherwise `handle()` is called for each message.
+        :param messages: The messages to handle, in the order they were taken from the topic.
+        :return: None
+        """
+        for msg in messages:
+            self.handle(msg)
+
+    @staticmethod
+    def handles_batches(subscriber: 'Subscriber') -> bool:
+        """
+        Check whether a subscriber overrides `handle_batch()`.
+        :param subscriber: The subscriber to check.
+        :return: True if the subscriber wants to receive batches.
+        """
+        return isinstance(subscriber, EventSubscriber) and \
+            type(subscriber).handle_batch is not EventSubscriber.handle_batch
+
+
+class AsyncEventSubscriber(ABC):
+    """
+    Subscriber handling messages on the loop of an asyncio based event bus.
+    """
+
+    @abstractmethod
+    async def handle(self, msg: Message) -> None:
+        ...
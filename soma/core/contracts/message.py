@@ -9,8 +9,8 @@
 # :license: MIT License
 
 from abc import abstractmethod, ABC
-from typing import Iterable, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from typing import Any, ClassVar, Dict, Iterable, Optional
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator
 
 
 class Message(BaseModel):
@@ -20,7 +20,7 @@ class Message(BaseModel):
     source ID, subject, content, timestamp, and any additional metadata.
     The `to_dict` method converts the message to a dictionary format for easy serialization.
     """
-    agent_name: str = Field(
+    agent_name: Optional[str] = Field(
         None,
         description="Name of the agent that created the message, if applicable. This is used to identify the agent in the system."
     )
@@ -51,19 +51,186 @@ class Message(BaseModel):
 
     def clone(self) -> 'Message':
         """
-        Create a clone of the current message instance.
+        Create a mutable copy of the current message instance, without validating it again.
+        The metadata is copied, but values within the metadata are shared.
 
         Returns:
             Message: A new instance of Message with the same data.
         """
-        return Message(
-            source_type=self.source_type,
-            source_id=self.source_id,
-            subject=self.subject,
-            content=self.content,
-            timestamp=self.timestamp,
-            metadata=self.metadata.copy()
-        )
+        return _construct(Message, {**self.__dict__, "metadata": dict(self.metadata or {})})
+
+    def with_metadata(self, **updates: Any) -> 'Message':
+        """
+        Create a copy of the message with additional or changed metadata, leaving this message unchanged.
+        :param updates: The metadata to add or change.
+        :return: The copy, of the same type as this message.
+        """
+        return _construct(type(self), {**self.__dict__, "metadata": {**(self.metadata or {}), **updates}})
+
+    def freeze(self, **changes: Any) -> 'FrozenMessage':
+        """
+        Create an immutable snapshot of the message, without validating it again.
+        Later changes to this message, including its metadata, do not affect the snapshot.
+        :param changes: Fields to change in the snapshot. They are not validated.
+        :return: The snapshot.
+        """
+        return FrozenMessage.trusted(**{**self.__dict__, **changes})
+
+
+class FrozenDict(dict):
+    """
+    FrozenDict: A read-only dict, used for the metadata of frozen messages.
+    It is a dict, so serializers handle it like the metadata of other messages; `copy()` returns a mutable dict.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The metadata of a frozen message is read-only, use with_metadata() instead")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+_FIELDS = tuple(Message.model_fields)
+_EMPTY_METADATA = FrozenDict()
+_new = object.__new__
+_set = object.__setattr__
+
+
+def _construct(cls: type, fields: Dict[str, Any]) -> Message:
+    """
+    Create a message from complete, valid fields without validation; faster than pydantic's model_construct().
+    :param cls: The message class.
+    :param fields: Values of all fields, in the order of their declaration.
+    :return: The message.
+    """
+    message = _new(cls)
+    _set(message, "__dict__", fields)
+    _set(message, "__pydantic_fields_set__", set(_FIELDS))
+    _set(message, "__pydantic_extra__", None)
+    _set(message, "__pydantic_private__", None)
+    return message
+
+
+class FrozenMessage(Message):
+    """
+    An immutable message, which can be shared by subscribers and threads without copying.
+    Its fields cannot be set and its metadata is a read-only FrozenDict. Changes are made to copies:
+    `with_metadata()` shares all other fields with the original, `clone()` returns a mutable Message.
+    Values within the metadata are not frozen and must not be changed.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    @field_validator("metadata", mode="after")
+    @classmethod
+    def _freeze_metadata(cls, metadata: Optional[Dict[str, Any]]) -> FrozenDict:
+        return FrozenDict(metadata) if metadata else _EMPTY_METADATA
+
+    @classmethod
+    def trusted(cls, *, source_type: str, source_id: str, content: str, agent_name: Optional[str] = None,
+                subject: Optional[str] = None, timestamp: Optional[str] = None,
+                metadata: Optional[Dict[str, Any]] = None) -> 'FrozenMessage':
+        """
+        Create a message without validation, for data taken from validated messages or produced by SOMA itself.
+        Data from outside, like records read from a broker, must be validated by the regular constructor.
+        :return: The message.
+        """
+        if type(metadata) is not FrozenDict:
+            metadata = FrozenDict(metadata) if metadata else _EMPTY_METADATA
+        return _construct(cls, {
+            "agent_name": agent_name,
+            "source_type": source_type,
+            "source_id": source_id,
+            "subject": subject,
+            "content": content,
+            "timestamp": timestamp,
+            "metadata": metadata,
+        })
+
+    def with_metadata(self, **updates: Any) -> 'FrozenMessage':
+        return _construct(FrozenMessage, {**self.__dict__, "metadata": FrozenDict({**self.metadata, **updates})})
+
+    def freeze(self, **changes: Any) -> 'FrozenMessage':
+        if not changes:
+            return self
+        return super().freeze(**changes)
+
+
+class LazyMessage(FrozenMessage):
+    """
+    A frozen message whose `content` field holds an encoded form of the content, like a reference or compressed
+    data, described by the metadata entry named by `encoding`. The content is decoded when it is accessed for
+    the first time. The fields keep the encoded form, so the message is serialized and published again encoded.
+    """
+    encoding: ClassVar[str]  # Name of the metadata entry describing the encoding
+    _source: Any = PrivateAttr(None)
+    _content: Optional[str] = PrivateAttr(None)
+
+    @classmethod
+    def wrap(cls, message: Message, source: Any = None) -> 'LazyMessage':
+        """
+        Wrap an encoded message.
+        :param message: The message, with encoded content and the metadata entry describing the encoding.
+        :param source: An object needed to decode the content, like a store.
+        :return: The lazy message.
+        """
+        lazy = cls.trusted(**message.__dict__)
+        _set(lazy, "__pydantic_private__", {"_source": source, "_content": None})
+        return lazy
+
+    @abstractmethod
+    def _decode(self, fields: Dict[str, Any]) -> str:
+        """
+        Decode the content.
+        :param fields: The fields of the message, holding the encoded form.
+        :return: The content.
+        """
+        ...
+
+    def __getattribute__(self, name: str):
+        if name != "content":
+            return super().__getattribute__(name)
+        private = super().__getattribute__("__pydantic_private__")
+        content = private["_content"]
+        if content is None:
+            content = self._decode(super().__getattribute__("__dict__"))
+            private["_content"] = content
+        return content
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        :return: True if the content was decoded.
+        """
+        return self.__pydantic_private__["_content"] is not None
+
+    def encoded(self) -> FrozenMessage:
+        """
+        :return: The message in its encoded form, without the decoded content.
+        """
+        return FrozenMessage.trusted(**self.__dict__)
+
+    def _resolved(self) -> Dict[str, Any]:
+        metadata = dict(self.metadata)
+        del metadata[self.encoding]
+        return {**self.__dict__, "content": self.content, "metadata": metadata}
+
+    def clone(self) -> Message:
+        return _construct(Message, self._resolved())
+
+    def freeze(self, **changes: Any) -> FrozenMessage:
+        if not changes:
+            return self
+        return FrozenMessage.trusted(**{**self._resolved(), **changes})
+
+    def with_metadata(self, **updates: Any) -> 'LazyMessage':
+        lazy = type(self).wrap(super().with_metadata(**updates), self._source)
+        lazy.__pydantic_private__["_content"] = self.__pydantic_private__["_content"]
+        return lazy
 
 
 class MessageConnector(ABC):
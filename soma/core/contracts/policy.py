@@ -6,4 +6,5 @@ class AccessPolicy(BaseModel):
     agent_name: str  # agent name
     allowed_publish_topics: List[str] = Field(default_factory=list)
     allowed_subscribe_topics: List[str] = Field(default_factory=list)
-    rate_limit_per_topic: Dict[str, int] = Field(default_factory=dict)
+    rate_limit_per_topic: Dict[str, int] = Field(default_factory=dict)  # max events/sec by topic
+    max_publish_rate_per_second: Optional[float] = None  # max events/sec across all topics
@@ -1,16 +1,30 @@
 # core/governance/policy_store.py
-import yaml
 from typing import Dict
 from soma.core.contracts.policy import AccessPolicy
+from soma.core.policy_manager import load_policies, merge_policies
 
 
 class PolicyStore:
+    """
+    PolicyStore: The policies of a YAML file by agent. The file is only read again when reload() is called;
+    use PolicyManager.watch() to follow changes of the file.
+    """
+
     def __init__(self, path: str):
-        with open(path, "r") as f:
-            config = yaml.safe_load(f)
-        self.policies: Dict[str, AccessPolicy] = {
-            entry["agent"]: AccessPolicy(**entry) for entry in config.get("policies", [])
-        }
+        self.path = path
+        self.policies: Dict[str, AccessPolicy] = {}
+        self.reload()
+
+    def reload(self):
+        """
+        Load the policies again. The new mapping is built first and then swapped in, so readers never see
+        a partially loaded store. If the file cannot be loaded, the error is raised and the current policies stay.
+        """
+        policies: Dict[str, AccessPolicy] = {}
+        for policy in load_policies(self.path):
+            known = policies.get(policy.agent_name)
+            policies[policy.agent_name] = merge_policies(known, policy) if known else policy
+        self.policies = policies
 
     def get_policy(self, agent: str) -> AccessPolicy | None:
         return self.policies.get(agent)
@@ -1,75 +1,290 @@
+import os
+import re
+import signal
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict
 
+import structlog
 import yaml
-from typing import List, Dict, Tuple
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional, Tuple
 from soma.core.contracts.policy import AccessPolicy
+from soma.core.rate_limiter import RateLimiter
+from soma.eventbus.topic_matcher import TopicMatcher, TopicPattern
 
-class PolicyManager:
-    def __init__(self, policies: List[AccessPolicy] = None):
-        self.policies: policies
-        self.policy_by_agent: Dict[str, AccessPolicy] = {
-            p.agent_name: p for p in policies
-        }
-        self.rate_limits: Dict[Tuple[str, str], int] = {}
-        self.usage: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+if TYPE_CHECKING:
+    from soma.core.rate_limit_store import RateLimitStore
+
+DIRECTIONS = ("publish", "subscribe")
+
+
+def load_policies(yaml_path: str) -> List[AccessPolicy]:
+    """
+    Load the policies from a YAML file, either a list of policies or a mapping with a `policies` list.
+    """
+    with open(yaml_path, "r", encoding="utf-8") as f:
+        raw = yaml.safe_load(f)
+    if isinstance(raw, dict):
+        raw = raw.get("policies") or []
+    return [AccessPolicy(**p) for p in raw or []]
+
+
+def merge_policies(first: AccessPolicy, second: AccessPolicy) -> AccessPolicy:
+    """
+    Merge two policies of the same agent: topics are combined, and the stricter rate limits apply.
+    """
+    rate_limits = dict(first.rate_limit_per_topic)
+    for topic, rate in second.rate_limit_per_topic.items():
+        rate_limits[topic] = min(rate, rate_limits.get(topic, rate))
+    max_rates = [r for r in (first.max_publish_rate_per_second, second.max_publish_rate_per_second)
+                 if r is not None]
+    return AccessPolicy(
+        agent_name=first.agent_name,
+        allowed_publish_topics=list(dict.fromkeys(first.allowed_publish_topics
+                                                  + second.allowed_publish_topics)),
+        allowed_subscribe_topics=list(dict.fromkeys(first.allowed_subscribe_topics
+                                                    + second.allowed_subscribe_topics)),
+        rate_limit_per_topic=rate_limits,
+        max_publish_rate_per_second=min(max_rates) if max_rates else None,
+    )
 
+
+class PolicySnapshot:
+    """
+    PolicySnapshot: The compiled state of a set of policies. It is not changed after it was built,
+    except for its decision cache, so checks can use it without a lock while a new snapshot is built.
+    """
+
+    def __init__(self, policies: List[AccessPolicy], clock: Callable[[], float] = time.monotonic,
+                 decision_cache_size: int = 10000, previous: Optional["PolicySnapshot"] = None,
+                 rate_limit_store: Optional["RateLimitStore"] = None, rate_limit_batch: float = 0.1):
+        """
+        :param policies: The access policies. Several policies of the same agent are merged.
+        :param clock: Function returning the current time in seconds, for the rate limits.
+        :param decision_cache_size: Maximum number of (agent, topic, direction) decisions kept.
+        :param previous: The snapshot replaced by this one, whose rate limit state is carried over.
+        :param rate_limit_store: Optional store sharing the rate limits with other processes.
+        :param rate_limit_batch: Share of a rate leased from the store at once.
+        """
+        self.policies = policies
+        self.policy_by_agent: Dict[str, AccessPolicy] = {}
         for policy in policies:
+            known = self.policy_by_agent.get(policy.agent_name)
+            self.policy_by_agent[policy.agent_name] = merge_policies(known, policy) if known else policy
+
+        self.rate_limits: Dict[Tuple[str, str], int] = {}  # rate = max events/sec
+        self.agent_rate_limits: Dict[str, float] = {}
+        for policy in self.policy_by_agent.values():
             for topic, rate in policy.rate_limit_per_topic.items():
-                self.rate_limits[(policy.agent_name, topic)] = rate  # rate = max events/sec
+                self.rate_limits[(policy.agent_name, topic)] = rate
+            if policy.max_publish_rate_per_second is not None:
+                self.agent_rate_limits[policy.agent_name] = policy.max_publish_rate_per_second
+        self.rate_limiter = RateLimiter(self.rate_limits, self.agent_rate_limits, clock=clock,
+                                        previous=previous.rate_limiter if previous else None,
+                                        store=rate_limit_store, batch=rate_limit_batch)
 
+        # Topics and patterns are compiled into a trie per direction, whose values are the allowed agents
+        self.matchers: Dict[str, TopicMatcher] = {direction: TopicMatcher(cache_size=0) for direction in DIRECTIONS}
+        for policy in self.policy_by_agent.values():
+            for topic in policy.allowed_publish_topics:
+                self.matchers["publish"].add(topic, policy.agent_name)
+            for topic in policy.allowed_subscribe_topics:
+                self.matchers["subscribe"].add(topic, policy.agent_name)
+        self.decision_cache_size = decision_cache_size
+        self.decisions: OrderedDict[Tuple[str, TopicPattern, str], bool] = OrderedDict()
 
-    @classmethod
-    def from_yaml(cls, yaml_path: str) -> "PolicyManager":
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            raw = yaml.safe_load(f)
-            policies = [AccessPolicy(**p) for p in raw]
-            return cls(policies)
+    def is_allowed(self, agent: str, topic: TopicPattern, direction: str) -> bool:
+        key = (agent, topic, direction)
+        decisions = self.decisions
+        decision = decisions.get(key)
+        if decision is not None:
+            try:
+                decisions.move_to_end(key)
+            except KeyError:  # Evicted by another thread meanwhile
+                pass
+            return decision
 
-    def is_allowed(self, agent: str, topic: str, direction: str) -> bool:
+        if TopicMatcher.is_pattern(topic):
+            decision = self._covers(agent, topic, direction)
+        else:
+            matcher = self.matchers.get(direction)
+            decision = matcher is not None and agent in matcher.match(topic)
+        # Each operation is atomic; concurrent inserts may evict an entry too many, which is harmless
+        decisions[key] = decision
+        if len(decisions) > self.decision_cache_size:
+            try:
+                decisions.popitem(last=False)
+            except KeyError:
+                pass
+        return decision
+
+    def _covers(self, agent: str, topic: TopicPattern, direction: str) -> bool:
         """
-        direction: 'publish' or 'subscribe'
+        Check a pattern subscription: an allowed topic must match every topic the pattern matches.
+        Regular expressions are only allowed if their pattern is listed as allowed topic.
+        :return: True if the pattern is allowed.
         """
         policy = self.policy_by_agent.get(agent)
-        if not policy:
+        if policy is None or direction not in DIRECTIONS:
             return False
+        allowed = policy.allowed_publish_topics if direction == "publish" else policy.allowed_subscribe_topics
+        if isinstance(topic, re.Pattern):
+            return topic.pattern in allowed
+        return any(TopicMatcher.covers(entry, topic) for entry in allowed)
 
-        if direction == "publish":
-            return topic in policy.allowed_publish_topics
-        elif direction == "subscribe":
-            return topic in policy.allowed_subscribe_topics
-        return False
 
-    def enforce_rate_limit(self, agent: str, topic: str) -> bool:
-        key = (agent, topic)
-        now = time.time()
-        rate = self.rate_limits.get(key)
+class PolicyManager:
+    def __init__(self, policies: List[AccessPolicy] = None, clock: Callable[[], float] = time.monotonic,
+                 decision_cache_size: int = 10000, path: Optional[str] = None,
+                 rate_limit_store: Optional["RateLimitStore"] = None, rate_limit_batch: float = 0.1):
+        """
+        :param policies: The access policies. Several policies of the same agent are merged.
+        :param clock: Function returning the current time in seconds, for the rate limits.
+        :param decision_cache_size: Maximum number of (agent, topic, direction) decisions kept.
+        :param path: The YAML file the policies were loaded from, for reload() and watch().
+        :param rate_limit_store: Optional store sharing the rate limits with other processes, e.g. a
+                                 SharedMemoryRateLimitStore or a NetworkRateLimitStore (default: none, each
+                                 manager enforces the limits on its own).
+        :param rate_limit_batch: Share of a rate leased from the store at once (default: 0.1).
+        """
+        self.clock = clock
+        self.decision_cache_size = decision_cache_size
+        self.path = path
+        self.rate_limit_store = rate_limit_store
+        self.rate_limit_batch = rate_limit_batch
+        self.logger = structlog.get_logger(__name__)
+        self.snapshot = self._snapshot(policies or [])
+        self._mtime = self._modified()
+        self._reload_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
 
-        if rate is None:
-            return True  # No rate limit configured
+    @classmethod
+    def from_yaml(cls, yaml_path: str, **kwargs) -> "PolicyManager":
+        """
+        Load the policies from a YAML file, either a list of policies or a mapping with a `policies` list.
+        Keyword arguments are passed to the constructor.
+        """
+        return cls(load_policies(yaml_path), path=yaml_path, **kwargs)
 
-        # Limit is in events/sec => window = 1 sec
-        window = 1.0
-        timestamps = self.usage[key]
-        timestamps = [ts for ts in timestamps if now - ts < window]
-        self.usage[key] = timestamps
+    def _snapshot(self, policies: List[AccessPolicy], previous: Optional[PolicySnapshot] = None) -> PolicySnapshot:
+        return PolicySnapshot(policies, self.clock, self.decision_cache_size, previous=previous,
+                              rate_limit_store=self.rate_limit_store, rate_limit_batch=self.rate_limit_batch)
 
-        if len(timestamps) < rate:
-            self.usage[key].append(now)
-            return True
-        return False
+    @property
+    def policies(self) -> List[AccessPolicy]:
+        return self.snapshot.policies
 
-    def get_usage_ratio(self, agent: str, topic: str) -> float:
-        key = (agent, topic)
-        now = time.time()
-        rate = self.rate_limits.get(key)
+    @property
+    def policy_by_agent(self) -> Dict[str, AccessPolicy]:
+        return self.snapshot.policy_by_agent
+
+    @property
+    def rate_limits(self) -> Dict[Tuple[str, str], int]:
+        return self.snapshot.rate_limits
 
-        if rate is None:
-            return 0.0
+    @property
+    def agent_rate_limits(self) -> Dict[str, float]:
+        return self.snapshot.agent_rate_limits
 
-        window = 1.0
-        timestamps = self.usage[key]
-        timestamps = [ts for ts in timestamps if now - ts < window]
-        self.usage[key] = timestamps
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return self.snapshot.rate_limiter
 
-        return min(len(timestamps) / rate, 1.0)
+    def reload(self, policies: Optional[List[AccessPolicy]] = None) -> bool:
+        """
+        Build a new snapshot of the policies and swap it in. Checks running meanwhile use the previous snapshot;
+        the rate limit state of unchanged limits is carried over.
+        :param policies: The new policies, or None to load them from `path` again.
+        :return: True if the policies were replaced, False if the file could not be loaded.
+        """
+        with self._reload_lock:
+            if policies is None:
+                if self.path is None:
+                    raise ValueError("Cannot reload policies that were not loaded from a file")
+                mtime = self._modified()
+                try:
+                    policies = load_policies(self.path)
+                except Exception as e:
+                    self.logger.error("Failed to reload policies, keeping the current ones", path=self.path,
+                                      error=str(e))
+                    self._mtime = mtime
+                    return False
+                self._mtime = mtime
+            # A single attribute assignment, so checks see either the old or the new snapshot
+            self.snapshot = self._snapshot(policies, previous=self.snapshot)
+        self.logger.info("Policies reloaded", path=self.path, agents=len(self.snapshot.policy_by_agent))
+        return True
+
+    def _modified(self) -> Optional[float]:
+        if self.path is None:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, interval: float = 1.0, signum: Optional[int] = None):
+        """
+        Reload the policies in a background thread when the file changes, polling every `interval` seconds.
+        :param interval: Time in seconds between two checks of the modification time.
+        :param signum: Optional signal, e.g. `signal.SIGHUP`, that triggers a reload immediately. Must be
+                       called from the main thread to install the signal handler.
+        :return: None
+        """
+        if self.path is None:
+            raise ValueError("Cannot watch policies that were not loaded from a file")
+        if signum is not None:
+            signal.signal(signum, lambda *_: self._wakeup.set())
+        if self._watcher is None or not self._watcher.is_alive():
+            self._stopped.clear()
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True,
+                                             name="policy-watcher")
+            self._watcher.start()
+
+    def stop_watching(self):
+        """
+        Stop the background thread started by watch().
+        :return: None
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval: float):
+        while not self._stopped.is_set():
+            signalled = self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            if signalled or self._modified() != self._mtime:
+                self.reload()
+
+    def is_allowed(self, agent: str, topic: TopicPattern, direction: str) -> bool:
+        """
+        direction: 'publish' or 'subscribe'
+        Allowed topics may be patterns: `*` matches exactly one segment, `#` zero or more segments.
+        A pattern subscription is allowed if an allowed topic matches every topic the pattern matches, a regular
+        expression only if its pattern is listed as allowed topic.
+        Decisions are kept in a bounded LRU cache, so repeated checks cost a dictionary lookup.
+        """
+        return self.snapshot.is_allowed(agent, topic, direction)
+
+    def enforce_rate_limit(self, agent: str, topic: str) -> bool:
+        return self.snapshot.rate_limiter.acquire(agent, topic, 1) == 1
+
+    def enforce_rate_limit_batch(self, agent: str, topic: str, count: int) -> int:
+        """
+        Admit up to `count` events at once, limited by the topic's and the agent's token buckets.
+        Returns the number of events that may be published without exceeding the rate limit.
+        """
+        return self.snapshot.rate_limiter.acquire(agent, topic, count)
+
+    def get_usage_ratio(self, agent: str, topic: str) -> float:
+        """
+        Returns the share of the burst capacity in use, 1.0 when the agent is rate limited on the topic.
+        """
+        return self.snapshot.rate_limiter.usage(agent, topic)
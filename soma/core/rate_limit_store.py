@@ -0,0 +1,335 @@
+# Rate Limit Store: Token bucket state shared by the rate limiters of several threads, processes or hosts.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import fcntl
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Tuple
+
+import structlog
+
+from soma.core.rate_limiter import TokenBucket
+from soma.eventbus.shm_ring import attach_segment
+
+
+class RateLimitStore(ABC):
+    """
+    RateLimitStore: Keeps token buckets by key, so several rate limiters share a limit.
+    Buckets are created on first use, full, with the capacity of a TokenBucket of the given rate.
+    """
+
+    @abstractmethod
+    def take(self, key: str, rate: float, count: int) -> int:
+        """
+        Take up to `count` tokens from a bucket.
+        :param key: The key of the bucket.
+        :param rate: The rate of the bucket in tokens per second; a changed rate replaces the previous one.
+        :param count: The number of tokens wanted.
+        :return: The number of tokens taken.
+        """
+        ...
+
+    @abstractmethod
+    def usage(self, key: str, rate: float) -> float:
+        """
+        :return: The share of the capacity of a bucket in use, from 0.0 to 1.0.
+        """
+        ...
+
+    def close(self):
+        pass
+
+
+class LocalRateLimitStore(RateLimitStore):
+    """
+    LocalRateLimitStore: Buckets in the memory of this process, shared by its rate limiters.
+    Also serves the buckets of a RateLimitServer.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """
+        :param clock: Function returning the current time in seconds.
+        """
+        self.clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str, rate: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, now=now)
+        elif bucket.rate != rate:
+            bucket.refill(now)
+            capacity = TokenBucket(rate).capacity
+            bucket.rate, bucket.capacity, bucket.tokens = float(rate), capacity, min(bucket.tokens, capacity)
+        return bucket
+
+    def take(self, key: str, rate: float, count: int) -> int:
+        with self._lock:
+            now = self.clock()
+            bucket = self._bucket(key, rate, now)
+            granted = max(min(count, bucket.available(now)), 0)
+            bucket.tokens -= granted
+            return granted
+
+    def usage(self, key: str, rate: float) -> float:
+        with self._lock:
+            now = self.clock()
+            return self._bucket(key, rate, now).usage(now)
+
+
+_SLOT = struct.Struct("<Qddd")  # key hash, rate, tokens, updated
+_SLOT_SIZE = 32
+
+
+class SharedMemoryRateLimitStore(RateLimitStore):
+    """
+    SharedMemoryRateLimitStore: Buckets in a `multiprocessing.shared_memory` segment, shared by the processes
+    of a host. The segment is an open-addressing hash table of fixed-size slots, keyed by a 64-bit hash of
+    the bucket key. Processes serialize their updates with an exclusive `flock()` on a lock file next to the
+    segment, threads of a process with a lock. Times are taken from `time.monotonic()`, which is system-wide.
+    """
+
+    def __init__(self, name: str, slots: int = 4096, create: bool = False):
+        """
+        Create or attach to a store.
+        :param name: The name of the shared memory segment.
+        :param slots: Maximum number of buckets. Only used when creating the segment.
+        :param create: If True, the segment is created, or reused if it exists, and removed by close().
+        """
+        self.name = name
+        self.owner = create
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=slots * _SLOT_SIZE)
+            except FileExistsError:
+                self.shm = attach_segment(name)
+        else:
+            self.shm = attach_segment(name)
+        self.buf = self.shm.buf
+        self.slots = self.shm.size // _SLOT_SIZE
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(self._lock_path, "a+b")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    def _slot(self, key: str, rate: float, now: float) -> Tuple[int, TokenBucket]:
+        """
+        Find or claim the slot of a key. Must be called with the locks held.
+        :return: The offset of the slot and its bucket.
+        :raises RuntimeError: If all slots are in use.
+        """
+        hashed = self._hash(key)
+        start = hashed % self.slots
+        for i in range(self.slots):
+            offset = (start + i) % self.slots * _SLOT_SIZE
+            slot_hash, slot_rate, tokens, updated = _SLOT.unpack_from(self.buf, offset)
+            if slot_hash == hashed:
+                bucket = TokenBucket(slot_rate, now=updated)
+                bucket.tokens = tokens
+                if slot_rate != rate:
+                    bucket.refill(now)
+                    bucket.rate, bucket.capacity = float(rate), TokenBucket(rate).capacity
+                    bucket.tokens = min(bucket.tokens, bucket.capacity)
+                return offset, bucket
+            if slot_hash == 0:
+                return offset, TokenBucket(rate, now=now)
+        raise RuntimeError(f"Rate limit store '{self.name}' is full ({self.slots} buckets)")
+
+    def _update(self, key: str, rate: float, count: int) -> Tuple[int, float]:
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                now = time.monotonic()
+                offset, bucket = self._slot(key, rate, now)
+                granted = max(min(count, bucket.available(now)), 0)
+                bucket.tokens -= granted
+                _SLOT.pack_into(self.buf, offset, self._hash(key), bucket.rate, bucket.tokens, bucket.updated)
+                return granted, bucket.usage(now)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def take(self, key: str, rate: float, count: int) -> int:
+        return self._update(key, rate, count)[0]
+
+    def usage(self, key: str, rate: float) -> float:
+        return self._update(key, rate, 0)[1]
+
+    def close(self):
+        """
+        Detach from the segment, and remove it and its lock file if this instance created it.
+        :return: None
+        """
+        self._lock_file.close()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            for remove in (self.shm.unlink, lambda: os.unlink(self._lock_path)):
+                try:
+                    remove()
+                except FileNotFoundError:
+                    pass
+
+
+class NetworkRateLimitStore(RateLimitStore):
+    """
+    NetworkRateLimitStore: Buckets kept by a RateLimitServer, shared by the processes of several hosts.
+    Requests and responses are JSON lines over a persistent TCP connection, which is reopened once per
+    request if it broke. After the server could not be reached, no requests are sent for `backoff` seconds,
+    doubled with each further failure, so callers do not wait for the timeout on every check.
+    """
+
+    def __init__(self, address: Tuple[str, int], timeout: float = 1.0, fail_open: bool = False,
+                 backoff: float = 1.0, max_backoff: float = 30.0, **kwargs):
+        """
+        :param address: Host and port of the server.
+        :param timeout: Maximum time in seconds to wait for the server.
+        :param fail_open: If True, tokens are granted while the server cannot be reached; otherwise, they are
+                          denied.
+        :param backoff: Time in seconds no requests are sent after the server could not be reached.
+        :param max_backoff: Maximum time in seconds between two attempts to reach the server.
+        :param logger: Optional structlog logger.
+        """
+        self.address = address
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = kwargs.get("logger", structlog.get_logger(__name__))
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._delay = 0.0  # Current back-off, 0 while the server is reachable
+        self._retry_at = 0.0
+
+    def _request(self, request: dict) -> dict:
+        """
+        Send a request and wait for the response.
+        :return: The response.
+        :raises OSError: If the server cannot be reached, or is not asked again yet.
+        :raises ValueError: If the server rejected the request.
+        """
+        data = (json.dumps(request) + "\n").encode("utf-8")
+        with self._lock:
+            if self._socket is None and time.monotonic() < self._retry_at:
+                raise ConnectionError("Rate limit server unavailable")
+            for attempt in (1, 2):
+                connected = self._socket is not None
+                try:
+                    if self._socket is None:
+                        self._socket = socket.create_connection(self.address, timeout=self.timeout)
+                        self._reader = self._socket.makefile("rb")
+                    self._socket.sendall(data)
+                    line = self._reader.readline()
+                    if not line:
+                        raise ConnectionError("Connection closed by the rate limit server")
+                    response = json.loads(line)
+                except OSError as e:
+                    self._disconnect()
+                    # A broken connection is reopened once; a new one that failed is not tried again
+                    if attempt == 1 and connected:
+                        continue
+                    self._delay = min(self._delay * 2 or self.backoff, self.max_backoff)
+                    self._retry_at = time.monotonic() + self._delay
+                    self.logger.warning("Rate limit server unavailable", address=self.address, error=str(e),
+                                        retry_in=self._delay, fail_open=self.fail_open)
+                    raise
+                self._delay = 0.0
+                if "error" in response:
+                    raise ValueError(f"Rate limit server: {response['error']}")
+                return response
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+    def take(self, key: str, rate: float, count: int) -> int:
+        try:
+            return self._request({"op": "take", "key": key, "rate": rate, "count": count})["granted"]
+        except OSError:
+            return count if self.fail_open else 0
+
+    def usage(self, key: str, rate: float) -> float:
+        try:
+            return self._request({"op": "usage", "key": key, "rate": rate})["usage"]
+        except OSError:
+            return 0.0 if self.fail_open else 1.0
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store: RateLimitStore = self.server.store
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request["op"] == "take":
+                    response = {"granted": store.take(request["key"], request["rate"], request["count"])}
+                elif request["op"] == "usage":
+                    response = {"usage": store.usage(request["key"], request["rate"])}
+                else:
+                    response = {"error": f"Unknown operation '{request['op']}'"}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class RateLimitServer(socketserver.ThreadingTCPServer):
+    """
+    RateLimitServer: Serves the buckets of a store, usually a LocalRateLimitStore, to NetworkRateLimitStores.
+    Started in a background thread, it also stands in for a separate server in tests and single-host setups.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int] = ("127.0.0.1", 0), store: Optional[RateLimitStore] = None):
+        """
+        :param address: Host and port to listen on; port 0 picks a free port, see `server_address`.
+        :param store: The store serving the buckets (default: a new LocalRateLimitStore).
+        """
+        super().__init__(address, _Handler)
+        self.store = store or LocalRateLimitStore()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        :return: None
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="rate-limit-server")
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving and close the listening socket.
+        :return: None
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,252 @@
+# Rate Limiter: Token buckets per (agent, topic) and per agent, with constant-time checks.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    from soma.core.rate_limit_store import RateLimitStore
+
+
+class TokenBucket:
+    """
+    TokenBucket: Admits events at a sustained `rate` per second, with bursts of up to `capacity` events.
+    Each event takes a token. Tokens are refilled lazily from the time elapsed since the last call, so a
+    check costs the same, however many events were admitted before. Not thread-safe by itself.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, now: float = 0.0):
+        """
+        Initialize a full bucket.
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens (default: one second worth of tokens, but at least one).
+        :param now: The current time, as returned by the clock of the limiter.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate, 1.0) if self.rate > 0 else 0.0
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        """
+        Add the tokens accrued since the last call.
+        :param now: The current time.
+        :return: The number of tokens available.
+        """
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+    def available(self, now: float, wanted: int = 0) -> int:
+        """
+        :param now: The current time.
+        :param wanted: The number of tokens about to be taken; not used by a local bucket.
+        :return: The number of whole tokens available.
+        """
+        # The epsilon absorbs rounding errors of the refill, e.g. 2.9999999 tokens after 0.6 s at 5/s
+        return int(self.refill(now) + 1e-9)
+
+    def usage(self, now: float) -> float:
+        """
+        :return: The share of the capacity in use, from 0.0 (full bucket) to 1.0 (empty bucket).
+        """
+        if self.capacity <= 0:
+            return 1.0
+        return min(max(1.0 - self.refill(now) / self.capacity, 0.0), 1.0)
+
+
+class LeasedBucket:
+    """
+    LeasedBucket: Tokens taken in advance from a bucket in a RateLimitStore, shared with other processes.
+    When the leased tokens do not cover a request, at least `batch` tokens are taken from the store at once,
+    so the store is not involved in every check. Leased tokens expire after `lease_ttl` seconds, so an idle
+    process does not keep them. If the store is short of tokens, it is not asked again before the missing
+    tokens were refilled. Not thread-safe by itself.
+    """
+    __slots__ = ("store", "key", "rate", "capacity", "batch", "lease_ttl", "tokens", "updated", "retry_at")
+
+    def __init__(self, store: "RateLimitStore", key: str, rate: float, batch: float = 0.1, lease_ttl: float = 1.0,
+                 now: float = 0.0):
+        """
+        Initialize an empty lease.
+        :param store: The store holding the bucket.
+        :param key: The key of the bucket in the store.
+        :param rate: Tokens added per second.
+        :param batch: Share of the rate taken from the store at once, at least one token.
+        :param lease_ttl: Time in seconds after which leased tokens expire.
+        :param now: The current time, as returned by the clock of the limiter.
+        """
+        self.store = store
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = TokenBucket(rate).capacity
+        self.batch = max(int(self.rate * batch), 1)
+        self.lease_ttl = lease_ttl
+        self.tokens = 0.0
+        self.updated = now
+        self.retry_at = now
+
+    def available(self, now: float, wanted: int = 1) -> int:
+        """
+        :param now: The current time.
+        :param wanted: The number of tokens about to be taken; more tokens are leased if they are not covered.
+        :return: The number of whole tokens leased.
+        """
+        if now - self.updated > self.lease_ttl:
+            self.tokens = 0.0
+        if self.tokens < wanted and now >= self.retry_at:
+            requested = max(wanted - int(self.tokens), self.batch)
+            granted = self.store.take(self.key, self.rate, requested)
+            self.tokens += granted
+            self.updated = now
+            if granted < requested:
+                # Ask again when the store may have refilled the missing tokens
+                self.retry_at = now + ((requested - granted) / self.rate if self.rate > 0 else self.lease_ttl)
+        return int(self.tokens)
+
+    def usage(self, now: float) -> float:
+        """
+        Estimate the usage of the shared bucket from the last lease, without asking the store: if the store was
+        short of tokens then, the bucket was empty and has refilled at the rate since. Otherwise, it is not known
+        to be in use.
+        :return: The share of the capacity of the shared bucket in use.
+        """
+        if self.capacity <= 0:
+            return 1.0
+        if self.retry_at <= self.updated:
+            return 0.0
+        return min(max(1.0 - (now - self.updated) * self.rate / self.capacity, 0.0), 1.0)
+
+
+Bucket = Union[TokenBucket, LeasedBucket]
+
+
+class _AgentLimits:
+    """
+    The buckets of an agent: one for all its topics, and one per limited topic. A single lock guards them,
+    so events taken from both buckets are taken atomically.
+    """
+    __slots__ = ("lock", "bucket", "topics")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bucket: Optional[Bucket] = None
+        self.topics: Dict[str, Bucket] = {}
+
+
+class RateLimiter:
+    """
+    RateLimiter: Limits the publish rate per (agent, topic) and, optionally, per agent across all topics.
+    Buckets exist only for configured limits, so the state does not grow with the topics used. Checks for
+    other keys return without taking a lock. Checks are thread-safe; each takes the lock of the agent.
+    By default, the buckets live in this limiter. With a RateLimitStore, they are shared with the limiters of
+    other processes, and tokens are leased from the store in batches.
+    """
+
+    def __init__(self, topic_rates: Optional[Dict[Tuple[str, str], float]] = None,
+                 agent_rates: Optional[Dict[str, float]] = None, clock: Callable[[], float] = time.monotonic,
+                 previous: Optional["RateLimiter"] = None, store: Optional["RateLimitStore"] = None,
+                 batch: float = 0.1, lease_ttl: float = 1.0):
+        """
+        Initialize the limiter with full buckets.
+        :param topic_rates: Maximum events per second by (agent, topic).
+        :param agent_rates: Maximum events per second by agent, across all topics.
+        :param clock: Function returning the current time in seconds.
+        :param previous: A limiter whose state is carried over: agents with unchanged limits share their
+                         buckets with it, and buckets with an unchanged rate keep their tokens.
+        :param store: Optional store sharing the buckets with other processes.
+        :param batch: Share of a rate leased from the store at once (default: 0.1, i.e. 100 ms worth of tokens).
+        :param lease_ttl: Time in seconds after which leased tokens expire.
+        """
+        self.clock = clock
+        self.store = store
+        self._limits: Dict[str, _AgentLimits] = {}
+        now = clock()
+
+        def bucket(key: str, rate: float) -> Bucket:
+            if store is None:
+                return TokenBucket(rate, now=now)
+            return LeasedBucket(store, key, rate, batch=batch, lease_ttl=lease_ttl, now=now)
+
+        for (agent, topic), rate in (topic_rates or {}).items():
+            self._agent(agent).topics[topic] = bucket(f"{agent}\0{topic}", rate)
+        for agent, rate in (agent_rates or {}).items():
+            self._agent(agent).bucket = bucket(agent, rate)
+        if previous is not None and previous.store is store:
+            self._carry_over(previous)
+
+    @staticmethod
+    def _rates(limits: _AgentLimits) -> Tuple[Dict[str, float], Optional[float]]:
+        return ({topic: bucket.rate for topic, bucket in limits.topics.items()},
+                limits.bucket.rate if limits.bucket is not None else None)
+
+    def _carry_over(self, previous: "RateLimiter"):
+        """
+        Take over the state of another limiter for unchanged limits.
+        :return: None
+        """
+        for agent, limits in self._limits.items():
+            known = previous._limits.get(agent)
+            if known is None:
+                continue
+            if self._rates(known) == self._rates(limits):
+                # Shared, so checks still running against the previous limiter count as well
+                self._limits[agent] = known
+                continue
+            with known.lock:
+                pairs = [(limits.bucket, known.bucket)] + [(bucket, known.topics.get(topic))
+                                                          for topic, bucket in limits.topics.items()]
+                for bucket, old in pairs:
+                    if bucket is not None and old is not None and old.rate == bucket.rate:
+                        bucket.tokens, bucket.updated = old.tokens, old.updated
+
+    def _agent(self, agent: str) -> _AgentLimits:
+        limits = self._limits.get(agent)
+        if limits is None:
+            limits = self._limits[agent] = _AgentLimits()
+        return limits
+
+    def acquire(self, agent: str, topic: str, count: int = 1) -> int:
+        """
+        Take up to `count` tokens from the buckets of the agent and the topic.
+        :param agent: The publishing agent.
+        :param topic: The topic.
+        :param count: The number of events to publish.
+        :return: The number of events that may be published without exceeding a limit.
+        """
+        limits = self._limits.get(agent)
+        if limits is None:
+            return count
+        bucket = limits.topics.get(topic)
+        if bucket is None and limits.bucket is None:
+            return count
+        now = self.clock()
+        with limits.lock:
+            granted = count
+            if bucket is not None:
+                granted = min(granted, bucket.available(now, granted))
+            if limits.bucket is not None:
+                granted = min(granted, limits.bucket.available(now, granted))
+            if granted > 0:
+                if bucket is not None:
+                    bucket.tokens -= granted
+                if limits.bucket is not None:
+                    limits.bucket.tokens -= granted
+        return max(granted, 0)
+
+    def usage(self, agent: str, topic: str) -> float:
+        """
+        :return: The usage of the more exhausted bucket of the agent and the topic, 0.0 if neither is limited.
+        """
+        limits = self._limits.get(agent)
+        if limits is None:
+            return 0.0
+        now = self.clock()
+        with limits.lock:
+            buckets = [b for b in (limits.topics.get(topic), limits.bucket) if b is not None]
+            return max((b.usage(now) for b in buckets), default=0.0)
@@ -0,0 +1,353 @@
+# Asyncio Event Bus Implementation
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import asyncio
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import structlog
+
+from soma.core.contracts.event_bus import EventBus, Subscriber, EventProducer, EventSubscriber, AsyncEventSubscriber
+from soma.core.contracts.message import Message
+from soma.eventbus.dedupe import Deduplicator
+from soma.eventbus.metrics import EVENT_LATENCY, EVENT_COUNT, EVENT_ERRORS
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.timing_wheel import Scheduler
+from soma.eventbus.topic_matcher import TopicMatcher, TopicPattern
+
+
+class _Subscription:
+    """
+    A subscriber together with its bounded queue of pending messages and the workers draining it.
+    """
+
+    def __init__(self, handler: Subscriber, concurrency: int, max_pending: int):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)  # (topic, message, attempt)
+        self.workers: List[asyncio.Task] = []
+        self.name = getattr(handler, "__name__", None) or getattr(handler, "name", "unknown")
+        self.is_async = inspect.iscoroutinefunction(getattr(handler, "handle", handler))
+
+
+class AsyncEventBus(EventBus):
+    """
+    AsyncEventBus: An event bus running on an asyncio event loop.
+    The loop runs in a background thread, so the bus can be used from synchronous code like the other buses.
+    Subscribers with an `async def handle` (or async callables) run on the loop, synchronous subscribers are
+    bridged through a thread pool executor. The number of concurrently handled messages and the number of messages
+    waiting for a subscriber are bounded per subscriber.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize the AsyncEventBus with empty queues and subscribers.
+        :param policy_manager:
+        :param concurrency: Default maximum number of messages handled concurrently per subscriber (default: 10).
+        :param max_pending: Maximum number of messages waiting for a subscriber (default: 1000). A subscriber with a
+                            full backlog holds up the consumers of its topics, so messages wait in the topic queues.
+        :param executor_workers: Number of threads used to run synchronous subscribers (default: 10).
+        :param retry: Default RetryPolicy of subscribers (default: None, failed messages are dropped).
+        :param dead_letter_prefix: Prefix of the dead-letter topics (default: "dead_letter.").
+        :param scheduler: Scheduler for retries and delayed messages (default: the shared scheduler).
+        :param dedupe: Optional Deduplicator dropping messages whose source_id was consumed on the topic before.
+                       Messages are recorded when they are taken from the queue.
+        """
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.subscribers: Dict[str, List[Subscriber]] = {}
+        self.topic_matcher = TopicMatcher()
+        self.subscriptions: Dict[int, _Subscription] = {}  # Backlogs and workers, by id of the subscriber
+        self.running = False
+        self.policy_manager = kwargs.get("policy_manager", None)
+        self.logger = kwargs.get("logger", structlog.get_logger(__name__))
+        self.concurrency: int = kwargs.get("concurrency", 10)
+        self.max_pending: int = kwargs.get("max_pending", 1000)
+        self.executor_workers: int = kwargs.get("executor_workers", 10)
+        self.retry: Optional[RetryPolicy] = kwargs.get("retry", None)
+        self.retry_policies: Dict[int, RetryPolicy] = {}
+        self.dead_letter_prefix: str = kwargs.get("dead_letter_prefix", "dead_letter.")
+        self.scheduler: Optional[Scheduler] = kwargs.get("scheduler", None)
+        self.deduplicator: Optional[Deduplicator] = kwargs.get("dedupe", None)
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._consumers: Dict[str, asyncio.Task] = {}
+        self._waiting: set = set()  # Retries waiting for room in the backlog of their subscriber
+
+        self.logger.info("AsyncEventBus initialized", policy_manager=self.policy_manager,
+                         concurrency=self.concurrency, executor_workers=self.executor_workers)
+
+    def publish(self, topic: str, message: Message, key: Optional[str] = None, delay: Optional[float] = None):
+        """
+        Publish a message to a specific topic. Safe to call from any thread, including handlers running on the loop.
+        :param topic: The topic to which the message should be published.
+        :param message: The message to be published.
+        :param key: Optional key for the message, used for routing or identification purposes.
+        :param delay: Optional time in seconds after which the message is published.
+        :return: None
+        """
+        policy_violation = self.check_publish_policy(topic, message)
+        if policy_violation:
+            self.logger.warning(policy_violation, topic=topic, message=message)
+            return
+
+        if delay:
+            self._publish_later(delay, topic, message, key)
+            return
+        self._call(self._enqueue, topic, [message])
+
+    def _publish_unchecked(self, topic: str, message: Message, key: Optional[str] = None):
+        self._call(self._enqueue, topic, [message])
+
+    def publish_many(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Publish a batch of messages to a specific topic, handing the whole batch to the loop at once.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :param keys: Optional keys for the messages, in the same order as the messages.
+        :return: None
+        """
+        self._batch_keys(messages, keys)
+        admitted, violations = self.check_publish_policy_many(topic, messages)
+        for policy_violation in violations:
+            self.logger.warning(policy_violation, topic=topic)
+        if admitted:
+            self._call(self._enqueue, topic, [messages[i] for i in admitted])
+
+    def subscribe(self, topic: TopicPattern, handler: Subscriber, concurrency: Optional[int] = None,
+                  retry: Optional[RetryPolicy] = None):
+        """
+        Subscribe to a specific topic. Subscriptions added after start() are consumed immediately.
+        :param topic: The topic to which the handler should subscribe, or a pattern matching several topics.
+        :param handler: An AsyncEventSubscriber, an EventSubscriber, or a sync or async callable.
+        :param concurrency: Maximum number of messages handled concurrently by this subscriber.
+        :param retry: Optional retry policy for this subscriber, overriding the retry policy of the bus.
+        :return: None
+        """
+        policy_violation = self.check_subscribe_policy(topic, handler)
+        if policy_violation:
+            self.logger.warning(policy_violation, topic=topic, handler=handler)
+            return
+
+        self.subscriptions.setdefault(id(handler),
+                                      _Subscription(handler, concurrency or self.concurrency, self.max_pending))
+        self._add_subscriber(topic, handler, retry)
+
+        # Auto-inject EventBus into producer agents
+        if isinstance(handler, EventProducer):
+            if handler.event_bus is None:
+                handler.event_bus = self
+
+        if self.running:
+            for name in (list(self.queues) if TopicMatcher.is_pattern(topic) else [topic]):
+                self._call(self._start_consumer, name)
+
+    def start(self):
+        """
+        Start the event loop thread and a consumer task for each subscribed topic.
+        :return: None
+        """
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="soma-async-sync")
+        self.loop = loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+            loop.close()
+
+        # Queues bind to the loop they are first used on, so replace them when restarting
+        for topic, q in list(self.queues.items()):
+            self.queues[topic] = self._requeue(q, asyncio.Queue())
+        for subscription in self.subscriptions.values():
+            subscription.queue = self._requeue(subscription.queue, asyncio.Queue(self.max_pending))
+            subscription.workers = []
+
+        self._thread = threading.Thread(target=run, daemon=True, name="soma-async-bus")
+        self._thread.start()
+        ready.wait()
+
+        for topic in list(self.subscribers) + list(self.queues):
+            self._call(self._start_consumer, topic)
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stop the consumers, wait up to `timeout` seconds for in-flight handlers, and stop the event loop.
+        :param timeout: Maximum time in seconds to wait for in-flight handlers.
+        :return: None
+        """
+        if not self.running:
+            return
+        self.running = False
+
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(timeout), self.loop)
+        try:
+            future.result(timeout + 1.0)
+        except Exception as e:
+            self.logger.warning("AsyncEventBus did not shut down cleanly", error=str(e))
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1.0)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._stop_executor()
+        self._thread = None
+        self.loop = None
+
+    @staticmethod
+    def _requeue(q: asyncio.Queue, fresh: asyncio.Queue) -> asyncio.Queue:
+        """
+        Move the messages left in a queue into a fresh one of the same size.
+        :return: The fresh queue.
+        """
+        while not q.empty():
+            fresh.put_nowait(q.get_nowait())
+        return fresh
+
+    def _call(self, callback, *args):
+        """
+        Run a callback on the event loop, directly if called from the loop thread.
+        :return: None
+        """
+        if self.loop is not None and self.loop.is_running() and self._thread is not threading.current_thread():
+            self.loop.call_soon_threadsafe(callback, *args)
+        else:
+            callback(*args)
+
+    def _enqueue(self, topic: str, messages: List[Message]):
+        """
+        Put messages into the queue of a topic. Must run on the loop thread, or before the loop was started.
+        :return: None
+        """
+        if topic not in self.queues:
+            self.queues[topic] = asyncio.Queue()
+            # Topics created at runtime may match pattern subscriptions
+            if self.running and self.loop is not None:
+                self._start_consumer(topic)
+        for message in messages:
+            self.queues[topic].put_nowait(message)
+
+    def _start_consumer(self, topic: str):
+        """
+        Create the consumer task of a topic if it does not exist yet. Must run on the loop thread.
+        :return: None
+        """
+        if not self.running or topic in self._consumers or not self.subscribers_for(topic):
+            return
+        if topic not in self.queues:
+            self.queues[topic] = asyncio.Queue()
+        self._consumers[topic] = self.loop.create_task(self._consume(topic))
+
+    async def _consume(self, topic: str):
+        """
+        Take messages from a topic queue and put them into the backlog of each subscriber.
+        A saturated subscriber does not hold up the others until its backlog is full.
+        :param topic: The topic from which to consume messages.
+        :return: None
+        """
+        q = self.queues[topic]
+        while True:
+            msg = await q.get()
+            if self.deduplicator is not None and self.deduplicator.is_duplicate(msg, scope=topic):
+                continue
+            for handler in self.subscribers_for(topic):
+                subscription = self.subscriptions[id(handler)]
+                self._start_workers(subscription)
+                await subscription.queue.put((topic, msg, 1))
+
+    def _redeliver(self, topic: str, subscriber: Subscriber, msg: Message, attempt: int, completion=None):
+        """
+        Run another delivery attempt on the loop, through the backlog of the subscriber.
+        :return: None
+        """
+        if not self.running:
+            self.logger.warning("AsyncEventBus is stopped, dropping retry", topic=topic, attempt=attempt)
+            return
+        self._call(self._retry, topic, self.subscriptions[id(subscriber)], msg, attempt)
+
+    def _retry(self, topic: str, subscription: _Subscription, msg: Message, attempt: int):
+        """
+        Put a retry into the backlog of a subscriber, waiting in a task while the backlog is full. Must run on the
+        loop thread.
+        :return: None
+        """
+        self._start_workers(subscription)
+        if not subscription.queue.full():
+            subscription.queue.put_nowait((topic, msg, attempt))
+            return
+        task = self.loop.create_task(subscription.queue.put((topic, msg, attempt)))
+        self._waiting.add(task)
+        task.add_done_callback(self._waiting.discard)
+
+    def _start_workers(self, subscription: _Subscription):
+        """
+        Create the worker tasks of a subscriber if they do not exist yet. Must run on the loop thread.
+        :return: None
+        """
+        if not subscription.workers:
+            subscription.workers = [self.loop.create_task(self._work(subscription))
+                                    for _ in range(subscription.concurrency)]
+
+    async def _work(self, subscription: _Subscription):
+        """
+        Handle the messages of the backlog of a subscriber, one at a time.
+        :return: None
+        """
+        q = subscription.queue
+        while True:
+            topic, msg, attempt = await q.get()
+            try:
+                await self._handle(topic, subscription, msg, attempt)
+            finally:
+                q.task_done()
+
+    async def _handle(self, topic: str, subscription: _Subscription, msg: Message, attempt: int = 1):
+        """
+        Invoke a single subscriber with a message and record metrics.
+        :return: None
+        """
+        started = time.perf_counter()
+        try:
+            handler = subscription.handler
+            if isinstance(handler, (EventSubscriber, AsyncEventSubscriber)):
+                handler = handler.handle
+            if subscription.is_async:
+                await handler(msg)
+            else:
+                await self.loop.run_in_executor(self.executor, handler, msg)
+
+            EVENT_LATENCY.labels(topic=topic, agent=subscription.name).observe(time.perf_counter() - started)
+            EVENT_COUNT.labels(topic=topic, agent=subscription.name).inc()
+        except Exception as e:
+            self.logger.error("Handler failed", topic=topic, agent=subscription.name, error=str(e))
+            EVENT_ERRORS.labels(topic=topic, agent=subscription.name).inc()
+            self._handler_failed(topic, subscription.handler, msg, attempt, e)
+
+    async def _shutdown(self, timeout: float):
+        """
+        Cancel the consumer tasks and retries waiting for room, wait for the backlogs of the subscribers to be
+        handled, and cancel the workers.
+        :return: None
+        """
+        for task in list(self._consumers.values()) + list(self._waiting):
+            task.cancel()
+        await asyncio.gather(*self._consumers.values(), *self._waiting, return_exceptions=True)
+        self._consumers.clear()
+
+        subscriptions = [s for s in self.subscriptions.values() if s.workers]
+        if subscriptions:
+            drained = [self.loop.create_task(s.queue.join()) for s in subscriptions]
+            await asyncio.wait(drained, timeout=timeout)
+            workers = [task for s in subscriptions for task in s.workers] + drained
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for subscription in subscriptions:
+                subscription.workers = []
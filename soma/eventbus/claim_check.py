@@ -0,0 +1,274 @@
+# Claim Check: Moves large message content into a content-addressed blob store, carrying only a reference.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, ClassVar, Dict, List, Optional, Sequence, Union
+
+from soma.core.contracts.message import Message, FrozenMessage, LazyMessage
+from soma.eventbus.metrics import CLAIM_CHECKS, CLAIM_CHECK_BYTES
+
+CLAIM_CHECK = "claim_check"  # Metadata entry holding the reference: {"digest": ..., "size": ...}
+
+
+class BlobStore:
+    """
+    BlobStore: A content-addressed store of immutable blobs in a local directory.
+    Blobs are named by the SHA-256 digest of their content, so equal content is stored once. Each blob has a
+    reference count, kept in a SQLite database next to the blobs, so processes sharing the directory share
+    the counts. References may be named, so releasing a named reference again, e.g. when a message is delivered
+    twice, is ignored. Blobs without references are removed by collect().
+    """
+
+    def __init__(self, directory: str):
+        """
+        Open or create the store.
+        :param directory: The directory of the blobs.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(os.path.join(directory, "refs.db"), check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                                 "refs INTEGER NOT NULL, created_at REAL NOT NULL, released_at REAL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS released (ref TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+        self._lock = threading.Lock()
+
+    def path(self, digest: str) -> str:
+        """
+        :return: The path of a blob.
+        """
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Store a blob, if it is not stored yet, and add a reference to it.
+        :param data: The content.
+        :return: The digest of the content, which identifies the blob.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        # The reference is added first, so a concurrent collect() does not remove the blob
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO blobs (digest, size, refs, created_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (digest) DO UPDATE SET refs = refs + 1, created_at = excluded.created_at, "
+                "released_at = NULL",
+                (digest, len(data), time.time()))
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name and renamed, so readers never see a partial blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def open(self, digest: str) -> mmap.mmap:
+        """
+        Map a blob into memory, read-only. Pages are read from the file when they are accessed.
+        :param digest: The digest of the blob.
+        :return: The mapping; close it when done.
+        :raises FileNotFoundError: If the blob does not exist.
+        """
+        with open(self.path(digest), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, digest: str) -> bytes:
+        """
+        :param digest: The digest of the blob.
+        :return: The content of the blob.
+        :raises FileNotFoundError: If the blob does not exist.
+        """
+        with self.open(digest) as mapping:
+            return mapping[:]
+
+    def read_text(self, digest: str) -> str:
+        """
+        :param digest: The digest of the blob.
+        :return: The content of the blob, decoded from UTF-8 directly from the mapping.
+        :raises FileNotFoundError: If the blob does not exist.
+        """
+        with self.open(digest) as mapping:
+            return str(mapping, "utf-8")
+
+    def refs(self, digest: str) -> int:
+        """
+        :return: The number of references to a blob, 0 if it is unknown.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row else 0
+
+    def retain(self, digest: str, count: int = 1):
+        """
+        Add references to a stored blob.
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("UPDATE blobs SET refs = refs + ?, released_at = NULL WHERE digest = ?",
+                                     (count, digest))
+
+    def release(self, digests: Sequence[str], refs: Optional[Sequence[Optional[str]]] = None):
+        """
+        Remove a reference per digest, in a single transaction.
+        :param digests: The digests, repeated to release several references to a blob.
+        :param refs: Optional names of the references, in the same order as the digests. A named reference is
+                     only removed the first time it is released; None entries are always removed.
+        :return: None
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN")
+            if refs is not None:
+                digests = [digest for digest, ref in zip(digests, refs) if ref is None or self._connection.execute(
+                    "INSERT OR IGNORE INTO released (ref, digest) VALUES (?, ?)", (ref, digest)).rowcount]
+            self._connection.executemany("UPDATE blobs SET refs = refs - 1, released_at = ? WHERE digest = ?",
+                                         [(now, digest) for digest in digests])
+            self._connection.execute("COMMIT")
+
+    def collect(self, grace: float = 0.0, max_age: Optional[float] = None) -> int:
+        """
+        Remove blobs without references.
+        :param grace: Time in seconds a blob is kept after its last reference was released.
+        :param max_age: Optional time in seconds after which a blob is removed even if it is referenced,
+                        e.g. because a message holding a reference was dropped.
+        :return: The number of removed blobs.
+        """
+        now = time.time()
+        query = "SELECT digest FROM blobs WHERE (refs <= 0 AND released_at < ?)"
+        params: List[Any] = [now - grace]
+        if max_age is not None:
+            query += " OR created_at < ?"
+            params.append(now - max_age)
+        with self._lock:
+            digests = [row[0] for row in self._connection.execute(query, params)]
+            for digest in digests:
+                try:
+                    os.unlink(self.path(digest))
+                except FileNotFoundError:
+                    pass
+            self._connection.execute("BEGIN")
+            self._connection.executemany("DELETE FROM blobs WHERE digest = ?", [(digest,) for digest in digests])
+            self._connection.executemany("DELETE FROM released WHERE digest = ?", [(digest,) for digest in digests])
+            self._connection.execute("COMMIT")
+        return len(digests)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ClaimedMessage(LazyMessage):
+    """
+    A message whose content is kept in a blob store and read when it is accessed for the first time.
+    Its fields hold the reference, so it is serialized and published again as reference, without reading the blob.
+    """
+    encoding: ClassVar[str] = CLAIM_CHECK
+
+    def _decode(self, fields: Dict[str, Any]) -> str:
+        return self._source.read_text(fields["metadata"][CLAIM_CHECK]["digest"])
+
+
+class ClaimCheck:
+    """
+    ClaimCheck: Replaces content above a size threshold by a reference into a BlobStore before messages are
+    queued or sent, and resolves the reference lazily when a subscriber accesses the content.
+    Each published message holds a named reference to its blob until it is done, i.e. handled by all subscribers,
+    moved to the dead-letter topic after its last retry, or dropped. Blobs without references are removed after
+    a grace period.
+    """
+
+    def __init__(self, store: Union[str, BlobStore], threshold: int = 64 * 1024, grace: float = 3600.0,
+                 max_age: Optional[float] = None, collect_interval: float = 60.0, release: bool = True):
+        """
+        Initialize the claim check.
+        :param store: The blob store, or its directory.
+        :param threshold: Minimum content size in characters moved to the store (default: 64 KiB).
+        :param grace: Time in seconds a blob is kept after the last message referencing it was done.
+        :param max_age: Optional time in seconds after which blobs are removed even if they are referenced.
+        :param collect_interval: Minimum time in seconds between two collections of unreferenced blobs.
+        :param release: If False, messages keep their references when they are done, e.g. if several Kafka consumer
+                        groups read the same topic; blobs are then only removed after `max_age`.
+        """
+        self.store = BlobStore(store) if isinstance(store, str) else store
+        self.threshold = threshold
+        self.grace = grace
+        self.max_age = max_age
+        self.collect_interval = collect_interval
+        self.release_on_delivery = release
+        self._collected = time.monotonic()
+
+    @staticmethod
+    def reference(message: Message) -> Optional[str]:
+        """
+        :return: The digest of the blob referenced by a message, or None if it carries its content.
+        """
+        claim = (message.metadata or {}).get(CLAIM_CHECK)
+        return claim["digest"] if claim else None
+
+    def check_in(self, messages: Sequence[Message], topic: str = "") -> List[Message]:
+        """
+        Replace large content by references. Messages already carrying a reference get another one.
+        :param messages: The messages to publish.
+        :param topic: The topic, for metrics.
+        :return: The messages to queue or send, in the same order.
+        """
+        checked = []
+        for message in messages:
+            claim = (message.metadata or {}).get(CLAIM_CHECK)
+            if claim is not None:
+                self.store.retain(claim["digest"])
+                checked.append(FrozenMessage.trusted(**{**message.__dict__, "metadata": {
+                    **message.metadata, CLAIM_CHECK: {**claim, "ref": uuid.uuid4().hex}}}))
+                continue
+            if isinstance(message, LazyMessage):
+                # Content encoded otherwise, e.g. compressed, is passed on encoded
+                checked.append(message.encoded())
+                continue
+            content = message.content
+            if len(content) < self.threshold:
+                checked.append(message)
+                continue
+            data = content.encode("utf-8")
+            digest = self.store.put(data)
+            CLAIM_CHECKS.labels(topic=topic).inc()
+            CLAIM_CHECK_BYTES.labels(topic=topic).inc(len(data))
+            claim = {"digest": digest, "size": len(data), "ref": uuid.uuid4().hex}
+            checked.append(message.freeze(content="", metadata={**(message.metadata or {}), CLAIM_CHECK: claim}))
+        return checked
+
+    def check_out(self, messages: Sequence[Message]) -> List[Message]:
+        """
+        Wrap messages carrying references, so their content is read when it is accessed.
+        :param messages: The messages taken from a queue or Kafka.
+        :return: The messages to deliver, in the same order.
+        """
+        return [ClaimedMessage.wrap(message, self.store) if self.reference(message) else message
+                for message in messages]
+
+    def release(self, messages: Sequence[Message]):
+        """
+        Release the references of messages that are done, and remove unreferenced blobs from time to time.
+        Each reference is released once, even if its message is delivered again, e.g. by Kafka after a restart.
+        :param messages: The messages, as passed to check_out(), or as queued.
+        :return: None
+        """
+        if self.release_on_delivery:
+            claims = [claim for claim in ((message.metadata or {}).get(CLAIM_CHECK) for message in messages) if claim]
+            if claims:
+                self.store.release([claim["digest"] for claim in claims], [claim.get("ref") for claim in claims])
+        now = time.monotonic()
+        if now - self._collected >= self.collect_interval:
+            self._collected = now
+            self.store.collect(self.grace, self.max_age)
@@ -0,0 +1,168 @@
+# Message Codecs: Serialization of messages for Kafka and the segment log.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+from abc import ABC, abstractmethod
+from typing import Dict, Union
+
+from soma.core.contracts.message import Message
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+# The first byte of an encoded message identifies its format, so consumers can decode records written by
+# producers using another codec, e.g. during a rollout. JSON starts with '{', which keeps JSON records
+# compatible with consumers that do not know about codecs.
+FORMAT_JSON = ord("{")
+FORMAT_MSGPACK = 0x01
+
+
+class MessageCodec(ABC):
+    """
+    MessageCodec: Converts messages to bytes and back.
+    `encode()` writes the format of the codec; `decode()` reads all known formats, whichever codec wrote them.
+    """
+
+    name: str
+    format: int
+
+    @abstractmethod
+    def encode(self, message: Message) -> bytes:
+        """
+        Serialize a message.
+        :param message: The message.
+        :return: The encoded message, starting with the format byte of the codec.
+        """
+        ...
+
+    @abstractmethod
+    def _decode(self, data: bytes) -> Message:
+        """
+        Deserialize a message written in the format of this codec.
+        :param data: The encoded message, including the format byte.
+        :return: The message.
+        """
+        ...
+
+    def decode(self, data: bytes) -> Message:
+        """
+        Deserialize a message written by any known codec.
+        :param data: The encoded message.
+        :return: The message.
+        :raises ValueError: If the format is unknown, or its codec is not available.
+        """
+        if not data:
+            raise ValueError("Empty message")
+        if data[0] == self.format:
+            return self._decode(data)
+        return _decoder(data[0])._decode(data)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class JsonCodec(MessageCodec):
+    """
+    JsonCodec: JSON, using the serializer of pydantic. The default.
+    """
+
+    name = "json"
+    format = FORMAT_JSON
+
+    def encode(self, message: Message) -> bytes:
+        return message.model_dump_json().encode("utf-8")
+
+    def _decode(self, data: bytes) -> Message:
+        return Message.model_validate_json(data)
+
+
+class OrjsonCodec(MessageCodec):
+    """
+    OrjsonCodec: JSON, encoded with orjson. Writes the same format as JsonCodec. Requires the `orjson` package.
+    Decoding uses the JSON parser of pydantic, which validates while parsing and is faster than
+    parsing with orjson and validating the resulting dict.
+    """
+
+    name = "orjson"
+    format = FORMAT_JSON
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("OrjsonCodec requires the 'orjson' package")
+
+    def encode(self, message: Message) -> bytes:
+        return orjson.dumps(message.__dict__)
+
+    def _decode(self, data: bytes) -> Message:
+        return Message.model_validate_json(data)
+
+
+class MsgpackCodec(MessageCodec):
+    """
+    MsgpackCodec: MessagePack, prefixed by its format byte. Requires the `msgpack` package.
+    """
+
+    name = "msgpack"
+    format = FORMAT_MSGPACK
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("MsgpackCodec requires the 'msgpack' package")
+
+    def encode(self, message: Message) -> bytes:
+        return bytes((FORMAT_MSGPACK,)) + msgpack.packb(message.__dict__)
+
+    def _decode(self, data: bytes) -> Message:
+        return Message.model_validate(msgpack.unpackb(memoryview(data)[1:]))
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+
+_decoders: Dict[int, MessageCodec] = {}
+
+
+def _decoder(fmt: int) -> MessageCodec:
+    """
+    Get a codec able to decode a format.
+    :param fmt: The format byte.
+    :return: The codec.
+    :raises ValueError: If the format is unknown, or its codec is not available.
+    """
+    decoder = _decoders.get(fmt)
+    if decoder is None:
+        if fmt == FORMAT_JSON:
+            decoder = JsonCodec()
+        elif fmt == FORMAT_MSGPACK:
+            try:
+                decoder = MsgpackCodec()
+            except ImportError as e:
+                raise ValueError(f"Cannot decode MessagePack message: {e}") from e
+        else:
+            raise ValueError(f"Unknown message format 0x{fmt:02x}")
+        _decoders[fmt] = decoder
+    return decoder
+
+
+def get_codec(codec: Union[str, MessageCodec, None] = None) -> MessageCodec:
+    """
+    Get a codec by name.
+    :param codec: 'json', 'orjson', 'msgpack', a codec instance, or None for the default JSON codec.
+    :return: The codec.
+    :raises ValueError: If the name is unknown.
+    :raises ImportError: If the package required by the codec is not installed.
+    """
+    if isinstance(codec, MessageCodec):
+        return codec
+    if codec is None:
+        codec = "json"
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec '{codec}', expected one of {', '.join(CODECS)}")
+    return CODECS[codec]()
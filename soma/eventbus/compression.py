@@ -0,0 +1,140 @@
+# Compression: Compresses large message content while messages are queued, logged or sent.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import base64
+import time
+import zlib
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Sequence, Tuple
+
+from soma.core.contracts.message import Message, LazyMessage
+from soma.eventbus.metrics import COMPRESSION_RATIO, COMPRESSION_CPU_SECONDS
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSION = "compression"  # Metadata entry describing the compression: {"codec": ..., "size": ...}
+
+Compressor = Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]
+
+
+def _zlib(level: int) -> Compressor:
+    return lambda data: zlib.compress(data, level), zlib.decompress
+
+
+def _zstd(level: int) -> Compressor:
+    if zstandard is None:
+        raise ImportError("zstd compression requires the 'zstandard' package")
+    return lambda data: zstandard.compress(data, level), zstandard.decompress
+
+
+# Factories of (compress, decompress) functions by codec name, taking the compression level
+CODECS: Dict[str, Callable[[int], Compressor]] = {"zlib": _zlib, "zstd": _zstd}
+
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+
+_decompressors: Dict[str, Callable[[bytes], bytes]] = {}
+
+
+def _decompressor(codec: str) -> Callable[[bytes], bytes]:
+    """
+    Get the decompression function of a codec; the level does not matter for decompression.
+    :raises ValueError: If the codec is unknown, or its package is not installed.
+    """
+    decompress = _decompressors.get(codec)
+    if decompress is None:
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec '{codec}'")
+        try:
+            decompress = CODECS[codec](DEFAULT_LEVELS[codec])[1]
+        except ImportError as e:
+            raise ValueError(f"Cannot decompress message: {e}") from e
+        _decompressors[codec] = decompress
+    return decompress
+
+
+class CompressedMessage(LazyMessage):
+    """
+    A message whose content is compressed, and decompressed when it is accessed for the first time.
+    Its fields hold the compressed content, Base64-encoded, so it is serialized and published again compressed.
+    """
+    encoding: ClassVar[str] = COMPRESSION
+
+    def _decode(self, fields: Dict[str, Any]) -> str:
+        started = time.thread_time()
+        content = _decompressor(fields["metadata"][COMPRESSION]["codec"])(base64.b64decode(fields["content"]))
+        COMPRESSION_CPU_SECONDS.labels(operation="decompress").inc(time.thread_time() - started)
+        return content.decode("utf-8")
+
+
+class Compression:
+    """
+    Compression: Compresses content above a size threshold before messages are queued, logged or sent, and
+    decompresses it lazily when a subscriber accesses the content.
+    Compressed content is Base64-encoded, so it fits the `content` field and every message codec. Content that
+    does not compress by at least `min_ratio`, including the Base64 overhead, is left as it is.
+    """
+
+    def __init__(self, codec: str = "auto", level: Optional[int] = None, threshold: int = 4096,
+                 min_ratio: float = 1.25):
+        """
+        Initialize the compression.
+        :param codec: 'zlib', 'zstd', or 'auto' for zstd if the 'zstandard' package is installed, zlib otherwise.
+        :param level: Compression level (default: 6 for zlib, 3 for zstd).
+        :param threshold: Minimum content size in characters to compress (default: 4 KiB).
+        :param min_ratio: Minimum ratio of content size to compressed size for compressed content to be used.
+        :raises ValueError: If the codec is unknown.
+        :raises ImportError: If the package required by the codec is not installed.
+        """
+        if codec == "auto":
+            codec = "zstd" if zstandard is not None else "zlib"
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec '{codec}', expected one of auto, {', '.join(CODECS)}")
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.threshold = threshold
+        self.min_ratio = min_ratio
+        self._compress = CODECS[codec](self.level)[0]
+
+    def compress(self, messages: Sequence[Message], topic: str = "") -> List[Message]:
+        """
+        Compress large content. Messages whose content is compressed or encoded otherwise are passed on encoded.
+        :param messages: The messages to publish.
+        :param topic: The topic, for metrics.
+        :return: The messages to queue or send, in the same order.
+        """
+        compressed = []
+        for message in messages:
+            if isinstance(message, LazyMessage):
+                compressed.append(message.encoded())
+                continue
+            content = message.content
+            if COMPRESSION in (message.metadata or {}) or len(content) < self.threshold:
+                compressed.append(message)
+                continue
+            data = content.encode("utf-8")
+            started = time.thread_time()
+            encoded = base64.b64encode(self._compress(data)).decode("ascii")
+            COMPRESSION_CPU_SECONDS.labels(operation="compress").inc(time.thread_time() - started)
+            ratio = len(data) / len(encoded)
+            COMPRESSION_RATIO.labels(topic=topic).observe(ratio)
+            if ratio < self.min_ratio:
+                compressed.append(message)
+                continue
+            compressed.append(message.freeze(
+                content=encoded, metadata={**(message.metadata or {}), COMPRESSION: {"codec": self.codec,
+                                                                                      "size": len(data)}}))
+        return compressed
+
+    @staticmethod
+    def decompress(messages: Sequence[Message]) -> List[Message]:
+        """
+        Wrap messages with compressed content, so it is decompressed when it is accessed.
+        :param messages: The messages taken from a queue or Kafka.
+        :return: The messages to deliver, in the same order.
+        """
+        return [CompressedMessage.wrap(message) if COMPRESSION in (message.metadata or {}) else message
+                for message in messages]
@@ -0,0 +1,287 @@
+# Deduplication: Suppresses messages whose source_id was seen before.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import collections
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+from soma.core.contracts.message import Message
+from soma.eventbus.metrics import DUPLICATES
+
+
+class BloomFilter:
+    """
+    BloomFilter: A set of strings with false positives but no false negatives, using a fixed amount of memory.
+    Sized for `capacity` entries at a false positive rate of `error_rate`; more entries raise the rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        Initialize an empty filter.
+        :param capacity: Expected number of entries.
+        :param error_rate: False positive rate at `capacity` entries.
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        if not 0 < error_rate < 1:
+            raise ValueError(f"error_rate must be between 0 and 1, got {error_rate}")
+
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        # A digest of blake2b provides up to 16 independent 32-bit hashes
+        self.hashes = min(16, max(1, round(self.bits / capacity * math.log(2))))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, item: str) -> List[int]:
+        """
+        The bit positions of an entry. Filters of the same size share the positions of an entry.
+        :param item: The entry.
+        :return: The positions.
+        """
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=4 * self.hashes).digest()
+        bits = self.bits
+        return [h % bits for h in memoryview(digest).cast("I")]
+
+    def add(self, item: str, positions: Optional[List[int]] = None):
+        """
+        Add an entry.
+        :param item: The entry.
+        :param positions: The positions of the entry, if already known.
+        :return: None
+        """
+        array = self.array
+        for position in positions or self.positions(item):
+            array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def contains(self, positions: List[int]) -> bool:
+        """
+        :param positions: The positions of an entry.
+        :return: True if the entry may have been added, False if it was not.
+        """
+        array = self.array
+        for position in positions:
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __contains__(self, item: str) -> bool:
+        return self.contains(self.positions(item))
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + self.array.__sizeof__()
+
+
+class SqliteDedupeStore:
+    """
+    SqliteDedupeStore: Persists seen IDs in a SQLite database, so duplicates are detected across restarts.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open or create the database.
+        :param path: Path of the database file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS seen_at ON seen (seen_at)")
+        self._lock = threading.Lock()
+
+    def contains(self, key: str, since: float) -> bool:
+        """
+        :param key: The ID.
+        :param since: Only IDs seen at or after this time count.
+        :return: True if the ID was seen since the given time.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM seen WHERE id = ? AND seen_at >= ?", (key, since)).fetchone()
+        return row is not None
+
+    def add(self, keys: Sequence[str], now: float):
+        """
+        Record IDs as seen, in a single transaction.
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO seen (id, seen_at) VALUES (?, ?)",
+                                         [(key, now) for key in keys])
+            self._connection.execute("COMMIT")
+
+    def keys(self, since: float) -> List[str]:
+        """
+        :return: The IDs seen since the given time.
+        """
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT id FROM seen WHERE seen_at >= ?", (since,))]
+
+    def expire(self, before: float):
+        """
+        Remove IDs seen before the given time.
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM seen WHERE seen_at < ?", (before,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class Deduplicator:
+    """
+    Deduplicator: Detects messages that were seen before, by source type and `source_id`.
+
+    Each ID is first looked up in a time-windowed Bloom filter. As it has no false negatives, an ID it does not
+    contain is new, which is the common case and costs no further lookup. IDs the filter may contain are checked
+    against an LRU set of the most recent `lru_size` IDs and, if configured, the persistent store, so a false
+    positive of the filter never drops a message. Without a store, an ID that dropped out of the LRU set is
+    treated as new.
+
+    The filter consists of two generations, each covering `window` seconds; when the current generation is
+    older than `window`, the older one is discarded. So IDs are remembered for at least `window` seconds.
+    """
+
+    def __init__(self, window: float = 86400.0, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 lru_size: int = 100_000, store: Optional[SqliteDedupeStore] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Initialize the deduplicator. IDs in the store are loaded into the Bloom filter.
+        :param window: Time in seconds IDs are remembered for at least (default: one day).
+        :param capacity: Expected number of IDs per window, used to size the Bloom filter.
+        :param error_rate: False positive rate of the Bloom filter at `capacity` IDs.
+        :param lru_size: Number of recent IDs kept in memory for exact lookups.
+        :param store: Optional persistent store.
+        :param clock: The clock, returning seconds since the epoch, as the store keeps timestamps.
+        """
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lru_size = lru_size
+        self.store = store
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._started = clock()
+        self._recent: collections.OrderedDict[str, float] = collections.OrderedDict()
+
+        if store:
+            for key in store.keys(self._started - window):
+                self._current.add(key)
+
+    @staticmethod
+    def key(message: Message, scope: str = "") -> Optional[str]:
+        """
+        The ID of a message, or None if it has no `source_id`. IDs are only unique per source type.
+        :param message: The message.
+        :param scope: Optional scope, e.g. a topic, so the same message may pass once per scope.
+        :return: The ID.
+        """
+        if not message.source_id:
+            return None
+        return f"{scope}\0{message.source_type}\0{message.source_id}"
+
+    def _rotate(self, now: float):
+        if now - self._started >= self.window:
+            self._previous = self._current if now - self._started < 2 * self.window else None
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._started = now
+            if self.store:
+                self.store.expire(now - 2 * self.window)
+
+    def _seen(self, key: str, positions: List[int], now: float) -> bool:
+        if not self._current.contains(positions) and (self._previous is None or
+                                                      not self._previous.contains(positions)):
+            return False
+        seen_at = self._recent.get(key)
+        if seen_at is not None:
+            return now - seen_at < 2 * self.window
+        return self.store is not None and self.store.contains(key, now - 2 * self.window)
+
+    def _remember(self, keys: Sequence[str], now: float, positions: Optional[Sequence[List[int]]] = None):
+        current = self._current
+        recent = self._recent
+        for i, key in enumerate(keys):
+            current.add(key, positions[i] if positions else None)
+            recent[key] = now
+            recent.move_to_end(key)
+        while len(recent) > self.lru_size:
+            recent.popitem(last=False)
+        if self.store and keys:
+            self.store.add(keys, now)
+
+    def filter(self, messages: Sequence[Message], scope: str = "", remember: bool = True) -> List[Message]:
+        """
+        Remove messages that were seen before, including repetitions within the batch.
+        :param messages: The messages.
+        :param scope: Optional scope, e.g. a topic, so the same message may pass once per scope.
+        :param remember: If True, the passed messages are recorded as seen. Otherwise, call remember() once
+                         they are handled, so a message is not lost if handling it is interrupted.
+        :return: The messages that were not seen before, in their original order.
+        """
+        with self._lock:
+            now = self.clock()
+            self._rotate(now)
+            passed = []
+            keys = []
+            positions = []
+            batch = set()
+            duplicates = 0
+            for message in messages:
+                key = self.key(message, scope)
+                if key is None:
+                    passed.append(message)
+                    continue
+                key_positions = self._current.positions(key)
+                if key in batch or self._seen(key, key_positions, now):
+                    duplicates += 1
+                    continue
+                batch.add(key)
+                keys.append(key)
+                positions.append(key_positions)
+                passed.append(message)
+            if remember:
+                self._remember(keys, now, positions)
+        if duplicates:
+            DUPLICATES.labels(topic=scope).inc(duplicates)
+        return passed
+
+    def remember(self, messages: Sequence[Message], scope: str = ""):
+        """
+        Record messages as seen.
+        :param messages: The messages.
+        :param scope: The scope passed to filter().
+        :return: None
+        """
+        keys = [key for key in (self.key(message, scope) for message in messages) if key is not None]
+        with self._lock:
+            now = self.clock()
+            self._rotate(now)
+            self._remember(keys, now)
+
+    def is_duplicate(self, message: Message, scope: str = "") -> bool:
+        """
+        Check a single message and record it as seen.
+        :return: True if the message was seen before.
+        """
+        return not self.filter([message], scope)
+
+    def __sizeof__(self) -> int:
+        size = object.__sizeof__(self) + self._current.__sizeof__() + self._recent.__sizeof__()
+        if self._previous:
+            size += self._previous.__sizeof__()
+        return size + sum(key.__sizeof__() + 24 for key in self._recent)
@@ -0,0 +1,88 @@
+# Dispatcher: Starts consumers for topics with pending messages.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import threading
+from typing import Dict, Optional, Tuple
+
+import structlog
+
+from soma.eventbus.worker_pool import TopicWorkerPool
+
+
+class Dispatcher:
+    """
+    Dispatcher: A single thread starting workers for the topics of an event bus that received messages.
+    Topic queues report new messages through notify(), which only records the pool and wakes the dispatcher
+    through a condition variable. The dispatcher then lets the pool start workers, outside the publisher's thread.
+    While nothing is published, the dispatcher waits without a timeout and uses no CPU.
+    """
+
+    def __init__(self, name: str = "soma-dispatcher", logger=None):
+        """
+        Initialize the dispatcher.
+        :param name: The name of the dispatcher thread.
+        :param logger: Optional structlog logger, e.g. the logger of the event bus.
+        """
+        self.name = name
+        self.logger = logger or structlog.get_logger(__name__)
+        self.running = False
+        self._ready: Dict[Tuple[int, int], Tuple[TopicWorkerPool, int]] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def notify(self, pool: TopicWorkerPool, index: int):
+        """
+        Request workers for a source of a pool. Called by publishers with the queue lock held, so it never blocks
+        for longer than it takes to record the request.
+        :param pool: The pool consuming the source.
+        :param index: The index of the source within the pool.
+        :return: None
+        """
+        with self._condition:
+            if (id(pool), index) not in self._ready:
+                self._ready[(id(pool), index)] = (pool, index)
+                self._condition.notify()
+
+    def start(self):
+        """
+        Start the dispatcher thread.
+        :return: None
+        """
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the dispatcher thread. Pending requests are discarded.
+        :return: None
+        """
+        with self._condition:
+            self.running = False
+            self._ready.clear()
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _run(self):
+        """
+        Dispatcher loop.
+        :return: None
+        """
+        while True:
+            with self._condition:
+                while self.running and not self._ready:
+                    self._condition.wait()
+                if not self.running:
+                    return
+                ready = list(self._ready.values())
+                self._ready.clear()
+
+            for pool, index in ready:
+                try:
+                    pool.wake(index)
+                except Exception as e:
+                    self.logger.error("Could not start workers", topic=pool.topic, error=str(e))
@@ -3,14 +3,304 @@
 # :author: Niels Braczek <nbraczek@bsds.de>
 # :license: MIT License
 
+import collections
+import queue
 import threading
-import json
+import time
 import structlog
-from kafka import KafkaConsumer, KafkaProducer
-from typing import Callable, Dict, List, Optional
-from soma.core.contracts.event_bus import EventBus, EventProducer, EventSubscriber
+from kafka import KafkaConsumer, KafkaProducer, ConsumerRebalanceListener, TopicPartition
+from kafka.structs import OffsetAndMetadata
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from soma.core.contracts.event_bus import EventBus, EventProducer
 from soma.core.contracts.message import Message
-from soma.eventbus.metrics import EVENT_LATENCY, EVENT_COUNT, EVENT_ERRORS
+from soma.eventbus.codec import MessageCodec, get_codec
+from soma.eventbus.claim_check import ClaimCheck
+from soma.eventbus.compression import Compression
+from soma.eventbus.dedupe import Deduplicator
+from soma.eventbus.metrics import PRODUCED_MESSAGES, PRODUCE_ERRORS, COMMIT_LATENCY, COMMIT_FAILURES, \
+    UNCOMMITTED_MESSAGES, PAUSED_PARTITIONS, CONSUMER_LAG, REBALANCES, KAFKA_RECORDS_IN_RATE, KAFKA_BYTES_IN_RATE, \
+    KAFKA_RECORDS_OUT_RATE, KAFKA_BYTES_OUT_RATE, KAFKA_SEND_LATENCY, KAFKA_PRODUCER_QUEUE
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.timing_wheel import Scheduler
+from soma.eventbus.topic_matcher import TopicMatcher, TopicPattern
+
+
+class _Commits:
+    """
+    Offsets of the records of one consumer that are done, committed in batches. A record is done when all
+    subscribers handled it, or it failed without another attempt pending, so a record waiting for a retry holds
+    back the commits of its partition. Used from the consumer thread, except for the callbacks returned by track().
+    """
+
+    def __init__(self, consumer: KafkaConsumer, every: int, interval: float, logger):
+        self.consumer = consumer
+        self.every = every
+        self.interval = interval
+        self.logger = logger
+        self.fetched: Dict[TopicPartition, int] = {}  # Offset after the last fetched record
+        self.tracked: Dict[TopicPartition, int] = {}  # Offset after the last record handed to delivery
+        self.outstanding: Dict[TopicPartition, set] = {}  # Offsets of delivered records that are not done yet
+        self.handled: Dict[TopicPartition, int] = {}  # Offset after the records that are all done
+        self.committed: Dict[TopicPartition, int] = {}
+        self.generations: Dict[TopicPartition, int] = {}  # Incremented when a partition is revoked
+        self.pending = 0  # Number of records done since the last commit
+        self.last_commit = time.monotonic()
+        self.lanes: Optional[_PartitionLanes] = None
+        self._finished: collections.deque = collections.deque()  # Reported by delivering threads
+
+    def track(self, tp: TopicPartition, offsets: Sequence[int], last: int, count: int) -> Callable[[Sequence[int]], None]:
+        """
+        Record the offsets of records handed to delivery. Records up to `last` not among them, e.g. invalid
+        records, are done already.
+        :param tp: The partition.
+        :param offsets: The offsets of the delivered records.
+        :param last: The offset of the last fetched record.
+        :param count: The number of fetched records.
+        :return: A callable reporting offsets that are done, safe to call from any thread.
+        """
+        self.outstanding.setdefault(tp, set()).update(offsets)
+        self.tracked[tp] = last + 1
+        self.pending += count - len(offsets)
+        self._advance(tp)
+        generation = self.generations.get(tp, 0)
+        return lambda done: self._finished.append((tp, generation, done))
+
+    def collect(self):
+        """
+        Take over the records reported as done.
+        :return: None
+        """
+        touched = set()
+        while self._finished:
+            tp, generation, done = self._finished.popleft()
+            outstanding = self.outstanding.get(tp)
+            if generation != self.generations.get(tp, 0) or outstanding is None:
+                continue
+            for offset in done:
+                if offset in outstanding:
+                    outstanding.discard(offset)
+                    self.pending += 1
+            touched.add(tp)
+        for tp in touched:
+            self._advance(tp)
+
+    def _advance(self, tp: TopicPartition):
+        outstanding = self.outstanding.get(tp)
+        self.handled[tp] = min(outstanding) if outstanding else self.tracked[tp]
+
+    def fetch(self, tp: TopicPartition, first: int, last: int):
+        """
+        Record the offsets of fetched records.
+        :return: None
+        """
+        self.committed.setdefault(tp, first)
+        self.fetched[tp] = last + 1
+        self._report(tp)
+
+    def maybe_commit(self):
+        """
+        Commit if `every` records were handled or `interval` seconds passed since the last commit.
+        :return: None
+        """
+        if self.pending and (self.pending >= self.every or time.monotonic() - self.last_commit >= self.interval):
+            self.commit()
+
+    def commit(self, sync: bool = False):
+        """
+        Commit the offsets of all handled records.
+        :param sync: If True, wait for the commit, e.g. before partitions are revoked or the consumer is closed.
+        :return: None
+        """
+        offsets = {
+            tp: OffsetAndMetadata(offset, "", -1)
+            for tp, offset in self.handled.items() if offset > self.committed.get(tp, -1)
+        }
+        self.pending = 0
+        self.last_commit = time.monotonic()
+        if not offsets:
+            return
+
+        started = time.perf_counter()
+        if not sync:
+            self.consumer.commit_async(offsets, callback=lambda _, response: self._on_commit(offsets, response, started))
+            return
+        try:
+            self.consumer.commit(offsets)
+        except Exception as e:
+            self._on_commit(offsets, e, started)
+        else:
+            self._on_commit(offsets, None, started)
+
+    def _on_commit(self, offsets: Dict[TopicPartition, OffsetAndMetadata], response, started: float):
+        if isinstance(response, Exception):
+            # The records are delivered again after a restart or rebalance, unless a later commit succeeds
+            COMMIT_FAILURES.inc()
+            self.logger.warning("Failed to commit Kafka offsets", error=str(response))
+            return
+        COMMIT_LATENCY.observe(time.perf_counter() - started)
+        for tp, offset in offsets.items():
+            self.committed[tp] = max(self.committed.get(tp, 0), offset.offset)
+            self._report(tp)
+
+    def _report(self, tp: TopicPartition):
+        backlog = self.fetched.get(tp, 0) - self.committed.get(tp, 0)
+        UNCOMMITTED_MESSAGES.labels(topic=tp.topic, partition=tp.partition).set(max(0, backlog))
+
+    def revoke(self, revoked):
+        """
+        Commit handled offsets before partitions are revoked, and forget the revoked partitions.
+        :return: None
+        """
+        if self.lanes:
+            # Queued records of revoked partitions are skipped; the new owner of the partition fetches them again
+            self.lanes.revoke(revoked)
+        self.collect()
+        self.commit(sync=True)
+        for tp in revoked:
+            UNCOMMITTED_MESSAGES.labels(topic=tp.topic, partition=tp.partition).set(0)
+            # Records still waiting for a retry are not reported as done anymore
+            self.generations[tp] = self.generations.get(tp, 0) + 1
+            for offsets in (self.fetched, self.tracked, self.outstanding, self.handled, self.committed):
+                offsets.pop(tp, None)
+
+
+class _Rebalances(ConsumerRebalanceListener):
+    """
+    Rebalance listener of a consumer: counts rebalances, drops the lag of revoked partitions, and, in manual
+    commit mode, commits handled offsets before partitions are revoked.
+    """
+
+    def __init__(self, commits: Optional[_Commits]):
+        self.commits = commits
+
+    def on_partitions_revoked(self, revoked):
+        if self.commits:
+            self.commits.revoke(revoked)
+        for tp in revoked:
+            try:
+                CONSUMER_LAG.remove(tp.topic, str(tp.partition))
+            except KeyError:
+                pass
+
+    def on_partitions_assigned(self, assigned):
+        REBALANCES.inc()
+
+
+class _PartitionLanes:
+    """
+    Worker threads handling the records fetched by one consumer. Each partition is assigned to the worker with
+    the fewest partitions when its first records arrive, so the records of a partition are handled in order,
+    and different partitions in parallel.
+    Counts the queued records per partition, so the consumer can pause partitions whose worker falls behind.
+    """
+
+    def __init__(self, bus: 'KafkaEventBus', workers: int, name: str):
+        self.bus = bus
+        self.queues: List[queue.SimpleQueue] = [queue.SimpleQueue() for _ in range(workers)]
+        self.pending: Dict[TopicPartition, int] = {}  # Queued and in-flight records per partition
+        self.generations: Dict[TopicPartition, int] = {}  # Incremented when a partition is revoked
+        self.assignment: Dict[TopicPartition, int] = {}  # Index of the worker of each partition
+        self.paused: set = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), daemon=True, name=f"{name}-worker-{i}")
+            for i, q in enumerate(self.queues)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, tp: TopicPartition, messages: List[Message], offsets: List[int], count: int,
+               finish: Optional[Callable[[Sequence[int]], None]] = None):
+        """
+        Queue the records of a partition for its worker.
+        :param tp: The partition.
+        :param messages: The decoded messages.
+        :param offsets: The offsets of the messages.
+        :param count: The number of records, including invalid ones.
+        :param finish: Optional callable reporting the offsets of records that are done.
+        :return: None
+        """
+        with self._lock:
+            self.pending[tp] = self.pending.get(tp, 0) + count
+            generation = self.generations.get(tp, 0)
+            worker = self.assignment.get(tp)
+            if worker is None:
+                load = [0] * len(self.queues)
+                for assigned in self.assignment.values():
+                    load[assigned] += 1
+                worker = self.assignment[tp] = load.index(min(load))
+        self.queues[worker].put((tp, generation, messages, offsets, count, finish))
+
+    def _work(self, q: queue.SimpleQueue):
+        """
+        Worker loop.
+        :return: None
+        """
+        while True:
+            job = q.get()
+            if job is None:
+                return
+            tp, generation, messages, offsets, count, finish = job
+            try:
+                if not self._stopping and generation == self.generations.get(tp, 0):
+                    self.bus._deliver_batches(tp, messages, offsets, finish)
+            except Exception as e:
+                # deliver() catches handler errors; anything else must not stop the worker, or its partitions
+                # would stay paused and uncommitted. The records count as done, like failed records.
+                self.bus.logger.error("Failed to deliver records", topic=tp.topic, partition=tp.partition,
+                                      records=count, error=str(e))
+                if finish is not None:
+                    finish(offsets)
+            finally:
+                with self._lock:
+                    if generation == self.generations.get(tp, 0):
+                        self.pending[tp] -= count
+
+    def apply_backpressure(self, consumer: KafkaConsumer, threshold: int):
+        """
+        Pause partitions with more than `threshold` queued records, and resume them once half of them are handled.
+        Paused partitions are not fetched, but the consumer keeps polling, so it stays in the group.
+        :return: None
+        """
+        with self._lock:
+            pending = dict(self.pending)
+        for tp, count in pending.items():
+            if count > threshold and tp not in self.paused:
+                consumer.pause(tp)
+                self.paused.add(tp)
+                PAUSED_PARTITIONS.inc()
+            elif count <= threshold // 2 and tp in self.paused:
+                consumer.resume(tp)
+                self.paused.discard(tp)
+                PAUSED_PARTITIONS.dec()
+
+    def revoke(self, revoked):
+        """
+        Forget revoked partitions. Their queued records are skipped.
+        :return: None
+        """
+        with self._lock:
+            for tp in revoked:
+                self.generations[tp] = self.generations.get(tp, 0) + 1
+                self.pending.pop(tp, None)
+                self.assignment.pop(tp, None)
+                if tp in self.paused:
+                    self.paused.discard(tp)
+                    PAUSED_PARTITIONS.dec()
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stop the workers after their current job. Queued records are skipped.
+        :return: None
+        """
+        self._stopping = True
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join(timeout=timeout)
+        PAUSED_PARTITIONS.dec(len(self.paused))
+        self.paused.clear()
 
 
 class KafkaEventBus(EventBus):
@@ -23,52 +313,200 @@ class KafkaEventBus(EventBus):
         Initialize the KafkaEventBus with the given bootstrap servers and group ID.
         :param bootstrap_servers: A string representing the Kafka bootstrap servers (e.g., 'localhost:9092').
         :param group_id: A string representing the consumer group ID for this event bus.
+        :param batch_size: Maximum number of records of a partition delivered to `handle_batch()` at once (default: 1).
+        :param batch_linger_ms: Maximum time in milliseconds to wait for records in a single poll (default: 500).
+        :param max_poll_records: Maximum number of records fetched in a single poll (default: 500).
+        :param consumers: Number of consumer threads, each consuming all subscribed topics (default: 1).
+        :param partition_workers: Number of worker threads per consumer handling records in parallel. The records
+                                  of a partition are always handled by the same worker, in order. 0 handles all
+                                  records in the consumer thread (default).
+        :param max_pending_records: With `partition_workers`, number of queued records of a partition above which
+                                    the partition is paused until its worker caught up to half of it (default: 1000).
+        :param commit_mode: 'auto' lets the consumer commit fetched offsets periodically (default);
+                            'manual' commits offsets only after all subscribers handled the records, or they failed
+                            without another retry pending (at-least-once).
+        :param commit_every: In manual mode, number of handled records after which offsets are committed (default: 100).
+        :param commit_interval_ms: In manual mode, time in milliseconds after which handled offsets are committed
+                                   (default: 1000).
+        :param producer_mode: 'async' sends messages in the background, batched by the producer (default);
+                              'sync' waits for the broker to acknowledge each publish() call.
+        :param linger_ms: Time in milliseconds the producer waits for more messages to fill a batch (default: 5).
+        :param producer_batch_size: Maximum size of a producer batch per partition in bytes (default: 16384).
+        :param compression_type: Compression of producer batches: None, 'gzip', 'snappy', 'lz4' or 'zstd' (default: None).
+        :param acks: Number of broker acknowledgements the producer requires: 0, 1 or 'all' (default: 1).
+        :param send_timeout: Maximum time in seconds to wait for acknowledgements in sync mode and when flushing
+                             on stop() (default: 30).
+        :param producer_config: Additional keyword arguments for the KafkaProducer, overriding the above.
+        :param codec: Serialization of messages: 'json' (default), 'orjson', 'msgpack' or a MessageCodec.
+                      Records written with any known codec are read.
+        :param metrics_interval: Time in seconds between two collections of lag and throughput metrics
+                                 (default: 5). 0 disables them.
+        :param retry: Default RetryPolicy of subscribers (default: None, failed messages are dropped).
+        :param dead_letter_prefix: Prefix of the dead-letter topics (default: "dead_letter.").
+        :param scheduler: Scheduler for retries and delayed messages (default: the shared scheduler).
+        :param retry_workers: Number of threads running retries and publishing delayed messages (default: 4).
+        :param dedupe: Optional Deduplicator dropping records whose source_id was delivered on the topic before,
+                       e.g. records redelivered after a rebalance. Use a persistent store to detect redeliveries
+                       after a restart.
+        :param claim_check: Optional ClaimCheck moving large content into a blob store before records are sent.
+                            Producers and consumers must share the directory of the store.
+        :param compression: Optional Compression of large content before records are sent. Unlike
+                            `compression_type`, the content stays compressed until a subscriber accesses it.
         """
         self.bootstrap_servers = bootstrap_servers
         self.group_id = group_id
         self.policy_manager = kwargs.get("policy_manager", None)
         self.logger = kwargs.get("logger", structlog.get_logger(__name__))
+        self.batch_size: int = kwargs.get("batch_size", 1)
+        self.batch_linger_ms: int = kwargs.get("batch_linger_ms", 500)
+        self.max_poll_records: int = kwargs.get("max_poll_records", 500)
+        self.consumers: int = kwargs.get("consumers", 1)
+        self.partition_workers: int = kwargs.get("partition_workers", 0)
+        self.max_pending_records: int = kwargs.get("max_pending_records", 1000)
+        self.codec: MessageCodec = get_codec(kwargs.get("codec", None))
+        self.metrics_interval: float = kwargs.get("metrics_interval", 5.0)
+        self._in_flight = 0  # Messages handed to the producer and not yet acknowledged or failed
+        self._in_flight_lock = threading.Lock()
+        self.commit_mode: str = kwargs.get("commit_mode", "auto")
+        self.commit_every: int = kwargs.get("commit_every", 100)
+        self.commit_interval_ms: int = kwargs.get("commit_interval_ms", 1000)
+        if self.commit_mode not in ("auto", "manual"):
+            raise ValueError(f"Unknown commit mode '{self.commit_mode}', expected 'auto' or 'manual'")
+        self.producer_mode: str = kwargs.get("producer_mode", "async")
+        self.send_timeout: float = kwargs.get("send_timeout", 30.0)
+        if self.producer_mode not in ("async", "sync"):
+            raise ValueError(f"Unknown producer mode '{self.producer_mode}', expected 'async' or 'sync'")
+        self.retry: Optional[RetryPolicy] = kwargs.get("retry", None)
+        self.retry_policies: Dict[int, RetryPolicy] = {}
+        self.dead_letter_prefix: str = kwargs.get("dead_letter_prefix", "dead_letter.")
+        self.scheduler: Optional[Scheduler] = kwargs.get("scheduler", None)
+        self.retry_workers: int = kwargs.get("retry_workers", 4)
+        self.deduplicator: Optional[Deduplicator] = kwargs.get("dedupe", None)
+        self.claim_check: Optional[ClaimCheck] = kwargs.get("claim_check", None)
+        self.compression: Optional[Compression] = kwargs.get("compression", None)
 
         self.subscribers: Dict[str, List[Callable]] = {}
+        self.topic_matcher = TopicMatcher()
         self.consumer_threads: List[threading.Thread] = []
+        self._subscriptions = 0  # Number of subscribe() calls, so consumers notice new subscriptions
         self.running = False
         self.consumer_config = {
             "bootstrap_servers": self.bootstrap_servers,
             "group_id": self.group_id,
-            "value_deserializer": lambda m: json.loads(m.decode("utf-8")),
             "key_deserializer": lambda k: k.decode("utf-8") if k else None,
             "auto_offset_reset": "earliest",
-            "enable_auto_commit": True,
+            "enable_auto_commit": self.commit_mode == "auto",
+        }
+        self.producer_config = {
+            "bootstrap_servers": self.bootstrap_servers,
+            "value_serializer": self.codec.encode,
+            "key_serializer": lambda k: k.encode("utf-8") if k else None,
+            "linger_ms": kwargs.get("linger_ms", 5),
+            "batch_size": kwargs.get("producer_batch_size", 16384),
+            "compression_type": kwargs.get("compression_type", None),
+            "acks": kwargs.get("acks", 1),
+            **kwargs.get("producer_config", {}),
         }
-        self.producer = KafkaProducer(
-            bootstrap_servers=self.bootstrap_servers,
-            value_serializer=lambda v: json.dumps(v).encode("utf-8"),
-            key_serializer=lambda k: k.encode("utf-8") if k else None,
-        )
+        self.producer = KafkaProducer(**self.producer_config)
 
-        self.logger.info("KafkaEventBus initialized", bootstrap_servers=self.bootstrap_servers, group_id=self.group_id, policy_manager=self.policy_manager)
+        self.logger.info("KafkaEventBus initialized", bootstrap_servers=self.bootstrap_servers, group_id=self.group_id,
+                         policy_manager=self.policy_manager, producer_mode=self.producer_mode,
+                         linger_ms=self.producer_config["linger_ms"],
+                         compression_type=self.producer_config["compression_type"])
 
-    def publish(self, topic: str, message: Message, key: Optional[str] = None):
+    def publish(self, topic: str, message: Message, key: Optional[str] = None, delay: Optional[float] = None):
         """
         Publish a message to a specific topic on the Kafka event bus.
         :param topic: The topic to which the message should be published.
         :param message: The message to be published, typically a dictionary containing the event data.
         :param key: Optional key for the message, used for routing or identification purposes.
+        :param delay: Optional time in seconds after which the message is sent to Kafka.
+                      Until then, the message is only kept in the memory of this process.
         :return: None
+        :raises KafkaError: In sync mode, if the brokers do not acknowledge the message within `send_timeout`.
         """
         policy_violation = self.check_publish_policy(topic, message)
         if policy_violation:
             self.logger.warning(policy_violation, topic=topic, message=message)
             return
 
-        self.producer.send(topic, value=message.model_dump(), key=key)
-        self.producer.flush()
+        if delay:
+            self._publish_later(delay, topic, message, key)
+            return
+        self._publish_unchecked(topic, message, key)
+
+    def _publish_unchecked(self, topic: str, message: Message, key: Optional[str] = None):
+        future = self._send(topic, message, key)
+        if self.producer_mode == "sync":
+            future.get(timeout=self.send_timeout)
+
+    def _send(self, topic: str, message: Message, key: Optional[str]):
+        """
+        Hand a message to the producer, which sends it in the background, and count the outcome when it is known.
+        :return: The future of the record metadata.
+        """
+        if self.claim_check is not None or self.compression is not None:
+            message = self._encode(topic, [message])[0]
+        future = self.producer.send(topic, value=message, key=key)
+        with self._in_flight_lock:
+            self._in_flight += 1
+        future.add_callback(self._on_send_success, topic)
+        future.add_errback(self._on_send_error, topic, message)
+        return future
+
+    def _on_send_success(self, topic: str, _metadata):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+        PRODUCED_MESSAGES.labels(topic=topic).inc()
+
+    def _on_send_error(self, topic: str, message: Message, error: Exception):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+        if self.claim_check is not None:
+            # The record was most likely not written; if it was, its delivery finds the reference released already
+            self.claim_check.release([message])
+        PRODUCE_ERRORS.labels(topic=topic).inc()
+        self.logger.error("Failed to send message to Kafka", topic=topic, error=str(error))
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Wait until all messages handed to the producer are sent and acknowledged.
+        :param timeout: Maximum time in seconds to wait (default: `send_timeout`).
+        :return: None
+        """
+        self.producer.flush(timeout=self.send_timeout if timeout is None else timeout)
+
+    def publish_many(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Publish a batch of messages to a specific topic on the Kafka event bus.
+        Policies are checked once per publishing agent. In sync mode, all admitted messages are sent before
+        a single flush.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :param keys: Optional keys for the messages, in the same order as the messages.
+        :return: None
+        """
+        keys = self._batch_keys(messages, keys)
+        admitted, violations = self.check_publish_policy_many(topic, messages)
+        for policy_violation in violations:
+            self.logger.warning(policy_violation, topic=topic)
+        if not admitted:
+            return
+
+        futures = [self._send(topic, messages[i], keys[i]) for i in admitted]
+        if self.producer_mode == "sync":
+            self.flush()
+            for future in futures:
+                future.get(timeout=0)
 
-    def subscribe(self, topic: str, handler: Callable):
+    def subscribe(self, topic: TopicPattern, handler: Callable, retry: Optional[RetryPolicy] = None):
         """
         Subscribe to a specific topic on the Kafka event bus with a handler function.
-        :param topic: The topic to which the handler should subscribe.
+        Patterns are passed to Kafka as a regex subscription, so topics created later are consumed as well.
+        Subscriptions added after start() are picked up by the consumers before their next poll.
+        :param topic: The topic to which the handler should subscribe, or a pattern matching several topics.
         :param handler: A callable function that will be invoked when a message is published to the topic.
+        :param retry: Optional retry policy for this subscriber, overriding the retry policy of the bus.
         :return: None
         """
         policy_violation = self.check_subscribe_policy(topic, handler)
@@ -76,60 +514,181 @@ class KafkaEventBus(EventBus):
             self.logger.warning(policy_violation, topic=topic, handler=handler)
             return
 
-        if topic not in self.subscribers:
-            self.subscribers[topic] = []
-        self.subscribers[topic].append(handler)
+        self._add_subscriber(topic, handler, retry)
+        self._subscriptions += 1
 
         # Auto-inject EventBus into producer agents
         if isinstance(handler, EventProducer):
             if handler.event_bus is None:
                 handler.event_bus = self
 
-    def _consume(self, topic: str):
+    def _subscription(self) -> Tuple[List[str], Optional[str]]:
         """
-        Internal method to consume messages from a specific topic in a separate thread.
-        :param topic: The topic from which messages should be consumed.
+        Combine all subscriptions into a single consumer subscription.
+        Without pattern subscriptions, the topics are subscribed by name; otherwise, topics and patterns are
+        combined into one regular expression, as Kafka does not support both at once.
+        :return: The topic names, or an empty list and the regular expression.
+        """
+        topics = list(self.subscribers)
+        patterns = self.topic_matcher.patterns
+        if not patterns:
+            return topics, None
+        return [], "|".join(f"(?:{TopicMatcher.to_regex(topic)})" for topic in topics + patterns)
+
+    def _consume(self, index: int = 0):
+        """
+        Internal method consuming all subscribed topics and patterns with a single consumer, in a separate thread.
+        Up to `max_poll_records` records are fetched at once, waiting up to `batch_linger_ms` for records.
+        The records of each partition are delivered in batches of up to `batch_size` records to all subscribers
+        of their topic, including pattern subscribers. With `partition_workers`, they are handed to the worker
+        of their partition, and partitions with more than `max_pending_records` queued records are paused.
+        :param index: The index of the consumer, used to name its threads.
         :return: None
         """
-        consumer = KafkaConsumer(topic, **self.consumer_config)
+        consumer = KafkaConsumer(**self.consumer_config)
+        commits = None
+        if self.commit_mode == "manual":
+            commits = _Commits(consumer, self.commit_every, self.commit_interval_ms / 1000, self.logger)
+        lanes = None
+        if self.partition_workers:
+            lanes = _PartitionLanes(self, self.partition_workers, f"soma-kafka-{index}")
+            if commits:
+                commits.lanes = lanes
+        listener = _Rebalances(commits)
+        next_metrics = time.monotonic() + self.metrics_interval
+        subscribed = 0
         while self.running:
-            for msg in consumer:
-                for subscriber in self.subscribers.get(topic, []):
-                    agent_name = getattr(subscriber, "__name__", None) or getattr(subscriber, "name", "unknown")
-                    try:
-                        with EVENT_LATENCY.labels(topic=topic, agent=agent_name).time():
-                            message = Message(**msg.value)
-
-                            if isinstance(subscriber, EventSubscriber):
-                                subscriber.handle(message)
-                            else:
-                                subscriber(message)
-
-                            EVENT_COUNT.labels(topic=topic, agent=agent_name).inc()
-                    except Exception as e:
-                        print(f"[KafkaEventBus] Handler error on topic '{topic}': {e}")
-                        EVENT_ERRORS.labels(topic=topic, agent=agent_name).inc()
-                if not self.running:
-                    break
+            if subscribed != self._subscriptions:
+                # Subscriptions were added since the last poll
+                subscribed = self._subscriptions
+                topics, pattern = self._subscription()
+                if commits:
+                    commits.collect()
+                    commits.commit(sync=True)
+                consumer.unsubscribe()
+                if pattern:
+                    consumer.subscribe(pattern=pattern, listener=listener)
+                else:
+                    consumer.subscribe(topics=topics, listener=listener)
+            if not subscribed:
+                time.sleep(self.batch_linger_ms / 1000)
+                continue
+
+            records = consumer.poll(timeout_ms=self.batch_linger_ms, max_records=self.max_poll_records)
+            for tp, partition_records in records.items():
+                if commits:
+                    commits.fetch(tp, partition_records[0].offset, partition_records[-1].offset)
+                offsets, messages = self._decode(tp, partition_records)
+                finish = None
+                if commits:
+                    finish = commits.track(tp, offsets, partition_records[-1].offset, len(partition_records))
+                if lanes:
+                    lanes.submit(tp, messages, offsets, len(partition_records), finish)
+                    continue
+                self._deliver_batches(tp, messages, offsets, finish)
+            if lanes:
+                lanes.apply_backpressure(consumer, self.max_pending_records)
+            if commits:
+                commits.collect()
+                commits.maybe_commit()
+            if self.metrics_interval and time.monotonic() >= next_metrics:
+                next_metrics = time.monotonic() + self.metrics_interval
+                self._collect_consumer_metrics(consumer, index)
+        if lanes:
+            lanes.stop()
+        if commits:
+            commits.collect()
+            commits.commit(sync=True)
         consumer.close()
 
+    def _decode(self, tp: TopicPartition, records) -> Tuple[List[int], List[Message]]:
+        """
+        Convert the records of a partition into messages, skipping invalid records.
+        Records are decoded here rather than by the consumer, so an invalid record does not fail the whole poll.
+        :return: The offsets of the valid records, and their messages.
+        """
+        offsets = []
+        messages = []
+        for record in records:
+            try:
+                messages.append(self.codec.decode(record.value))
+            except Exception as e:
+                self.logger.error("Invalid message", topic=tp.topic, partition=tp.partition, offset=record.offset,
+                                  error=str(e))
+                continue
+            offsets.append(record.offset)
+        return offsets, messages
+
+    def _deliver_batches(self, tp: TopicPartition, messages: List[Message], offsets: Sequence[int] = (),
+                         finish: Optional[Callable[[Sequence[int]], None]] = None):
+        """
+        Deliver the messages of a partition in batches of up to `batch_size` messages.
+        :param finish: Optional callable reporting the offsets of records that are done, possibly after a retry.
+        :return: None
+        """
+        for i in range(0, len(messages), self.batch_size):
+            on_done = None
+            if finish is not None:
+                batch = offsets[i:i + self.batch_size]
+                on_done = lambda done, batch=batch: finish([batch[j] for j in done])
+            self.deliver(tp.topic, messages[i:i + self.batch_size], on_done)
+
+    @staticmethod
+    def _collect_consumer_metrics(consumer: KafkaConsumer, index: int):
+        """
+        Export the lag of the assigned partitions and the throughput of a consumer. Must run on the consumer thread.
+        The lag is computed from the high watermarks returned with the last fetches, so it costs no broker request.
+        :return: None
+        """
+        for tp in consumer.assignment():
+            highwater = consumer.highwater(tp)
+            if highwater is not None:
+                CONSUMER_LAG.labels(topic=tp.topic, partition=str(tp.partition)).set(
+                    max(0, highwater - consumer.position(tp)))
+        fetch_metrics = consumer.metrics().get("consumer-fetch-manager-metrics", {})
+        KAFKA_RECORDS_IN_RATE.labels(consumer=str(index)).set(fetch_metrics.get("records-consumed-rate", 0.0))
+        KAFKA_BYTES_IN_RATE.labels(consumer=str(index)).set(fetch_metrics.get("bytes-consumed-rate", 0.0))
+
+    def _collect_producer_metrics(self):
+        """
+        Export the throughput, queue depth and send latency of the producer, and schedule the next collection.
+        Runs on the scheduler thread every `metrics_interval` seconds while the bus is running.
+        :return: None
+        """
+        if not self.running:
+            return
+        producer_metrics = self.producer.metrics().get("producer-metrics", {})
+        KAFKA_RECORDS_OUT_RATE.set(producer_metrics.get("record-send-rate", 0.0))
+        KAFKA_BYTES_OUT_RATE.set(producer_metrics.get("outgoing-byte-rate", 0.0))
+        # Time in the accumulator plus the round trip of the produce request, reported in milliseconds
+        latency = producer_metrics.get("record-queue-time-avg", 0.0) + producer_metrics.get("request-latency-avg", 0.0)
+        KAFKA_SEND_LATENCY.set(latency / 1000)
+        KAFKA_PRODUCER_QUEUE.set(self._in_flight)
+        self._later(self.metrics_interval, self._collect_producer_metrics)
+
     def start(self):
         """
-        Start the Kafka event bus, initializing consumer threads for each subscribed topic.
+        Start the Kafka event bus with `consumers` consumer threads, each subscribed to all topics and patterns.
+        The consumers share the consumer group, so Kafka assigns each partition to one of them.
         :return: None
         """
         self.running = True
-        for topic in self.subscribers:
-            t = threading.Thread(target=self._consume, args=(topic,), daemon=True)
+        for i in range(self.consumers):
+            t = threading.Thread(target=self._consume, args=(i,), daemon=True, name=f"soma-kafka-{i}")
             self.consumer_threads.append(t)
             t.start()
+        if self.metrics_interval:
+            self._later(self.metrics_interval, self._collect_producer_metrics)
 
     def stop(self):
         """
         Stop the Kafka event bus, cleaning up resources and stopping consumer threads.
+        Messages still buffered by the producer are sent before returning.
         :return: None
         """
         self.running = False
         for t in self.consumer_threads:
             t.join(timeout=1.0)
         self.consumer_threads.clear()
+        self._stop_executor()
+        self.flush()
@@ -4,56 +4,330 @@
 # :license: MIT License
 
 import threading
-import queue
 import structlog
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 from soma.core.contracts.event_bus import EventBus, Subscriber, EventProducer, EventSubscriber
 from soma.core.contracts.message import Message
-from soma.eventbus.metrics import EVENT_LATENCY, EVENT_COUNT, EVENT_ERRORS
+from soma.eventbus.claim_check import ClaimCheck
+from soma.eventbus.compression import Compression
+from soma.eventbus.dedupe import Deduplicator
+from soma.eventbus.dispatcher import Dispatcher
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.topic_matcher import TopicMatcher, TopicPattern
+from soma.eventbus.segment_log import SegmentLog
+from soma.eventbus.timing_wheel import Scheduler
+from soma.eventbus.topic_queue import TopicQueue, KeyedTopicQueue, MemoryBudget, BackpressureError, message_size
+from soma.eventbus.worker_pool import TopicWorkerPool, KeyedWorkerPool, AdaptiveScaler
 
 
 class InMemoryEventBus(EventBus):
     """
     InMemoryEventBus: An in-memory implementation of an event bus for testing and local use.
     This class provides a simple event bus that allows publishing and subscribing to topics
+    Each topic is consumed by a pool of worker threads, so a slow handler does not hold up the whole topic
+    when more than one worker is configured. Workers are started by a dispatcher when messages arrive and exit
+    after being idle for `worker_keepalive` seconds, so idle topics use neither threads nor CPU.
+    With `key_lanes`, each topic is split into ordered lanes instead: messages with the same key are handled
+    in publish order, messages with different keys in parallel, like the partitions of a Kafka topic.
+    With `log_dir`, published messages are written to a durable segment log first, and messages that were not
+    handled completely are delivered again after a restart.
     """
 
     def __init__(self, **kwargs):
         """
         Initialize the InMemoryEventBus with empty queues and subscribers.
         :param policy_manager:
+        :param workers: Optional mapping of topic names to the number of worker threads consuming that topic.
+        :param default_workers: Number of worker threads for topics not listed in `workers` (default: 1).
+        :param adaptive: If True, worker pools are resized based on queue depth and handler latency.
+        :param min_workers: Lower bound for adaptive pool sizes (default: 1).
+        :param max_workers: Upper bound for adaptive pool sizes (default: 16).
+        :param target_backlog: Estimated time in seconds to drain a queue above which adaptive pools grow (default: 0.5).
+        :param adapt_interval: Time in seconds between two adaptive scaling decisions (default: 1.0).
+        :param max_queue_size: Maximum number of messages per topic queue. 0 means unbounded (default).
+        :param overflow: Policy applied when a queue is full: 'block', 'drop_oldest', 'drop_newest' or 'raise'.
+        :param put_timeout: Maximum time in seconds a publisher is blocked with the 'block' policy (default: wait forever).
+        :param max_bytes: Optional memory budget in message bytes shared by all topic queues of the bus.
+        :param batch_size: Maximum number of messages delivered to `handle_batch()` at once (default: 1, no batching).
+        :param batch_linger_ms: Maximum time in milliseconds to wait for a batch to fill up (default: 0).
+        :param worker_keepalive: Time in seconds an idle worker waits for further messages before it exits (default: 5).
+        :param key_lanes: Number of ordered lanes per topic, each consumed by one worker. Messages are assigned
+                          to lanes by the hash of their key. 0 disables lanes (default); `workers` and `adaptive`
+                          do not apply to topics with lanes.
+        :param log_dir: Directory of the durable segment log. None keeps messages in memory only (default).
+        :param log_segment_bytes: Size of a log segment file in bytes (default: 64 MiB).
+        :param log_fsync_messages: Number of messages after which the log is flushed to disk (default: 1000).
+        :param log_fsync_interval: Time in seconds after which the log is flushed to disk (default: 1.0).
+        :param log_retain_segments: Number of segments kept per topic once their messages are handled
+                                    (default: keep all).
+        :param log_codec: Serialization of logged messages: 'json' (default), 'orjson', 'msgpack' or a MessageCodec.
+        :param retry: Default RetryPolicy of subscribers (default: None, failed messages are dropped).
+        :param dead_letter_prefix: Prefix of the dead-letter topics (default: "dead_letter.").
+        :param scheduler: Scheduler for retries and delayed messages (default: the shared scheduler).
+        :param retry_workers: Number of threads running retries and publishing delayed messages (default: 4).
+        :param dedupe: Optional Deduplicator dropping messages whose source_id was delivered on the topic before.
+        :param claim_check: Optional ClaimCheck moving large content into a blob store while messages are queued
+                            and logged.
+        :param compression: Optional Compression of large content while messages are queued and logged.
         """
-        self.queues: Dict[str, queue.Queue] = {}
+        self.queues: Dict[str, Union[TopicQueue, KeyedTopicQueue]] = {}
         self.subscribers: Dict[str, List[Callable]] = {}
-        self.threads: List[threading.Thread] = []
+        self.pools: Dict[str, TopicWorkerPool] = {}
+        self.topic_matcher = TopicMatcher()
+        self._pool_lock = threading.RLock()
         self.running = False
         self.policy_manager = kwargs.get("policy_manager", None)
         self.logger = kwargs.get("logger", structlog.get_logger(__name__))
 
-        self.logger.info("InMemoryEventBus initialized", policy_manager=self.policy_manager)
+        self.max_queue_size: int = kwargs.get("max_queue_size", 0)
+        self.overflow: str = kwargs.get("overflow", "block")
+        self.put_timeout: Optional[float] = kwargs.get("put_timeout", None)
+        max_bytes = kwargs.get("max_bytes", None)
+        self.budget: Optional[MemoryBudget] = MemoryBudget(max_bytes) if max_bytes else None
 
-    def publish(self, topic: str, message: Message, key: Optional[str] = None):
+        self.batch_size: int = kwargs.get("batch_size", 1)
+        self.batch_linger_ms: float = kwargs.get("batch_linger_ms", 0)
+        self.key_lanes: int = kwargs.get("key_lanes", 0)
+        self.worker_keepalive: float = kwargs.get("worker_keepalive", 5.0)
+        self.retry: Optional[RetryPolicy] = kwargs.get("retry", None)
+        self.retry_policies: Dict[int, RetryPolicy] = {}
+        self.dead_letter_prefix: str = kwargs.get("dead_letter_prefix", "dead_letter.")
+        self.scheduler: Optional[Scheduler] = kwargs.get("scheduler", None)
+        self.retry_workers: int = kwargs.get("retry_workers", 4)
+        self.deduplicator: Optional[Deduplicator] = kwargs.get("dedupe", None)
+        self.claim_check: Optional[ClaimCheck] = kwargs.get("claim_check", None)
+        self.compression: Optional[Compression] = kwargs.get("compression", None)
+        self.dispatcher = Dispatcher(logger=self.logger)
+
+        self.workers: Dict[str, int] = dict(kwargs.get("workers", None) or {})
+        self.default_workers: int = kwargs.get("default_workers", 1)
+        self.scaler: Optional[AdaptiveScaler] = None
+        if kwargs.get("adaptive", False):
+            self.scaler = AdaptiveScaler(
+                # Resizing keyed pools would move keys to other lanes
+                lambda: [pool for pool in self.pools.values() if not isinstance(pool, KeyedWorkerPool)],
+                min_workers=kwargs.get("min_workers", 1),
+                max_workers=kwargs.get("max_workers", 16),
+                target_backlog=kwargs.get("target_backlog", 0.5),
+                interval=kwargs.get("adapt_interval", 1.0),
+            )
+
+        self.log: Optional[SegmentLog] = None
+        log_dir = kwargs.get("log_dir", None)
+        if log_dir:
+            self.log = SegmentLog(
+                log_dir,
+                segment_bytes=kwargs.get("log_segment_bytes", 64 << 20),
+                fsync_messages=kwargs.get("log_fsync_messages", 1000),
+                fsync_interval=kwargs.get("log_fsync_interval", 1.0),
+                retain_segments=kwargs.get("log_retain_segments", None),
+                codec=kwargs.get("log_codec", None),
+            )
+            self._restore()
+
+        self.logger.info("InMemoryEventBus initialized", policy_manager=self.policy_manager,
+                         workers=self.workers, default_workers=self.default_workers, adaptive=self.scaler is not None,
+                         max_queue_size=self.max_queue_size, overflow=self.overflow, max_bytes=max_bytes,
+                         key_lanes=self.key_lanes, log_dir=log_dir)
+
+    def _queue(self, topic: str) -> Union[TopicQueue, KeyedTopicQueue]:
+        """
+        Get the queue of a topic, creating it on first use.
+        :param topic: The topic name.
+        :return: The topic queue, split into lanes if `key_lanes` is configured.
+        """
+        if topic not in self.queues:
+            options = dict(
+                maxsize=self.max_queue_size,
+                overflow=self.overflow,
+                put_timeout=self.put_timeout,
+                budget=self.budget,
+            )
+            if self.log:
+                # Queues hold (offset, message) entries, so handled and dropped messages can be acknowledged
+                options.update(sizeof=lambda entry: message_size(entry[1]))
+            if self.log or self.claim_check:
+                options.update(on_discard=lambda entry: self._discard(topic, [entry]))
+            if self.key_lanes:
+                self.queues.setdefault(topic, KeyedTopicQueue(topic, self.key_lanes, **options))
+            else:
+                self.queues.setdefault(topic, TopicQueue(topic, **options))
+            # Topics created at runtime may match pattern subscriptions
+            if self.running:
+                self._ensure_pool(topic)
+        return self.queues[topic]
+
+    def _ensure_pool(self, topic: str):
+        """
+        Start a worker pool for a topic if it has subscribers and is not consumed yet.
+        :param topic: The topic name.
+        :return: None
+        """
+        if topic in self.pools or not self.subscribers_for(topic):
+            return
+        source = self._queue(topic)
+        with self._pool_lock:
+            if topic in self.pools or not self.running:
+                return
+            dispatch = self._deliver_logged if self.log else self.deliver
+            if isinstance(source, KeyedTopicQueue):
+                pool = KeyedWorkerPool(topic, source, dispatch,
+                                       batch_size=self.batch_size, linger=self.batch_linger_ms / 1000.0,
+                                       keepalive=self.worker_keepalive, notify=self.dispatcher.notify)
+            else:
+                pool = TopicWorkerPool(topic, source, dispatch,
+                                       size=self.workers.get(topic, self.default_workers),
+                                       batch_size=self.batch_size, linger=self.batch_linger_ms / 1000.0,
+                                       keepalive=self.worker_keepalive, notify=self.dispatcher.notify)
+            self.pools[topic] = pool
+            pool.start()
+
+    def _enqueue(self, topic: str, messages: Sequence[Message], keys: Sequence[Optional[str]]):
+        """
+        Append messages to the log, if enabled, and put them into the topic queue.
+        :return: None
+        :raises BackpressureError: If the topic queue is full and the overflow policy rejects a message.
+        """
+        q = self._queue(topic)
+        messages = self._encode(topic, messages)
+        if self.log is None and self.claim_check is None:
+            q.put_many(messages, keys=keys)
+            return
+
+        entries = list(zip(self.log.append(topic, messages, keys), messages)) if self.log else messages
+        for i, entry in enumerate(entries):
+            try:
+                q.put(entry, key=keys[i])
+            except BackpressureError:
+                # The publisher is told about the rejection, so the messages are not delivered after a restart
+                self._discard(topic, entries[i:])
+                raise
+
+    def _discard(self, topic: str, entries: Sequence):
+        """
+        Acknowledge messages that were dropped or rejected by a topic queue in the log, and release their claim
+        check references.
+        :param entries: The queue entries, (offset, message) tuples if the bus has a log.
+        :return: None
+        """
+        if self.log:
+            for offset, _ in entries:
+                self.log.ack(topic, offset)
+            entries = [message for _, message in entries]
+        if self.claim_check:
+            self.claim_check.release(entries)
+
+    def _deliver_logged(self, topic: str, entries: Sequence[Tuple[int, Message]]):
+        """
+        Deliver messages taken from a logged topic queue, and acknowledge each in the log once it is done,
+        i.e. after its last retry or its move to the dead-letter topic.
+        :return: None
+        """
+        def acknowledge(done: Sequence[int]):
+            for i in done:
+                self.log.ack(topic, entries[i][0])
+
+        self.deliver(topic, [message for _, message in entries], on_done=acknowledge)
+
+    def _restore(self):
+        """
+        Put the messages that were published, but not handled completely before the last shutdown,
+        back into the topic queues.
+        :return: None
+        """
+        for topic in self.log.topics():
+            offset = self.log.committed(topic)
+            while True:
+                records = self.log.read(topic, offset)
+                if not records:
+                    break
+                self._queue(topic).restore([(o, message) for o, _, message in records],
+                                           keys=[key for _, key, _ in records])
+                offset = records[-1][0] + 1
+            if offset > self.log.committed(topic):
+                self.logger.info("Restored messages from log", topic=topic, count=offset - self.log.committed(topic))
+
+    def replay(self, topic: str, handler: Subscriber, from_offset: int = 0, to_offset: Optional[int] = None) -> int:
+        """
+        Pass logged messages of a topic to a handler, e.g. to rebuild its state. Requires `log_dir`.
+        The messages are replayed synchronously, in log order, and independent of their delivery to subscribers.
+        :param topic: The topic to replay.
+        :param handler: An EventSubscriber or a callable invoked with each message.
+        :param from_offset: The offset of the first message to replay.
+        :param to_offset: The offset after the last message to replay. None replays up to the end of the log.
+        :return: The offset after the last replayed message, to resume from later.
+        """
+        if self.log is None:
+            raise RuntimeError("Replay requires a log, configure the bus with 'log_dir'")
+
+        handle = handler.handle if isinstance(handler, EventSubscriber) else handler
+        offset = from_offset
+        while to_offset is None or offset < to_offset:
+            records = self.log.read(topic, offset)
+            for record_offset, _, message in records:
+                if to_offset is not None and record_offset >= to_offset:
+                    return offset
+                handle(message)
+                offset = record_offset + 1
+            if not records:
+                break
+        return offset
+
+    def publish(self, topic: str, message: Message, key: Optional[str] = None, delay: Optional[float] = None):
         """
         Publish a message to a specific topic on the in-memory event bus.
         :param topic: The topic to which the message should be published.
         :param message: The message to be published, typically a dictionary containing the event data.
-        :param key: Optional key for the message, used for routing or identification purposes.
+        :param key: Optional key for the message. With `key_lanes`, messages with the same key are handled in order.
+        :param delay: Optional time in seconds after which the message is enqueued. Delayed messages are written
+                      to the log only when they are enqueued.
         :return: None
+        :raises BackpressureError: If the topic queue is full and the overflow policy rejects the message.
         """
         policy_violation = self.check_publish_policy(topic, message)
         if policy_violation:
             self.logger.warning(policy_violation, topic=topic, message=message)
             return
 
-        if topic not in self.queues:
-            self.queues[topic] = queue.Queue()
-        self.queues[topic].put(message)
+        if delay:
+            self._publish_later(delay, topic, message, key)
+            return
+        self._enqueue(topic, [message], [key])
 
-    def subscribe(self, topic: str, handler: Subscriber):
+    def _publish_unchecked(self, topic: str, message: Message, key: Optional[str] = None):
+        self._enqueue(topic, [message], [key])
+
+    def publish_many(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Publish a batch of messages to a specific topic on the in-memory event bus.
+        Policies are checked once per publishing agent, and the admitted messages are enqueued in bulk.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :param keys: Optional keys for the messages, in the same order as the messages.
+        :return: None
+        :raises BackpressureError: If the topic queue is full and the overflow policy rejects a message.
+        """
+        keys = self._batch_keys(messages, keys)
+        admitted, violations = self.check_publish_policy_many(topic, messages)
+        for policy_violation in violations:
+            self.logger.warning(policy_violation, topic=topic)
+        if not admitted:
+            return
+
+        if len(admitted) < len(messages):
+            messages = [messages[i] for i in admitted]
+            keys = [keys[i] for i in admitted]
+        self._enqueue(topic, messages, keys)
+
+    def subscribe(self, topic: TopicPattern, handler: Subscriber, workers: Optional[int] = None,
+                  retry: Optional[RetryPolicy] = None):
         """
         Subscribe to a specific topic on the in-memory event bus with a handler function.
-        :param topic: The topic to which the handler should subscribe.
+        :param topic: The topic to which the handler should subscribe, or a pattern matching several topics.
         :param handler: A callable function that will be invoked when a message is published to the topic.
+        :param workers: Optional number of worker threads consuming the topic. Overrides the configured value.
+                        Ignored for patterns and topics with key lanes.
+        :param retry: Optional retry policy for this subscriber, overriding the retry policy of the bus.
         :return: None
         """
         policy_violation = self.check_subscribe_policy(topic, handler)
@@ -61,59 +335,53 @@ class InMemoryEventBus(EventBus):
             self.logger.warning(policy_violation, topic=topic, handler=handler)
             return
 
-        if topic not in self.subscribers:
-            self.subscribers[topic] = []
-        self.subscribers[topic].append(handler)
+        self._add_subscriber(topic, handler, retry)
+        is_pattern = TopicMatcher.is_pattern(topic)
+
+        if workers is not None and not is_pattern:
+            self.workers[topic] = workers
+            if topic in self.pools and not isinstance(self.pools[topic], KeyedWorkerPool):
+                self.pools[topic].resize(workers)
+
+        if self.running:
+            for name in (list(self.queues) if is_pattern else [topic]):
+                self._ensure_pool(name)
 
         # Auto-inject EventBus into producer agents
         if isinstance(handler, EventProducer):
             if handler.event_bus is None:
                 handler.event_bus = self
 
-    def _consume(self, topic: str):
-        """
-        Consume messages from the specified topic's queue and invoke the registered handlers.
-        :param topic: The topic from which to consume messages.
-        :return: None
-        """
-        while self.running:
-            try:
-                msg = self.queues[topic].get(timeout=0.5)
-                for subscriber in self.subscribers.get(topic, []):
-                    agent_name = getattr(subscriber, "__name__", None) or getattr(subscriber, "name", "unknown")
-                    try:
-                        with EVENT_LATENCY.labels(topic=topic, agent=agent_name).time():
-                            if isinstance(subscriber, EventSubscriber):
-                                subscriber.handle(msg)
-                            else:
-                                subscriber(msg)
-
-                            EVENT_COUNT.labels(topic=topic, agent=agent_name).inc()
-                    except Exception as e:
-                        print(f"[InMemoryEventBus] Handler error on topic '{topic}': {e}")
-                        EVENT_ERRORS.labels(topic=topic, agent=agent_name).inc()
-            except queue.Empty:
-                continue
-
     def start(self):
         """
-        Start the in-memory event bus, initializing consumer threads for each subscribed topic.
+        Start the in-memory event bus, initializing a worker pool for each topic with subscribers.
         :return: None
         """
+        if self.log and self.log.closed:
+            self.log.reopen()
+        self.dispatcher.start()
         self.running = True
-        for topic in self.subscribers:
-            if topic not in self.queues:
-                self.queues[topic] = queue.Queue()
-            t = threading.Thread(target=self._consume, args=(topic,), daemon=True)
-            self.threads.append(t)
-            t.start()
+        for topic in list(self.subscribers) + list(self.queues):
+            self._ensure_pool(topic)
+
+        if self.scaler:
+            self.scaler.start()
 
     def stop(self):
         """
-        Stop the in-memory event bus, cleaning up resources and stopping consumer threads.
+        Stop the in-memory event bus, cleaning up resources and stopping worker pools.
         :return: None
         """
-        self.running = False
-        for t in self.threads:
-            t.join(timeout=1.0)
-        self.threads.clear()
+        with self._pool_lock:
+            self.running = False
+        if self.scaler:
+            self.scaler.stop()
+        self.dispatcher.stop()
+        for pool in self.pools.values():
+            pool.running = False
+        for pool in self.pools.values():
+            pool.stop()
+        self.pools.clear()
+        self._stop_executor()
+        if self.log:
+            self.log.close()
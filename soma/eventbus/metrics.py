@@ -28,4 +28,157 @@ RATE_LIMIT_USAGE = Gauge(
     "soma_event_rate_limit_usage",
     "Current rate limit usage ratio (0.0 to 1.0)",
     ["agent", "topic"]
-)
\ No newline at end of file
+)
+TOPIC_WORKERS = Gauge(
+    "soma_topic_workers",
+    "Number of worker threads consuming a topic",
+    ["topic"]
+)
+
+BACKPRESSURE_EVENTS = Counter(
+    "soma_backpressure_total",
+    "Total number of times backpressure was applied to a publisher (blocked, dropped_oldest, dropped_newest, rejected)",
+    ["topic", "action"]
+)
+
+BUS_MEMORY_BYTES = Gauge(
+    "soma_bus_memory_bytes",
+    "Message bytes currently held in the queues of the in-memory event bus"
+)
+
+IDLE_WAKEUPS = Counter(
+    "soma_idle_wakeups_total",
+    "Total number of times a worker or dispatcher thread woke up without a message to handle",
+    ["topic"]
+)
+
+RECEIVE_ERRORS = Counter(
+    "soma_shm_receive_errors_total",
+    "Total number of message batches received from another node that could not be enqueued, e.g. because the "
+    "topic queue rejected a message",
+    ["topic"]
+)
+
+RETRIES = Counter(
+    "soma_retries_total",
+    "Total number of times a message was scheduled for another delivery attempt after a handler error",
+    ["topic", "agent"]
+)
+
+DEAD_LETTERS = Counter(
+    "soma_dead_letters_total",
+    "Total number of messages moved to a dead-letter topic after the last delivery attempt failed",
+    ["topic", "agent"]
+)
+
+DUPLICATES = Counter(
+    "soma_duplicates_total",
+    "Total number of messages dropped because their source_id was seen before",
+    ["topic"]
+)
+
+CLAIM_CHECKS = Counter(
+    "soma_claim_checks_total",
+    "Total number of messages whose content was moved to the blob store",
+    ["topic"]
+)
+
+CLAIM_CHECK_BYTES = Counter(
+    "soma_claim_check_bytes_total",
+    "Total number of content bytes moved to the blob store",
+    ["topic"]
+)
+
+COMPRESSION_RATIO = Histogram(
+    "soma_compression_ratio",
+    "Ratio of content size to compressed size, including the Base64 encoding, per compressed message",
+    ["topic"],
+    buckets=(1, 1.25, 1.5, 2, 3, 4, 5, 7, 10, 15, 20)
+)
+
+COMPRESSION_CPU_SECONDS = Counter(
+    "soma_compression_cpu_seconds_total",
+    "Total CPU time spent compressing and decompressing message content",
+    ["operation"]
+)
+
+SCHEDULED_TASKS = Gauge(
+    "soma_scheduled_tasks",
+    "Number of retries and delayed messages waiting in the timing wheel"
+)
+
+PRODUCED_MESSAGES = Counter(
+    "soma_produced_messages_total",
+    "Total number of messages acknowledged by the Kafka brokers",
+    ["topic"]
+)
+
+PRODUCE_ERRORS = Counter(
+    "soma_produce_errors_total",
+    "Total number of messages the Kafka producer failed to send",
+    ["topic"]
+)
+
+COMMIT_LATENCY = Histogram(
+    "soma_kafka_commit_latency_seconds",
+    "Time from requesting an offset commit to its acknowledgement by the Kafka group coordinator"
+)
+
+COMMIT_FAILURES = Counter(
+    "soma_kafka_commit_failures_total",
+    "Total number of failed Kafka offset commits"
+)
+
+UNCOMMITTED_MESSAGES = Gauge(
+    "soma_kafka_uncommitted_messages",
+    "Number of fetched messages whose offsets are not committed yet, i.e. that would be delivered again after a crash",
+    ["topic", "partition"]
+)
+
+PAUSED_PARTITIONS = Gauge(
+    "soma_kafka_paused_partitions",
+    "Number of Kafka partitions paused because their worker has too many queued records"
+)
+
+CONSUMER_LAG = Gauge(
+    "soma_kafka_consumer_lag",
+    "Number of records in a partition behind the position of the consumer",
+    ["topic", "partition"]
+)
+
+REBALANCES = Counter(
+    "soma_kafka_rebalances_total",
+    "Total number of partition assignments received by the consumers of this process"
+)
+
+KAFKA_RECORDS_IN_RATE = Gauge(
+    "soma_kafka_records_in_per_second",
+    "Records fetched per second by a consumer, as measured by the Kafka client",
+    ["consumer"]
+)
+
+KAFKA_BYTES_IN_RATE = Gauge(
+    "soma_kafka_bytes_in_per_second",
+    "Bytes fetched per second by a consumer, as measured by the Kafka client",
+    ["consumer"]
+)
+
+KAFKA_RECORDS_OUT_RATE = Gauge(
+    "soma_kafka_records_out_per_second",
+    "Records sent per second by the producer, as measured by the Kafka client"
+)
+
+KAFKA_BYTES_OUT_RATE = Gauge(
+    "soma_kafka_bytes_out_per_second",
+    "Bytes sent per second by the producer, as measured by the Kafka client"
+)
+
+KAFKA_SEND_LATENCY = Gauge(
+    "soma_kafka_send_latency_seconds",
+    "Average time from handing a record to the producer until the brokers acknowledged it"
+)
+
+KAFKA_PRODUCER_QUEUE = Gauge(
+    "soma_kafka_producer_queue_messages",
+    "Number of messages handed to the producer and not yet acknowledged or failed"
+)
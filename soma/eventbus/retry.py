@@ -0,0 +1,51 @@
+# Retry Policy: How often and when a failed message is delivered to a subscriber again.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import random
+
+
+class RetryPolicy:
+    """
+    RetryPolicy: Retries with exponential backoff and jitter.
+    The delay before attempt `n + 1` is `initial_backoff * multiplier ** (n - 1)`, capped at `max_backoff`,
+    and reduced by a random fraction of up to `jitter`, so subscribers failing together do not retry in lockstep.
+    """
+
+    def __init__(self, max_attempts: int = 3, initial_backoff: float = 1.0, max_backoff: float = 60.0,
+                 multiplier: float = 2.0, jitter: float = 0.5, dead_letter: bool = True):
+        """
+        Initialize the policy.
+        :param max_attempts: Maximum number of delivery attempts, including the first one.
+        :param initial_backoff: Delay in seconds before the first retry.
+        :param max_backoff: Maximum delay in seconds between two attempts.
+        :param multiplier: Factor by which the delay grows with each attempt.
+        :param jitter: Maximum fraction by which a delay is randomly shortened, between 0 and 1.
+        :param dead_letter: If True, messages are published to the dead-letter topic after the last failed attempt.
+        """
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {max_attempts}")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"jitter must be between 0 and 1, got {jitter}")
+
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.dead_letter = dead_letter
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Compute the delay after a failed attempt.
+        :param attempt: The number of the failed attempt, starting at 1.
+        :return: The delay in seconds.
+        """
+        delay = min(self.max_backoff, self.initial_backoff * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def __repr__(self):
+        return (f"RetryPolicy(max_attempts={self.max_attempts}, initial_backoff={self.initial_backoff}, "
+                f"max_backoff={self.max_backoff}, multiplier={self.multiplier}, jitter={self.jitter}, "
+                f"dead_letter={self.dead_letter})")
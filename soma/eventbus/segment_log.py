@@ -0,0 +1,505 @@
+# Segment Log: Durable, append-only log of the messages published to the in-memory event bus.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote, unquote
+
+import structlog
+
+from soma.core.contracts.message import Message
+from soma.eventbus.codec import MessageCodec, get_codec
+
+_HEADER = struct.Struct("<II")  # Payload length, CRC32 of the payload
+_POSITION = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+_KEY_LENGTH = struct.Struct("<H")
+_NO_KEY = 0xFFFF
+
+
+def _encode(codec: MessageCodec, message: Message, key: Optional[str]) -> bytes:
+    if key is None:
+        return _KEY_LENGTH.pack(_NO_KEY) + codec.encode(message)
+    encoded_key = key.encode("utf-8")
+    return _KEY_LENGTH.pack(len(encoded_key)) + encoded_key + codec.encode(message)
+
+
+def _decode(codec: MessageCodec, payload: bytes) -> Tuple[Optional[str], Message]:
+    size = _KEY_LENGTH.unpack_from(payload)[0]
+    if size == _NO_KEY:
+        return None, codec.decode(payload[_KEY_LENGTH.size:])
+    end = _KEY_LENGTH.size + size
+    return payload[_KEY_LENGTH.size:end].decode("utf-8"), codec.decode(payload[end:])
+
+
+class _Segment:
+    """
+    One segment of a topic log: a memory-mapped data file holding CRC-protected records, and an index file
+    holding the position of each record, so a record is found by its offset without scanning.
+    Only the newest segment of a topic is active, i.e. writable; it is preallocated to its capacity.
+    """
+
+    def __init__(self, directory: str, base: int, capacity: int, active: bool):
+        self.base = base
+        self.path = os.path.join(directory, f"{base:020d}.log")
+        self.index_path = os.path.join(directory, f"{base:020d}.index")
+        self.active = active
+        self.positions: List[int] = []
+        self.size = 0
+
+        self.file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        if active and os.fstat(self.file.fileno()).st_size < capacity:
+            self.file.truncate(capacity)
+        self.capacity = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.capacity, access=mmap.ACCESS_WRITE if active else mmap.ACCESS_READ)
+        self._recover()
+        self.index = open(self.index_path, "ab")
+
+    def _valid(self, position: int) -> int:
+        """
+        Check the record at a position.
+        :return: The position after the record, or -1 if there is no intact record.
+        """
+        if position + _HEADER.size > self.capacity:
+            return -1
+        length, crc = _HEADER.unpack_from(self.map, position)
+        end = position + _HEADER.size + length
+        if length == 0 or end > self.capacity or zlib.crc32(self.map[position + _HEADER.size:end]) != crc:
+            return -1
+        return end
+
+    def _recover(self):
+        """
+        Load the index, drop entries of torn records and index records written after the last index flush.
+        :return: None
+        """
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            self.positions = [p for (p,) in _POSITION.iter_unpack(data[:len(data) - len(data) % _POSITION.size])]
+
+        while self.positions and self._valid(self.positions[-1]) < 0:
+            self.positions.pop()
+        position = self._valid(self.positions[-1]) if self.positions else 0
+        indexed = len(self.positions)
+        while True:
+            end = self._valid(position)
+            if end < 0:
+                break
+            self.positions.append(position)
+            position = end
+        self.size = position
+
+        if self.active and position + _HEADER.size <= self.capacity and any(self.map[position:position + _HEADER.size]):
+            # A torn record; clear the rest, so no stale record can reappear behind the next append
+            self.map[position:] = bytes(self.capacity - position)
+
+        stale = not os.path.exists(self.index_path) or os.path.getsize(self.index_path) != indexed * _POSITION.size
+        if stale or indexed != len(self.positions):
+            with open(self.index_path, "wb") as f:
+                f.write(b"".join(_POSITION.pack(p) for p in self.positions))
+
+    def append(self, payload: bytes) -> bool:
+        """
+        Append a record.
+        :return: False if the record does not fit into the segment.
+        """
+        end = self.size + _HEADER.size + len(payload)
+        if end > self.capacity:
+            return False
+        _HEADER.pack_into(self.map, self.size, len(payload), zlib.crc32(payload))
+        self.map[self.size + _HEADER.size:end] = payload
+        self.positions.append(self.size)
+        self.index.write(_POSITION.pack(self.size))
+        self.size = end
+        return True
+
+    def read(self, relative: int) -> bytes:
+        position = self.positions[relative]
+        length = _HEADER.unpack_from(self.map, position)[0]
+        return self.map[position + _HEADER.size:position + _HEADER.size + length]
+
+    def sync(self):
+        if self.active:
+            self.map.flush()
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    def seal(self):
+        """
+        Make the segment read-only and shrink its file to the records it holds.
+        :return: None
+        """
+        self.sync()
+        self.map.close()
+        self.file.truncate(self.size)
+        self.active = False
+        self.capacity = self.size
+        self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.sync()
+        self.map.close()
+        if self.active:
+            self.file.truncate(self.size)
+        self.file.close()
+        self.index.close()
+
+    def delete(self):
+        self.map.close()
+        self.file.close()
+        self.index.close()
+        os.remove(self.path)
+        os.remove(self.index_path)
+
+
+class TopicLog:
+    """
+    TopicLog: The segments of one topic, and the committed offset, i.e. the offset of the first message
+    that was not yet handled completely. Messages are acknowledged individually and possibly out of order;
+    the committed offset advances over all acknowledged messages in front of it.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log"))
+        self.segments = [_Segment(directory, base, segment_bytes, active=i == len(bases) - 1)
+                         for i, base in enumerate(bases)]
+        if not self.segments:
+            self.segments = [_Segment(directory, 0, segment_bytes, active=True)]
+
+        self.committed_path = os.path.join(directory, "committed")
+        self.committed = self.start_offset
+        if os.path.exists(self.committed_path):
+            with open(self.committed_path, "rb") as f:
+                self.committed = max(_OFFSET.unpack(f.read(_OFFSET.size))[0], self.start_offset)
+        self.unsynced = 0
+        self.synced_committed = self.committed
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        self._acknowledged = set()
+
+    @property
+    def dirty(self) -> bool:
+        """
+        :return: True if records were appended or the committed offset moved since the last sync.
+        """
+        return self.unsynced > 0 or self.committed != self.synced_committed
+
+    @property
+    def start_offset(self) -> int:
+        return self.segments[0].base
+
+    @property
+    def end_offset(self) -> int:
+        return self.segments[-1].base + len(self.segments[-1].positions)
+
+    def append(self, payloads: Sequence[bytes]) -> int:
+        """
+        Append records, starting a new segment when the active one is full.
+        :return: The offset of the first record.
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError(f"Topic log '{self.directory}' is closed")
+            first = self.end_offset
+            for payload in payloads:
+                if not self.segments[-1].append(payload):
+                    if self.segments[-1].positions:
+                        self.segments[-1].seal()
+                    else:
+                        # The record is larger than a segment; replace the empty segment by a larger one
+                        self.segments.pop().delete()
+                    capacity = max(self.segment_bytes, _HEADER.size + len(payload))
+                    self.segments.append(_Segment(self.directory, self.end_offset, capacity, active=True))
+                    self.segments[-1].append(payload)
+            self.unsynced += len(payloads)
+            return first
+
+    def read(self, offset: int, max_records: int) -> List[Tuple[int, bytes]]:
+        with self.lock:
+            if self.closed:
+                raise ValueError(f"Topic log '{self.directory}' is closed")
+            if offset < self.start_offset:
+                raise ValueError(f"Offset {offset} was removed, the log starts at {self.start_offset}")
+            records = []
+            i = bisect.bisect_right([segment.base for segment in self.segments], offset) - 1
+            while i < len(self.segments) and len(records) < max_records:
+                segment = self.segments[i]
+                for relative in range(offset - segment.base, min(len(segment.positions),
+                                                                  offset - segment.base + max_records - len(records))):
+                    records.append((offset, bytes(segment.read(relative))))
+                    offset += 1
+                i += 1
+            return records
+
+    def ack(self, offset: int):
+        with self.lock:
+            if offset < self.committed:
+                return
+            self._acknowledged.add(offset)
+            while self.committed in self._acknowledged:
+                self._acknowledged.remove(self.committed)
+                self.committed += 1
+
+    def seek(self, offset: int):
+        with self.lock:
+            self.committed = max(self.start_offset, min(offset, self.end_offset))
+            self._acknowledged = {o for o in self._acknowledged if o > self.committed}
+
+    def sync(self, retain_segments: Optional[int] = None):
+        """
+        Flush the active segment, the index and the committed offset to disk, and remove old segments.
+        :param retain_segments: Number of segments to keep at least. Only segments whose messages are all committed
+                                are removed. None keeps all segments.
+        :return: None
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.segments[-1].sync()
+            tmp = self.committed_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(_OFFSET.pack(self.committed))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.committed_path)
+            self.synced_committed = self.committed
+
+            if retain_segments is not None:
+                while len(self.segments) > max(retain_segments, 1) and self.segments[1].base <= self.committed:
+                    self.segments.pop(0).delete()
+
+            self.unsynced = 0
+            self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.closed = True
+
+
+class SegmentLog:
+    """
+    SegmentLog: A write-ahead log for the in-memory event bus, so queued messages survive a restart.
+
+    Each topic has its own directory of segments. A segment is a memory-mapped file of length-prefixed,
+    CRC32-protected records, with an index file mapping offsets to positions, so reading from any offset
+    does not require scanning. Torn records at the end of a segment are detected and discarded on startup.
+
+    Writes to the memory mapping survive a crash of the process immediately. To survive a crash of the operating
+    system, the log is flushed to disk after `fsync_messages` appended messages or `fsync_interval` seconds,
+    whatever comes first. The message count is checked when messages are appended or acknowledged; the interval
+    is also checked by a background thread, so writes are flushed while the log is idle.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 << 20, fsync_messages: int = 1000,
+                 fsync_interval: Optional[float] = 1.0, retain_segments: Optional[int] = None,
+                 codec: Union[str, MessageCodec, None] = None):
+        """
+        Open or create a log.
+        :param directory: The directory holding the log.
+        :param segment_bytes: Size of a segment file in bytes (default: 64 MiB).
+        :param fsync_messages: Number of appended messages after which the log is flushed to disk. 0 disables.
+        :param fsync_interval: Time in seconds after which the log is flushed to disk. None disables.
+        :param retain_segments: Number of segments kept per topic. Older segments are removed once all their
+                                messages are committed. None keeps all segments (default).
+        :param codec: Serialization of messages: 'json' (default), 'orjson', 'msgpack' or a MessageCodec.
+                      Messages written with any known codec are read, so the codec of an existing log can be changed.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_messages = fsync_messages
+        self.fsync_interval = fsync_interval
+        self.retain_segments = retain_segments
+        self.codec = get_codec(codec)
+        self.closed = False
+        self.logger = structlog.get_logger(__name__)
+        self._topics: Dict[str, TopicLog] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def _topic(self, topic: str, create: bool = True) -> Optional[TopicLog]:
+        """
+        Get the log of a topic, opening it on first use.
+        :param topic: The topic.
+        :param create: If False, the log of a topic without a directory is not created.
+        :return: The log of the topic, or None if it does not exist and `create` is False.
+        :raises ValueError: If the log was closed.
+        """
+        log = self._topics.get(topic)
+        if log is None:
+            with self._lock:
+                if self.closed:
+                    raise ValueError(f"Segment log '{self.directory}' is closed")
+                log = self._topics.get(topic)
+                if log is None:
+                    directory = os.path.join(self.directory, quote(topic, safe=""))
+                    if not create and not os.path.isdir(directory):
+                        return None
+                    log = TopicLog(directory, self.segment_bytes)
+                    self._topics[topic] = log
+        return log
+
+    def _maybe_sync(self, log: TopicLog):
+        if (self.fsync_messages and log.unsynced >= self.fsync_messages) or \
+                (self.fsync_interval is not None and time.monotonic() - log.last_sync >= self.fsync_interval):
+            log.sync(self.retain_segments)
+        elif self._flusher is None and self.fsync_interval is not None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        """
+        Start the thread flushing idle topics, unless it runs already.
+        :return: None
+        """
+        with self._lock:
+            if self._flusher is not None or self.closed:
+                return
+            self._stopping = threading.Event()
+            self._flusher = threading.Thread(target=self._flush_idle, args=(self._stopping,), daemon=True,
+                                             name="soma-segment-log")
+            self._flusher.start()
+
+    def _flush_idle(self, stopping: threading.Event):
+        """
+        Flusher loop: flush topics whose last flush is `fsync_interval` seconds ago and that were written since.
+        :param stopping: Set when the log is closed.
+        :return: None
+        """
+        timeout = self.fsync_interval
+        while not stopping.wait(timeout):
+            timeout = self.fsync_interval
+            for log in list(self._topics.values()):
+                if not log.dirty:
+                    continue
+                remaining = log.last_sync + self.fsync_interval - time.monotonic()
+                if remaining > 0:
+                    timeout = min(timeout, remaining)
+                    continue
+                try:
+                    log.sync(self.retain_segments)
+                except Exception as e:
+                    self.logger.error("Failed to flush the segment log", directory=log.directory, error=str(e))
+
+    def topics(self) -> List[str]:
+        """
+        :return: The topics present in the log.
+        """
+        names = {unquote(name) for name in os.listdir(self.directory)
+                 if os.path.isdir(os.path.join(self.directory, name))}
+        return sorted(names | set(self._topics))
+
+    def append(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None) -> range:
+        """
+        Append messages to the log of a topic.
+        :param topic: The topic.
+        :param messages: The messages.
+        :param keys: Optional keys, in the same order as the messages.
+        :return: The offsets assigned to the messages.
+        """
+        log = self._topic(topic)
+        first = log.append([_encode(self.codec, message, keys[i] if keys else None) for i, message in enumerate(messages)])
+        self._maybe_sync(log)
+        return range(first, first + len(messages))
+
+    def read(self, topic: str, offset: int, max_messages: int = 1000) -> List[Tuple[int, Optional[str], Message]]:
+        """
+        Read messages starting at an offset.
+        :param topic: The topic.
+        :param offset: The offset of the first message.
+        :param max_messages: Maximum number of messages to return.
+        :return: Tuples of offset, key and message. Empty if there are no messages at or after the offset.
+        :raises ValueError: If the offset was removed by retention.
+        """
+        log = self._topic(topic, create=False)
+        if log is None:
+            return []
+        return [(o, *_decode(self.codec, payload)) for o, payload in log.read(offset, max_messages)]
+
+    def ack(self, topic: str, offset: int):
+        """
+        Acknowledge that a message was handled. Acknowledgements arriving after close() are ignored; the
+        message is delivered again after a restart.
+        :param topic: The topic.
+        :param offset: The offset of the message.
+        :return: None
+        """
+        if self.closed:
+            return
+        log = self._topic(topic, create=False)
+        if log is None:
+            return
+        log.ack(offset)
+        self._maybe_sync(log)
+
+    def committed(self, topic: str) -> int:
+        """
+        :return: The offset of the first message of a topic that was not acknowledged yet.
+        """
+        log = self._topic(topic, create=False)
+        return log.committed if log is not None else 0
+
+    def end_offset(self, topic: str) -> int:
+        """
+        :return: The offset the next message appended to a topic will get.
+        """
+        log = self._topic(topic, create=False)
+        return log.end_offset if log is not None else 0
+
+    def seek(self, topic: str, offset: int):
+        """
+        Move the committed offset of a topic, e.g. to redeliver messages after the next restart.
+        :param topic: The topic.
+        :param offset: The new committed offset.
+        :return: None
+        """
+        self._topic(topic).seek(offset)
+
+    def sync(self):
+        """
+        Flush all topics to disk.
+        :return: None
+        """
+        for log in list(self._topics.values()):
+            log.sync(self.retain_segments)
+
+    def close(self):
+        """
+        Flush and close all topics, unmapping their segments. Further use raises a ValueError, until reopen().
+        :return: None
+        """
+        with self._lock:
+            self.closed = True
+            flusher, self._flusher = self._flusher, None
+            self._stopping.set()
+        if flusher is not None:
+            flusher.join()
+        with self._lock:
+            for log in self._topics.values():
+                log.close()
+            self._topics.clear()
+
+    def reopen(self):
+        """
+        Allow using a closed log again. Topics are opened again on first use.
+        :return: None
+        """
+        with self._lock:
+            self.closed = False
@@ -0,0 +1,323 @@
+# Shared Memory Event Bus: Event bus spanning several local processes.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import itertools
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import structlog
+
+from soma.core.contracts.event_bus import EventBus, Subscriber
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.metrics import RECEIVE_ERRORS
+from soma.eventbus.shm_ring import Doorbell, ShmRingBuffer
+from soma.eventbus.topic_queue import BackpressureError
+from soma.eventbus.topic_matcher import TopicPattern
+
+_LENGTH = struct.Struct("<H")
+_NO_KEY = 0xFFFF
+
+
+class SharedMemoryEventBus(EventBus):
+    """
+    SharedMemoryEventBus: An event bus for several processes on the same host, e.g. to spread CPU-heavy agents
+    over several cores without running Kafka.
+
+    The processes form a group of `nodes` members, each running its own bus instance with a distinct `node_id`
+    and, usually, the same agents. Like a Kafka consumer group, every message is handled by exactly one node:
+    messages with a key go to the node selected by the key's hash, so they stay in order, and messages without
+    a key are distributed round-robin. On the receiving node, the message is delivered to the local subscribers
+    by an embedded InMemoryEventBus, so worker pools, batching and pattern subscriptions work as usual.
+
+    Each ordered pair of nodes is connected by a single-producer, single-consumer ShmRingBuffer. Producers ring
+    the Doorbell of the receiving node after adding records, so an idle receiver blocks instead of polling.
+    Messages for the own node bypass serialization and go directly to the local queues.
+    """
+
+    def __init__(self, name: str, node_id: int, nodes: int, **kwargs):
+        """
+        Initialize the bus and create the inbound rings of this node.
+        :param name: Name of the group, used as prefix for the shared memory segments.
+        :param node_id: Index of this node, from 0 to `nodes - 1`.
+        :param nodes: Number of nodes in the group.
+        :param policy_manager:
+        :param ring_capacity: Size of each ring in bytes (default: 4 MiB).
+        :param put_timeout: Maximum time in seconds to wait for room in a full ring (default: wait forever).
+        :param max_idle_sleep: Maximum time in seconds the receiver waits for the doorbell while all rings are empty,
+                               before it looks at the rings again (default: 0.5).
+        :param attach_timeout: Maximum time in seconds to wait for a peer to create its rings (default: 10).
+        Other keyword arguments configure the embedded InMemoryEventBus, including `retry`, `scheduler` and `dedupe`:
+        failed messages are retried, and moved to dead-letter topics, on the node that handled them.
+        """
+        if not 0 <= node_id < nodes:
+            raise ValueError(f"node_id must be between 0 and {nodes - 1}, got {node_id}")
+
+        self.name = name
+        self.node_id = node_id
+        self.nodes = nodes
+        self.policy_manager = kwargs.pop("policy_manager", None)
+        self.logger = kwargs.get("logger", structlog.get_logger(__name__))
+        self.ring_capacity: int = kwargs.pop("ring_capacity", 4 << 20)
+        self.put_timeout: Optional[float] = kwargs.pop("put_timeout", None)
+        self.max_idle_sleep: float = kwargs.pop("max_idle_sleep", 0.5)
+        self.attach_timeout: float = kwargs.pop("attach_timeout", 10.0)
+        self.running = False
+
+        # Policies are checked once, when publishing on the sending node
+        self.local = InMemoryEventBus(**kwargs)
+        self.queues = self.local.queues
+        self.subscribers = self.local.subscribers
+        self.topic_matcher = self.local.topic_matcher
+        self.retry_policies = self.local.retry_policies
+        self.scheduler = self.local.scheduler
+
+        # The doorbell exists before the rings, so producers attaching to a ring find it
+        self.doorbell = Doorbell(self._doorbell_name(node_id), create=True)
+        self.inbound: List[ShmRingBuffer] = [
+            ShmRingBuffer(self._ring_name(src, node_id), self.ring_capacity, create=True) for src in range(nodes)
+        ]
+        self.outbound: Dict[int, ShmRingBuffer] = {}
+        self._doorbells: Dict[int, Doorbell] = {}
+        self._outbound_locks = [threading.Lock() for _ in range(nodes)]
+        self._round_robin = itertools.cycle(range(nodes))
+        self._receiver: Optional[threading.Thread] = None
+
+        self.logger.info("SharedMemoryEventBus initialized", name=name, node_id=node_id, nodes=nodes,
+                         ring_capacity=self.ring_capacity, policy_manager=self.policy_manager)
+
+    def _ring_name(self, src: int, dst: int) -> str:
+        return f"{self.name}-{src}-{dst}"
+
+    def _doorbell_name(self, node: int) -> str:
+        return f"{self.name}-{node}"
+
+    def _route(self, key: Optional[str]) -> int:
+        """
+        Select the node handling a message. Uses CRC32, as Python's hash() differs between processes.
+        :param key: The message key or None.
+        :return: The node index.
+        """
+        if key is None:
+            return next(self._round_robin)
+        return zlib.crc32(key.encode("utf-8")) % self.nodes
+
+    def _ring_to(self, node: int) -> ShmRingBuffer:
+        """
+        Get the outbound ring to a node, attaching to it on first use.
+        :param node: The node index.
+        :return: The ring buffer.
+        """
+        ring = self.outbound.get(node)
+        if ring is None:
+            deadline = time.monotonic() + self.attach_timeout
+            while True:
+                try:
+                    ring = ShmRingBuffer(self._ring_name(self.node_id, node))
+                    break
+                except FileNotFoundError:
+                    if time.monotonic() >= deadline:
+                        raise
+                    time.sleep(0.05)
+            self.outbound[node] = ring
+            self._doorbells[node] = Doorbell(self._doorbell_name(node))
+        return ring
+
+    @staticmethod
+    def encode(topic: str, message: Message, key: Optional[str] = None) -> bytes:
+        """
+        Serialize a message for the ring: topic length, topic, key length, key, JSON encoded message.
+        The key is kept, so the receiving node can keep messages with the same key in order.
+        """
+        encoded_topic = topic.encode("utf-8")
+        record = _LENGTH.pack(len(encoded_topic)) + encoded_topic
+        if key is None:
+            record += _LENGTH.pack(_NO_KEY)
+        else:
+            encoded_key = key.encode("utf-8")
+            record += _LENGTH.pack(len(encoded_key)) + encoded_key
+        return record + message.model_dump_json().encode("utf-8")
+
+    @staticmethod
+    def decode(record: bytes) -> tuple[str, Optional[str], Message]:
+        """
+        Deserialize a record written by encode().
+        :return: The topic, the key and the message.
+        """
+        size = _LENGTH.unpack_from(record)[0]
+        offset = _LENGTH.size + size
+        topic = record[_LENGTH.size:offset].decode("utf-8")
+        size = _LENGTH.unpack_from(record, offset)[0]
+        offset += _LENGTH.size
+        key = None
+        if size != _NO_KEY:
+            key = record[offset:offset + size].decode("utf-8")
+            offset += size
+        return topic, key, Message.model_validate_json(record[offset:])
+
+    def publish(self, topic: str, message: Message, key: Optional[str] = None, delay: Optional[float] = None):
+        """
+        Publish a message to a specific topic. The message is handled by exactly one node of the group.
+        :param topic: The topic to which the message should be published.
+        :param message: The message to be published.
+        :param key: Optional key; messages with the same key are handled by the same node, in order.
+        :param delay: Optional time in seconds after which the message is sent. Until then, it is kept
+                      in the memory of the publishing process.
+        :return: None
+        :raises BackpressureError: If the ring to the target node stays full for `put_timeout` seconds.
+        """
+        policy_violation = self.check_publish_policy(topic, message)
+        if policy_violation:
+            self.logger.warning(policy_violation, topic=topic, message=message)
+            return
+
+        if delay:
+            self._publish_later(delay, topic, message, key)
+            return
+        self._publish_unchecked(topic, message, key)
+
+    def _publish_unchecked(self, topic: str, message: Message, key: Optional[str] = None):
+        self._send(self._route(key), topic, [message], [key])
+
+    def publish_many(self, topic: str, messages: Sequence[Message], keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Publish a batch of messages to a specific topic, checking policies once per publishing agent.
+        :param topic: The topic to which the messages should be published.
+        :param messages: The messages to be published.
+        :param keys: Optional keys for the messages, in the same order as the messages.
+        :return: None
+        """
+        keys = self._batch_keys(messages, keys)
+        admitted, violations = self.check_publish_policy_many(topic, messages)
+        for policy_violation in violations:
+            self.logger.warning(policy_violation, topic=topic)
+
+        by_node: Dict[int, Tuple[List[Message], List[Optional[str]]]] = {}
+        for i in admitted:
+            batch, batch_keys = by_node.setdefault(self._route(keys[i]), ([], []))
+            batch.append(messages[i])
+            batch_keys.append(keys[i])
+        for node, (batch, batch_keys) in by_node.items():
+            self._send(node, topic, batch, batch_keys)
+
+    def _send(self, node: int, topic: str, messages: List[Message], keys: List[Optional[str]]):
+        """
+        Hand messages to a node, directly for the own node, through its ring otherwise.
+        :return: None
+        """
+        if node == self.node_id:
+            self.local._enqueue(topic, messages, keys)
+            return
+
+        records = [self.encode(topic, message, key) for message, key in zip(messages, keys)]
+        # Rings have a single producer, so threads of this process take turns
+        with self._outbound_locks[node]:
+            ring = self._ring_to(node)
+            doorbell = self._doorbells[node]
+            try:
+                for record in records:
+                    try:
+                        ring.put(record, timeout=0)
+                    except BackpressureError:
+                        # Make sure the receiver is draining the ring while waiting for room
+                        doorbell.ring()
+                        ring.put(record, timeout=self.put_timeout)
+            finally:
+                doorbell.ring()
+
+    def subscribe(self, topic: TopicPattern, handler: Subscriber, **kwargs):
+        """
+        Subscribe a local handler to a topic or pattern. See InMemoryEventBus.subscribe().
+        All nodes of a group should subscribe to the same topics, as messages are routed without
+        knowledge of the subscriptions of other nodes.
+        :param topic: The topic to which the handler should subscribe, or a pattern matching several topics.
+        :param handler: A callable function that will be invoked when a message is published to the topic.
+        :return: None
+        """
+        policy_violation = self.check_subscribe_policy(topic, handler)
+        if policy_violation:
+            self.logger.warning(policy_violation, topic=topic, handler=handler)
+            return
+
+        self.local.subscribe(topic, handler, **kwargs)
+        # Producer agents publish through the group, not only the local bus
+        if getattr(handler, "event_bus", None) is self.local:
+            handler.event_bus = self
+
+    def start(self):
+        """
+        Start local delivery and the thread receiving messages from the other nodes.
+        :return: None
+        """
+        self.running = True
+        self.local.start()
+        self._receiver = threading.Thread(target=self._receive, daemon=True, name=f"soma-shm-{self.node_id}")
+        self._receiver.start()
+
+    def stop(self):
+        """
+        Stop receiving and local delivery. The rings stay available until close() is called.
+        :return: None
+        """
+        self.running = False
+        if self._receiver:
+            self.doorbell.ring()
+            self._receiver.join(timeout=1.0)
+            self._receiver = None
+        self.local.stop()
+        self._stop_executor()
+
+    def close(self):
+        """
+        Release the shared memory. The inbound rings of this node are removed.
+        :return: None
+        """
+        if self.running:
+            self.stop()
+        for ring in list(self.outbound.values()) + self.inbound:
+            ring.close()
+        for doorbell in list(self._doorbells.values()) + [self.doorbell]:
+            doorbell.close()
+        self.outbound.clear()
+        self._doorbells.clear()
+        self.inbound = []
+
+    def _receive(self):
+        """
+        Receiver loop: move records from the inbound rings into the local topic queues.
+        Waits for the doorbell, up to `max_idle_sleep`, while all rings are empty.
+        :return: None
+        """
+        while self.running:
+            received = False
+            for ring in self.inbound:
+                records = ring.get_many()
+                if not records:
+                    continue
+                received = True
+                by_topic: Dict[str, Tuple[List[Message], List[Optional[str]]]] = {}
+                for record in records:
+                    try:
+                        topic, key, message = self.decode(record)
+                    except Exception as e:
+                        self.logger.error("Invalid record", ring=ring.name, error=str(e))
+                        continue
+                    messages, keys = by_topic.setdefault(topic, ([], []))
+                    messages.append(message)
+                    keys.append(key)
+                for topic, (messages, keys) in by_topic.items():
+                    try:
+                        self.local._enqueue(topic, messages, keys)
+                    except Exception as e:
+                        # The sender cannot be told, so the receiver carries on with the other topics
+                        RECEIVE_ERRORS.labels(topic=topic).inc()
+                        self.logger.error("Failed to enqueue received messages", topic=topic, ring=ring.name,
+                                          messages=len(messages), error=str(e))
+
+            if not received:
+                self.doorbell.wait(self.max_idle_sleep)
@@ -0,0 +1,297 @@
+# Shared Memory Ring Buffer: Single-producer, single-consumer byte ring for inter-process messaging.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import errno
+import fcntl
+import os
+import platform
+import select
+import struct
+import sys
+import tempfile
+import time
+from multiprocessing import shared_memory, resource_tracker
+from typing import List, Optional
+
+from soma.eventbus.topic_queue import BackpressureError
+
+_COUNTER = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+
+# Head and tail live on separate cache lines, so producer and consumer do not invalidate each other's line
+_HEAD_OFFSET = 0
+_TAIL_OFFSET = 64
+_DATA_OFFSET = 128
+
+# CPUs with total store order: stores become visible to other cores in program order
+_ORDERED_MACHINES = {"x86_64", "amd64", "i386", "i686", "x86"}
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without registering it with the resource tracker.
+    Otherwise the tracker would remove the segment when this process exits, although another process owns it,
+    see https://github.com/python/cpython/issues/82300
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _remove_stale_segment(name: str):
+    """
+    Remove a segment left over by a crashed process. It is not registered with the resource tracker of this
+    process, so it is not unregistered either.
+    """
+    stale = attach_segment(name)
+    stale.close()
+    if sys.version_info >= (3, 13):
+        stale.unlink()
+        return
+
+    unregister = resource_tracker.unregister
+    resource_tracker.unregister = lambda *args, **kwargs: None
+    try:
+        stale.unlink()
+    finally:
+        resource_tracker.unregister = unregister
+
+
+class ShmRingBuffer:
+    """
+    ShmRingBuffer: A single-producer, single-consumer ring buffer in `multiprocessing.shared_memory`.
+
+    The segment starts with two monotonically increasing 64-bit counters: `head` (bytes written) and `tail`
+    (bytes read). Only the producer writes `head`, and only the consumer writes `tail`. The producer copies a
+    length-prefixed record into the free space and publishes it by advancing `head` afterwards; the consumer
+    reads records up to `head` and releases the space by advancing `tail`. There must be exactly one producer
+    and one consumer per ring.
+
+    This relies on the other process seeing the record before the advanced `head`, and the released space only
+    after the records were read. x86 CPUs keep stores in program order, so no lock is needed there. Python has
+    no memory fences, so on other CPUs, e.g. ARM64, each counter is stored and loaded under an `flock()` on a
+    lock file; taking and releasing the lock orders the memory accesses around it.
+    """
+
+    def __init__(self, name: str, capacity: int = 1 << 20, create: bool = False, fenced: Optional[bool] = None):
+        """
+        Create or attach to a ring buffer.
+        :param name: The name of the shared memory segment.
+        :param capacity: Size of the data area in bytes. Only used when creating the segment.
+        :param create: If True, the segment is created (or replaced, if a stale one exists) and owned by this
+                       instance.
+        :param fenced: If True, counters are accessed under a lock (default: on CPUs other than x86).
+        """
+        self.name = name
+        self.owner = create
+        if fenced is None:
+            fenced = platform.machine().lower() not in _ORDERED_MACHINES
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(self._lock_path, "a+b") if fenced else None
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=_DATA_OFFSET + capacity)
+            except FileExistsError:
+                # Left over by a crashed process, possibly with another capacity: replace it
+                _remove_stale_segment(name)
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=_DATA_OFFSET + capacity)
+            _COUNTER.pack_into(self.shm.buf, _HEAD_OFFSET, 0)
+            _COUNTER.pack_into(self.shm.buf, _TAIL_OFFSET, 0)
+        else:
+            self.shm = attach_segment(name)
+
+        self.buf = self.shm.buf
+        self.capacity = self.shm.size - _DATA_OFFSET
+
+    def _load(self, offset: int) -> int:
+        return _COUNTER.unpack_from(self.buf, offset)[0]
+
+    def _acquire(self, offset: int) -> int:
+        """
+        Load the counter written by the other side; the memory it covers is visible afterwards.
+        """
+        if self._lock_file is None:
+            return self._load(offset)
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            return self._load(offset)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _release(self, offset: int, value: int) -> None:
+        """
+        Store a counter of this side once the memory it covers was written or read.
+        """
+        if self._lock_file is None:
+            _COUNTER.pack_into(self.buf, offset, value)
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            _COUNTER.pack_into(self.buf, offset, value)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _copy_in(self, position: int, data) -> None:
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buf[_DATA_OFFSET + start:_DATA_OFFSET + start + first] = data[:first]
+        if first < len(data):
+            self.buf[_DATA_OFFSET:_DATA_OFFSET + len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, size: int) -> bytes:
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(self.buf[_DATA_OFFSET + start:_DATA_OFFSET + start + first])
+        if first < size:
+            data += bytes(self.buf[_DATA_OFFSET:_DATA_OFFSET + size - first])
+        return data
+
+    def free(self) -> int:
+        """
+        :return: The number of bytes that can currently be written.
+        """
+        return self.capacity - (self._acquire(_HEAD_OFFSET) - self._acquire(_TAIL_OFFSET))
+
+    def put(self, record: bytes, timeout: Optional[float] = None) -> None:
+        """
+        Append a record. Producer side only.
+        :param record: The record payload.
+        :param timeout: Maximum time in seconds to wait for free space. None waits forever, 0 does not wait.
+        :return: None
+        :raises BackpressureError: If the record does not fit in time.
+        :raises ValueError: If the record can never fit into the ring.
+        """
+        size = _LENGTH.size + len(record)
+        if size > self.capacity:
+            raise ValueError(f"Record of {len(record)} bytes exceeds the capacity of ring '{self.name}'")
+
+        head = self._load(_HEAD_OFFSET)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0
+        while self.capacity - (head - self._acquire(_TAIL_OFFSET)) < size:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise BackpressureError(f"Ring '{self.name}' is full")
+            time.sleep(delay)
+            delay = min(delay * 2 or 0.00005, 0.001)
+
+        self._copy_in(head, _LENGTH.pack(len(record)))
+        self._copy_in(head + _LENGTH.size, record)
+        self._release(_HEAD_OFFSET, head + size)
+
+    def get_many(self, max_records: int = 1000) -> List[bytes]:
+        """
+        Take all available records, up to `max_records`. Consumer side only. Never blocks.
+        :param max_records: Maximum number of records to return.
+        :return: A possibly empty list of records.
+        """
+        tail = self._load(_TAIL_OFFSET)
+        head = self._acquire(_HEAD_OFFSET)
+        records = []
+        while tail < head and len(records) < max_records:
+            size = _LENGTH.unpack(self._copy_out(tail, _LENGTH.size))[0]
+            records.append(self._copy_out(tail + _LENGTH.size, size))
+            tail += _LENGTH.size + size
+        if records:
+            self._release(_TAIL_OFFSET, tail)
+        return records
+
+    def close(self):
+        """
+        Detach from the segment, and remove it and its lock file if this instance created it.
+        :return: None
+        """
+        if self._lock_file is not None:
+            self._lock_file.close()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            for remove in (self.shm.unlink, lambda: os.unlink(self._lock_path)):
+                try:
+                    remove()
+                except FileNotFoundError:
+                    pass
+
+
+class Doorbell:
+    """
+    Doorbell: Wakes a consumer waiting for records in its rings. A named pipe in the temp directory; producers
+    write a byte after adding records, and the consumer blocks in select() until a byte arrives. A byte written
+    between the consumer's last look at the rings and its wait stays in the pipe, so no wake-up is lost. While
+    the pipe is full, further bytes are dropped, as the consumer is due to wake up anyway.
+    """
+
+    def __init__(self, name: str, create: bool = False):
+        """
+        Create or open a doorbell.
+        :param name: The name of the doorbell, unique per consumer.
+        :param create: If True, the pipe is created and owned by this instance, which waits on it.
+        """
+        self.name = name
+        self.owner = create
+        self.path = os.path.join(tempfile.gettempdir(), f"{name}.wake")
+        self._fd: Optional[int] = None
+        if create:
+            try:
+                os.mkfifo(self.path, 0o600)
+            except FileExistsError:
+                pass
+            # Opened for reading and writing, so the pipe stays open without producers
+            self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+
+    def ring(self) -> None:
+        """
+        Wake the consumer. Producer side; does nothing while the consumer has not created the pipe.
+        :return: None
+        """
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                return
+        try:
+            os.write(self._fd, b"\0")
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if e.errno == errno.EPIPE and not self.owner:
+                # The consumer went away; a restarted one creates a new pipe
+                os.close(self._fd)
+                self._fd = None
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until a producer rang, or the timeout expired. Consumer side only.
+        :param timeout: Maximum time in seconds to wait.
+        :return: True if woken up by a producer.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        """
+        Close the pipe, and remove it if this instance created it.
+        :return: None
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self.owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
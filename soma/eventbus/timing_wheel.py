@@ -0,0 +1,236 @@
+# Timing Wheel: Schedules delayed callbacks, e.g. retries and delayed messages, in constant time.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import math
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import structlog
+
+from soma.eventbus.metrics import SCHEDULED_TASKS
+
+
+class TimingWheel:
+    """
+    TimingWheel: A hierarchical timing wheel, as used by Kafka and the Linux kernel for timers.
+
+    Time advances in ticks. Level 0 has one slot per tick; each slot of level `n` spans `slots ** n` ticks.
+    An entry is put into the slot of the lowest level whose range covers its delay, so scheduling is a list
+    append. When a lower level wraps around, the entries of the next slot of the level above are moved down
+    ("cascaded"). Each entry is moved at most `levels - 1` times, independent of the number of pending entries.
+
+    The wheel is not thread-safe; see Scheduler.
+    """
+
+    def __init__(self, tick: float = 0.01, slots: int = 256, levels: int = 4, start: Optional[float] = None):
+        """
+        Initialize an empty wheel.
+        :param tick: The resolution in seconds.
+        :param slots: Number of slots per level. Must be a power of two.
+        :param levels: Number of levels. Delays beyond `tick * slots ** levels` are cascaded more often, but still work.
+        :param start: The time of tick 0, in seconds of the clock passed to advance(). Defaults to time.monotonic().
+        """
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError(f"The number of slots must be a power of two, got {slots}")
+
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.start = time.monotonic() if start is None else start
+        self.current = 0  # The last tick that was processed
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, delay: float, item: Any):
+        """
+        Add an entry that becomes due after `delay` seconds, rounded up to the next tick.
+        :param delay: The delay in seconds, relative to the last call to advance().
+        :param item: The entry, returned by advance() when it is due.
+        :return: None
+        """
+        self._insert(self.current + max(1, math.ceil(delay / self.tick)), item)
+        self._count += 1
+
+    def _insert(self, expiry: int, item: Any):
+        ticks = expiry - self.current
+        if ticks <= 0:
+            # Due now; the slot of the current tick is processed right after cascading
+            self._wheels[0][self.current & self._mask].append((expiry, item))
+            return
+        level = 0
+        while level < self.levels - 1 and ticks >= self.slots ** (level + 1):
+            level += 1
+        self._wheels[level][(expiry >> (level * self._bits)) & self._mask].append((expiry, item))
+
+    def advance(self, now: float) -> List[Any]:
+        """
+        Process all ticks up to `now` and remove the entries that became due.
+        :param now: The current time.
+        :return: The due entries, in order of their expiry.
+        """
+        target = int((now - self.start) / self.tick)
+        due: List[Tuple[int, Any]] = []
+        if not self._count:
+            self.current = max(self.current, target)
+            return []
+
+        while self.current < target and self._count:
+            self.current += 1
+            t = self.current
+            # Cascade from the highest level that wrapped around, so entries can move down several levels at once
+            level = 1
+            while level < self.levels and t & ((1 << (level * self._bits)) - 1) == 0:
+                level += 1
+            for cascading in range(level - 1, 0, -1):
+                slot = (t >> (cascading * self._bits)) & self._mask
+                entries, self._wheels[cascading][slot] = self._wheels[cascading][slot], []
+                for expiry, item in entries:
+                    self._insert(expiry, item)
+
+            slot = t & self._mask
+            entries, self._wheels[0][slot] = self._wheels[0][slot], []
+            for expiry, item in entries:
+                if expiry <= t:
+                    due.append((expiry, item))
+                    self._count -= 1
+                else:
+                    # Placed a full rotation ahead
+                    self._insert(expiry, item)
+        self.current = max(self.current, target)
+
+        due.sort(key=lambda entry: entry[0])
+        return [item for _, item in due]
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        The time at which advance() should be called next, i.e. the next occupied level 0 slot or, if there is none,
+        the next time level 0 wraps around and entries are cascaded down.
+        :return: The time, or None if the wheel is empty.
+        """
+        if not self._count:
+            return None
+        t = self.current + 1
+        boundary = (self.current | self._mask) + 1
+        while t < boundary and not self._wheels[0][t & self._mask]:
+            t += 1
+        return self.start + t * self.tick
+
+
+class Scheduler:
+    """
+    Scheduler: Runs callbacks after a delay, using a TimingWheel driven by a single thread.
+    While nothing is scheduled, the thread waits on a condition variable without a timeout.
+    Callbacks run on the scheduler thread and must not block; hand longer work to an executor.
+    """
+
+    def __init__(self, tick: float = 0.01, slots: int = 256, levels: int = 4, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the scheduler. The thread is started on first use.
+        :param tick: The resolution in seconds.
+        :param slots: Number of slots per level of the wheel.
+        :param levels: Number of levels of the wheel.
+        :param clock: The clock, returning seconds.
+        """
+        self.clock = clock
+        self.wheel = TimingWheel(tick, slots, levels, start=clock())
+        self.running = False
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.logger = structlog.get_logger(__name__)
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def call_later(self, delay: float, callback: Callable[[], None]):
+        """
+        Run a callback after `delay` seconds.
+        :param delay: The delay in seconds. The callback may run up to one tick late.
+        :param callback: The callback.
+        :return: None
+        """
+        with self._condition:
+            now = self.clock()
+            if not len(self.wheel):
+                # Nothing is pending, so move the wheel to the present without returning anything
+                self.wheel.advance(now)
+            # The wheel counts delays from its last processed tick
+            self.wheel.schedule(delay + now - (self.wheel.start + self.wheel.current * self.wheel.tick), callback)
+            SCHEDULED_TASKS.set(len(self.wheel))
+            if not self.running:
+                self.start()
+            self._condition.notify()
+
+    def start(self):
+        """
+        Start the scheduler thread.
+        :return: None
+        """
+        with self._condition:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, daemon=True, name="soma-scheduler")
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the scheduler thread. Pending callbacks are kept and run after the next start.
+        :return: None
+        """
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self):
+        """
+        Scheduler loop.
+        :return: None
+        """
+        while True:
+            with self._condition:
+                while self.running:
+                    deadline = self.wheel.next_deadline()
+                    if deadline is None:
+                        self._condition.wait()
+                        continue
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if not self.running:
+                    return
+                due = self.wheel.advance(self.clock())
+                SCHEDULED_TASKS.set(len(self.wheel))
+
+            for callback in due:
+                try:
+                    callback()
+                except Exception as e:
+                    self.logger.exception("Scheduler callback failed", error=str(e))
+
+
+_default_scheduler: Optional[Scheduler] = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler() -> Scheduler:
+    """
+    The scheduler shared by all event buses that were not configured with their own.
+    :return: The scheduler.
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = Scheduler()
+        return _default_scheduler
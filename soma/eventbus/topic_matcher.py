@@ -0,0 +1,205 @@
+# Topic Matcher: Resolves the subscribers of a topic from literal and pattern subscriptions.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple, Union
+
+TopicPattern = Union[str, re.Pattern]
+
+# Flags that can be scoped to a group; re.UNICODE is the default for str patterns
+_INLINE_FLAGS = ((re.ASCII, "a"), (re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"))
+
+
+@lru_cache(maxsize=1024)
+def _covers(pattern: Tuple[str, ...], topic: Tuple[str, ...]) -> bool:
+    """
+    Check whether the segments of a pattern match every topic matched by the segments of another pattern.
+    """
+    if not pattern:
+        return not topic
+    head = pattern[0]
+    if head == "#":
+        # '#' matches no segment, or takes the first segment of the topic, whatever it matches, and goes on
+        return _covers(pattern[1:], topic) or (bool(topic) and _covers(pattern, topic[1:]))
+    if not topic or topic[0] == "#":
+        # A single segment does not cover a variable number of segments
+        return False
+    if head == "*" or head == topic[0]:
+        return _covers(pattern[1:], topic[1:])
+    return False
+
+
+class _Node:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.values: List[Tuple[int, Any]] = []
+
+
+class TopicMatcher:
+    """
+    TopicMatcher: Maps topics to the values (subscribers) registered for them.
+    Topics are dot-separated. Besides literal topics, patterns are supported:
+
+    - `*` matches exactly one segment, e.g. `github.*` matches `github.ci_activity`
+    - `#` matches zero or more segments, e.g. `github.#` matches `github`, `github.ci_activity`
+      and `github.state_change.pr.closed`
+    - compiled regular expressions (`re.Pattern`) match if `pattern.match(topic)` succeeds
+
+    Literal topics and wildcard patterns are stored in a trie. The result for each topic is cached,
+    so resolving the subscribers of a known topic is a single dictionary lookup.
+    """
+
+    def __init__(self, cache_size: int = 10000):
+        """
+        Initialize an empty matcher.
+        :param cache_size: Maximum number of topics kept in the match cache.
+        """
+        self.cache_size = cache_size
+        self._root = _Node()
+        self._regexes: List[Tuple[int, re.Pattern, Any]] = []
+        self._patterns: List[TopicPattern] = []
+        self._sequence = 0
+        self._cache: Dict[str, Tuple[Any, ...]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_pattern(topic: TopicPattern) -> bool:
+        """
+        Check whether a subscription topic is a pattern rather than a literal topic.
+        :param topic: A topic name, a wildcard pattern or a compiled regular expression.
+        :return: True for wildcard patterns and regular expressions.
+        """
+        if isinstance(topic, re.Pattern):
+            return True
+        return any(segment in ("*", "#") for segment in topic.split("."))
+
+    @staticmethod
+    def covers(pattern: str, topic: str) -> bool:
+        """
+        Check whether a wildcard pattern matches every topic that a topic or another wildcard pattern matches,
+        e.g. `github.#` covers `github.*`, but `*` does not cover `#`.
+        :param pattern: A topic name or a wildcard pattern.
+        :param topic: A topic name or a wildcard pattern.
+        :return: True if each topic matched by `topic` is matched by `pattern`.
+        """
+        return _covers(tuple(pattern.split(".")), tuple(topic.split(".")))
+
+    @staticmethod
+    def to_regex(topic: TopicPattern) -> str:
+        """
+        Convert a topic or pattern into an equivalent regular expression matching the whole topic name.
+        The flags of a compiled regular expression are kept as inline flags.
+        :param topic: A topic name, a wildcard pattern or a compiled regular expression.
+        :return: The regular expression as string.
+        """
+        if isinstance(topic, re.Pattern):
+            flags = "".join(letter for flag, letter in _INLINE_FLAGS if topic.flags & flag)
+            return f"(?{flags}:{topic.pattern})" if flags else topic.pattern
+
+        segments = topic.split(".")
+        regex = ""
+        for i, segment in enumerate(segments):
+            if segment == "#":
+                if i == 0:
+                    # A leading '#' consumes the separator of the following segment itself
+                    regex += ".*" if len(segments) == 1 else r"(?:[^.]+\.)*"
+                else:
+                    regex += r"(?:\.[^.]+)*"
+                continue
+            separator = "" if i == 0 or (i == 1 and segments[0] == "#") else r"\."
+            regex += separator + (r"[^.]+" if segment == "*" else re.escape(segment))
+        return "^" + regex + "$"
+
+    @property
+    def patterns(self) -> List[TopicPattern]:
+        """
+        The pattern subscriptions, in the order they were added.
+        """
+        return list(self._patterns)
+
+    def add(self, topic: TopicPattern, value: Any):
+        """
+        Register a value for a topic or pattern.
+        :param topic: A topic name, a wildcard pattern or a compiled regular expression.
+        :param value: The value, usually a subscriber, returned for matching topics.
+        :return: None
+        """
+        with self._lock:
+            self._sequence += 1
+            if isinstance(topic, re.Pattern):
+                self._regexes.append((self._sequence, topic, value))
+            else:
+                node = self._root
+                for segment in topic.split("."):
+                    node = node.children.setdefault(segment, _Node())
+                node.values.append((self._sequence, value))
+
+            if self.is_pattern(topic) and topic not in self._patterns:
+                self._patterns.append(topic)
+
+            self._generation += 1
+            self._cache = {}
+
+    def match(self, topic: str) -> Tuple[Any, ...]:
+        """
+        Get the values registered for a topic, in the order they were added.
+        A value is returned once per matching registration, so a subscriber added twice, or under two matching
+        patterns, is returned twice, like a subscriber added twice to a literal topic.
+        :param topic: The topic name.
+        :return: A tuple of values.
+        """
+        cached = self._cache.get(topic)
+        if cached is not None:
+            return cached
+
+        generation = self._generation
+        found: List[Tuple[int, Any]] = []
+        self._walk(self._root, topic.split("."), 0, found)
+        for sequence, regex, value in self._regexes:
+            if regex.match(topic):
+                found.append((sequence, value))
+        found.sort(key=lambda entry: entry[0])
+
+        # A registration is reached more than once through patterns like `#.#`
+        seen = set()
+        values = []
+        for sequence, value in found:
+            if sequence not in seen:
+                seen.add(sequence)
+                values.append(value)
+        result = tuple(values)
+
+        with self._lock:
+            if generation == self._generation:
+                if len(self._cache) >= self.cache_size:
+                    self._cache = {}
+                self._cache[topic] = result
+        return result
+
+    def _walk(self, node: _Node, segments: List[str], i: int, found: List[Tuple[int, Any]]):
+        """
+        Collect the values of all trie nodes matching `segments[i:]`.
+        :return: None
+        """
+        hashed = node.children.get("#")
+        if hashed is not None:
+            for j in range(i, len(segments) + 1):
+                self._walk(hashed, segments, j, found)
+
+        if i == len(segments):
+            found.extend(node.values)
+            return
+
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._walk(child, segments, i + 1, found)
+        star = node.children.get("*")
+        if star is not None:
+            self._walk(star, segments, i + 1, found)
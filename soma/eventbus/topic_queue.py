@@ -0,0 +1,396 @@
+# Topic Queue: Bounded message queue with overflow policies and a shared memory budget.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import itertools
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from soma.core.contracts.message import Message
+from soma.eventbus.metrics import BACKPRESSURE_EVENTS, BUS_MEMORY_BYTES
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "raise")
+
+
+class BackpressureError(queue.Full):
+    """
+    Raised when a message cannot be enqueued because the topic queue or the memory budget is exhausted.
+    """
+    pass
+
+
+def message_size(message: Message) -> int:
+    """
+    Estimate the memory footprint of a message from the length of its payload fields.
+    :param message: The message to measure.
+    :return: The approximate size in bytes.
+    """
+    size = len(message.content or "") + len(message.subject or "") + len(message.source_id or "")
+    for key, value in (message.metadata or {}).items():
+        size += len(key) + len(str(value))
+    return size
+
+
+class MemoryBudget:
+    """
+    MemoryBudget: Byte budget shared by all queues of an event bus.
+    Bytes are checked and reserved in one step under the budget lock, so concurrent queues never exceed the limit
+    together. The budget is never waited on itself; queues wait on their own condition and try again.
+    """
+
+    def __init__(self, limit: int):
+        """
+        Initialize the budget.
+        :param limit: The maximum number of message bytes held by all queues together.
+        """
+        if limit <= 0:
+            raise ValueError(f"Memory budget must be positive, got {limit}")
+
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        """
+        Reserve `size` bytes if they fit into the budget. A single message always fits into an empty budget.
+        :param size: Number of bytes to add.
+        :return: True if the bytes were reserved, False if they do not fit.
+        """
+        with self._lock:
+            if self.used and self.used + size > self.limit:
+                return False
+            self.used += size
+        BUS_MEMORY_BYTES.set(self.used)
+        return True
+
+    def acquire(self, size: int):
+        """
+        Account for bytes added regardless of the limit, e.g. for messages restored after a restart.
+        :param size: Number of bytes added.
+        :return: None
+        """
+        with self._lock:
+            self.used += size
+        BUS_MEMORY_BYTES.set(self.used)
+
+    def release(self, size: int):
+        """
+        Account for bytes removed from a queue.
+        :param size: Number of bytes removed.
+        :return: None
+        """
+        with self._lock:
+            self.used -= size
+        BUS_MEMORY_BYTES.set(self.used)
+
+
+class TopicQueue(queue.Queue):
+    """
+    TopicQueue: A queue.Queue holding the messages of one topic.
+    When the queue is full, either by number of messages or by the shared memory budget,
+    the overflow policy decides what happens to a new message:
+
+    - `block`: wait until there is room, raising BackpressureError after `put_timeout` seconds
+    - `drop_oldest`: discard the oldest messages of this topic until the new one fits
+    - `drop_newest`: discard the new message
+    - `raise`: raise BackpressureError immediately
+    """
+
+    def __init__(self, topic: str, maxsize: int = 0, overflow: str = "block", put_timeout: Optional[float] = None,
+                 budget: Optional[MemoryBudget] = None, sizeof: Callable[[Message], int] = message_size,
+                 on_discard: Optional[Callable[[Any], None]] = None):
+        """
+        Initialize the topic queue.
+        :param topic: The topic this queue belongs to, used for metrics.
+        :param maxsize: Maximum number of messages. 0 means unbounded.
+        :param overflow: The overflow policy, one of 'block', 'drop_oldest', 'drop_newest' or 'raise'.
+        :param put_timeout: Maximum time in seconds to block with the 'block' policy. None waits forever.
+        :param budget: Optional memory budget shared with the other queues of the bus.
+        :param sizeof: Callable estimating the size of a message in bytes.
+        :param on_discard: Callable invoked with each message dropped by the 'drop_oldest' or 'drop_newest' policy.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}")
+
+        super().__init__(maxsize)
+        self.topic = topic
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.budget = budget
+        self.sizeof = sizeof
+        self.on_discard = on_discard
+        self.bytes = 0
+        # Called with the queue lock held whenever messages were added, e.g. to start a consumer
+        self.listener: Optional[Callable[[], None]] = None
+
+    def _init(self, maxsize):
+        self.queue = deque()
+
+    def _put(self, entry):
+        # The bytes were reserved in the budget by _reserve() or restore()
+        size, _ = entry
+        self.queue.append(entry)
+        self.bytes += size
+
+    def _get(self):
+        size, item = self.queue.popleft()
+        self.bytes -= size
+        if self.budget:
+            self.budget.release(size)
+        return item
+
+    def _reserve(self, size: int) -> bool:
+        """
+        Check whether a message fits into the queue and reserve its bytes in the budget. Called with the queue lock held.
+        :return: True if the message may be added; its bytes are then reserved.
+        """
+        if 0 < self.maxsize <= self._qsize():
+            return False
+        return self.budget is None or self.budget.try_acquire(size)
+
+    def put(self, item, block=True, timeout=None, key=None):
+        """
+        Put a message into the queue, applying the overflow policy if there is no room.
+        :param item: The message to enqueue.
+        :param block: If False, the 'block' policy behaves like 'raise'.
+        :param timeout: Overrides `put_timeout` for the 'block' policy.
+        :param key: Ignored; a single queue keeps the publish order of all messages.
+        :return: None
+        :raises BackpressureError: If the message was rejected.
+        """
+        size = self.sizeof(item)
+        with self.not_full:
+            if not self._reserve(size):
+                if not self._overflow(item, size, block, self.put_timeout if timeout is None else timeout):
+                    return
+            self._put((size, item))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            if self.listener:
+                self.listener()
+
+    def put_many(self, items, block=True, timeout=None, keys=None):
+        """
+        Put several messages into the queue while holding the queue lock only once.
+        The overflow policy is applied to each message that does not fit.
+        :param items: The messages to enqueue.
+        :param block: If False, the 'block' policy behaves like 'raise'.
+        :param timeout: Overrides `put_timeout` for the 'block' policy, per message.
+        :param keys: Ignored; a single queue keeps the publish order of all messages.
+        :return: None
+        :raises BackpressureError: If a message was rejected. Messages before it remain enqueued.
+        """
+        timeout = self.put_timeout if timeout is None else timeout
+        with self.not_full:
+            added = 0
+            try:
+                for item in items:
+                    size = self.sizeof(item)
+                    if not self._reserve(size):
+                        if added:
+                            # Let consumers start on the messages enqueued so far while we wait for room
+                            self.not_empty.notify(added)
+                            self.unfinished_tasks += added
+                            added = 0
+                            if self.listener:
+                                self.listener()
+                        if not self._overflow(item, size, block, timeout):
+                            continue
+                    self._put((size, item))
+                    added += 1
+            finally:
+                if added:
+                    self.unfinished_tasks += added
+                    self.not_empty.notify(added)
+                    if self.listener:
+                        self.listener()
+
+    def restore(self, items: Sequence, keys=None):
+        """
+        Put messages recovered after a restart into the queue, regardless of its size limit and overflow policy.
+        :param items: The messages to enqueue.
+        :param keys: Ignored; a single queue keeps the order of all messages.
+        :return: None
+        """
+        with self.not_full:
+            for item in items:
+                size = self.sizeof(item)
+                if self.budget:
+                    self.budget.acquire(size)
+                self._put((size, item))
+            self.unfinished_tasks += len(items)
+            self.not_empty.notify(len(items))
+            if items and self.listener:
+                self.listener()
+
+    def get_batch(self, max_items: int, timeout: Optional[float] = None, linger: float = 0.0) -> list:
+        """
+        Remove up to `max_items` messages from the queue.
+        Waits up to `timeout` seconds for the first message, then up to `linger` seconds for more.
+        :param max_items: Maximum number of messages to return.
+        :param timeout: Maximum time in seconds to wait for the first message. None waits forever.
+        :param linger: Maximum time in seconds to wait for further messages after the first one.
+        :return: A non-empty list of messages.
+        :raises queue.Empty: If no message arrived within `timeout`.
+        """
+        with self.not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._qsize():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.not_empty.wait(remaining)
+
+            items = []
+            deadline = time.monotonic() + linger
+            while len(items) < max_items:
+                if self._qsize():
+                    items.append(self._get())
+                    self.not_full.notify()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.not_empty.wait(remaining)
+            return items
+
+    def _overflow(self, item, size: int, block: bool, timeout: Optional[float]) -> bool:
+        """
+        Apply the overflow policy. Called with the queue lock held.
+        :return: True if the new message should be enqueued, with its bytes reserved, False if it was dropped.
+        """
+        policy = self.overflow if block or self.overflow != "block" else "raise"
+
+        if policy == "block":
+            BACKPRESSURE_EVENTS.labels(topic=self.topic, action="blocked").inc()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._reserve(size):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    BACKPRESSURE_EVENTS.labels(topic=self.topic, action="rejected").inc()
+                    raise BackpressureError(f"Timed out waiting for room in queue '{self.topic}'")
+                # The budget may be freed by other queues, which do not notify this one, so wait in short slices
+                self.not_full.wait(0.05 if remaining is None else min(remaining, 0.05))
+            return True
+
+        if policy == "drop_oldest":
+            while self._qsize() > 0:
+                dropped = self._get()
+                self.unfinished_tasks -= 1
+                BACKPRESSURE_EVENTS.labels(topic=self.topic, action="dropped_oldest").inc()
+                if self.on_discard:
+                    self.on_discard(dropped)
+                if self._reserve(size):
+                    return True
+            if self._reserve(size):
+                return True
+            # The budget is held by other topics, so there is nothing left to drop here
+            policy = "drop_newest"
+
+        if policy == "drop_newest":
+            BACKPRESSURE_EVENTS.labels(topic=self.topic, action="dropped_newest").inc()
+            if self.on_discard:
+                self.on_discard(item)
+            return False
+
+        BACKPRESSURE_EVENTS.labels(topic=self.topic, action="rejected").inc()
+        raise BackpressureError(f"Queue '{self.topic}' is full")
+
+
+class KeyedTopicQueue:
+    """
+    KeyedTopicQueue: Splits the messages of one topic into a fixed number of ordered lanes, like the partitions
+    of a Kafka topic. Messages with the same key always go to the same lane, selected by the CRC32 of the key,
+    so they keep their publish order when each lane is consumed by a single worker. Messages without a key
+    are distributed round-robin.
+    Each lane is a TopicQueue; `max_queue_size` and the overflow policy apply per lane.
+    """
+
+    def __init__(self, topic: str, lanes: int, **kwargs):
+        """
+        Initialize the lanes.
+        :param topic: The topic this queue belongs to.
+        :param lanes: The number of lanes.
+        Other keyword arguments configure the TopicQueue of each lane.
+        """
+        if lanes < 1:
+            raise ValueError(f"Keyed queue for '{topic}' needs at least one lane, got {lanes}")
+
+        self.topic = topic
+        self.lanes: List[TopicQueue] = [TopicQueue(topic, **kwargs) for _ in range(lanes)]
+        self._round_robin = itertools.cycle(range(lanes))
+
+    def lane(self, key: Optional[str]) -> int:
+        """
+        Select the lane of a message. Uses CRC32, so the assignment is stable across processes.
+        :param key: The message key or None.
+        :return: The lane index.
+        """
+        if key is None:
+            return next(self._round_robin)
+        return zlib.crc32(key.encode("utf-8")) % len(self.lanes)
+
+    def put(self, item, block=True, timeout=None, key=None):
+        """
+        Put a message into the lane of its key. See TopicQueue.put().
+        :param key: The message key. Messages without a key are distributed round-robin.
+        :return: None
+        :raises BackpressureError: If the message was rejected.
+        """
+        self.lanes[self.lane(key)].put(item, block, timeout)
+
+    def put_many(self, items: Sequence, block=True, timeout=None, keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Put several messages into the lanes of their keys, taking the lock of each lane once.
+        :param keys: The message keys, in the same order as the messages. None distributes all messages round-robin.
+        :return: None
+        :raises BackpressureError: If a message was rejected.
+        """
+        by_lane: Dict[int, list] = {}
+        for i, item in enumerate(items):
+            by_lane.setdefault(self.lane(keys[i] if keys else None), []).append(item)
+        for lane, batch in by_lane.items():
+            self.lanes[lane].put_many(batch, block, timeout)
+
+    def restore(self, items: Sequence, keys: Optional[Sequence[Optional[str]]] = None):
+        """
+        Put messages recovered after a restart into the lanes of their keys. See TopicQueue.restore().
+        :return: None
+        """
+        by_lane: Dict[int, list] = {}
+        for i, item in enumerate(items):
+            by_lane.setdefault(self.lane(keys[i] if keys else None), []).append(item)
+        for lane, batch in by_lane.items():
+            self.lanes[lane].restore(batch)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove a message from the first non-empty lane. Meant for draining the queue;
+        workers consume the lanes directly, to keep the order within each lane.
+        :return: The message.
+        :raises queue.Empty: If all lanes stayed empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for lane in self.lanes:
+                try:
+                    return lane.get_nowait()
+                except queue.Empty:
+                    pass
+            if not block or (deadline is not None and time.monotonic() >= deadline):
+                raise queue.Empty
+            time.sleep(0.01)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        return sum(lane.qsize() for lane in self.lanes)
+
+    def empty(self) -> bool:
+        return all(lane.empty() for lane in self.lanes)
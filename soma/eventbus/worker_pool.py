@@ -0,0 +1,352 @@
+# Topic Worker Pool: A resizable set of worker threads consuming a topic queue.
+#
+# :author: Niels Braczek <nbraczek@bsds.de>
+# :license: MIT License
+
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+from soma.core.contracts.message import Message
+from soma.eventbus.metrics import TOPIC_WORKERS, IDLE_WAKEUPS
+from soma.eventbus.topic_queue import KeyedTopicQueue
+
+
+class TopicWorkerPool:
+    """
+    TopicWorkerPool: A resizable set of worker threads consuming messages from a single topic queue.
+    Each worker takes the next message, or batch of messages, from the queue and passes it to the dispatch callable,
+    so up to `size` batches of the topic are handled concurrently.
+
+    Workers are started on demand, when messages arrive, and block on the queue's condition variable while waiting.
+    A worker that found no message for `keepalive` seconds exits, so an idle topic has no threads and uses no CPU.
+    """
+
+    def __init__(self, topic: str, source: queue.Queue, dispatch: Callable[[str, Sequence[Message]], None],
+                 size: int = 1, batch_size: int = 1, linger: float = 0.0, keepalive: float = 5.0,
+                 notify: Optional[Callable[['TopicWorkerPool', int], None]] = None):
+        """
+        Initialize the worker pool.
+        :param topic: The topic consumed by this pool.
+        :param source: The queue from which the workers take messages. Batching requires a TopicQueue.
+        :param dispatch: A callable invoked with the topic and each list of messages taken from the queue.
+        :param size: The maximum number of worker threads.
+        :param batch_size: Maximum number of messages passed to a single dispatch call.
+        :param linger: Maximum time in seconds to wait for a batch to fill up.
+        :param keepalive: Time in seconds an idle worker waits for further messages before it exits.
+        :param notify: Callable invoked with the pool and the source index when a TopicQueue receives messages
+                       and more workers may be needed, e.g. Dispatcher.notify(). By default, wake() is called directly.
+        """
+        if size < 1:
+            raise ValueError(f"Worker pool for '{topic}' needs at least one worker, got {size}")
+
+        self.topic = topic
+        self.source = source
+        self.dispatch = dispatch
+        self.batch_size = batch_size
+        self.linger = linger
+        self.keepalive = keepalive
+        self.running = False
+        self.latency: Optional[float] = None  # Exponentially weighted average of the dispatch time per message in seconds
+        self.busy = 0
+
+        self._target = size
+        self._threads: List[List[threading.Thread]] = [[] for _ in self._sources()]
+        self._lock = threading.Lock()
+        self._names = itertools.count()
+
+        notify = notify or (lambda pool, index: pool.wake(index))
+        for index, source in enumerate(self._sources()):
+            if hasattr(source, "listener"):
+                source.listener = lambda index=index: self._on_put(notify, index)
+
+    @property
+    def size(self) -> int:
+        """
+        The number of workers the pool is currently sized to.
+        """
+        return self._target
+
+    @property
+    def threads(self) -> int:
+        """
+        The number of worker threads currently running.
+        """
+        return sum(len(threads) for threads in self._threads)
+
+    def _sources(self) -> List[queue.Queue]:
+        """
+        The queues consumed by this pool.
+        """
+        return [self.source]
+
+    def _limit(self, index: int) -> int:
+        """
+        The maximum number of workers consuming a source.
+        """
+        return self._target
+
+    def _on_put(self, notify: Callable[['TopicWorkerPool', int], None], index: int):
+        """
+        Listener of a source queue. Called with the queue lock held, so it must not block.
+        :return: None
+        """
+        if self.running and len(self._threads[index]) < self._limit(index):
+            notify(self, index)
+
+    def start(self):
+        """
+        Start consuming. Workers are started for messages that are already waiting.
+        :return: None
+        """
+        self.running = True
+        self.wake()
+
+    def wake(self, index: Optional[int] = None):
+        """
+        Start workers for the pending messages of a source, up to the size of the pool.
+        :param index: The index of the source. None wakes all sources.
+        :return: None
+        """
+        sources = self._sources()
+        with self._lock:
+            if not self.running:
+                return
+            for i in (range(len(sources)) if index is None else [index]):
+                threads = self._threads[i]
+                idle = max(len(threads) - self.busy, 0) if len(sources) == 1 else 0
+                # Without the queue lock, as publishers call this from within their put()
+                pending = -(-sources[i]._qsize() // self.batch_size)
+                for _ in range(min(self._limit(i) - len(threads), pending - idle)):
+                    t = threading.Thread(target=self._work, args=(i,), daemon=True,
+                                         name=f"soma-{self.topic}-{next(self._names)}")
+                    threads.append(t)
+                    t.start()
+            TOPIC_WORKERS.labels(topic=self.topic).set(self.threads)
+
+    def resize(self, size: int):
+        """
+        Change the maximum number of workers. Surplus workers retire after finishing their current message.
+        :param size: The new number of worker threads.
+        :return: None
+        """
+        if size < 1:
+            raise ValueError(f"Worker pool for '{self.topic}' needs at least one worker, got {size}")
+
+        self._target = size
+        self.wake()
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stop all worker threads.
+        :param timeout: Maximum time in seconds to wait for each worker.
+        :return: None
+        """
+        self.running = False
+        for source in self._sources():
+            with source.not_empty:
+                source.not_empty.notify_all()
+        with self._lock:
+            threads = [t for source_threads in self._threads for t in source_threads]
+        for t in threads:
+            t.join(timeout=timeout)
+        with self._lock:
+            for source_threads in self._threads:
+                source_threads.clear()
+        TOPIC_WORKERS.labels(topic=self.topic).set(0)
+
+    def _exit(self, index: int):
+        """
+        Remove the calling worker from the pool, unless stop() did so already.
+        :return: None
+        """
+        with self._lock:
+            current = threading.current_thread()
+            if current in self._threads[index]:
+                self._threads[index].remove(current)
+            TOPIC_WORKERS.labels(topic=self.topic).set(self.threads)
+
+    def _retire(self, index: int) -> bool:
+        """
+        Remove the calling worker from the pool if the source has more workers than allowed.
+        :return: True if the worker should exit.
+        """
+        with self._lock:
+            if len(self._threads[index]) > self._limit(index):
+                self._threads[index].remove(threading.current_thread())
+                TOPIC_WORKERS.labels(topic=self.topic).set(self.threads)
+                return True
+        return False
+
+    def _claim(self, source: queue.Queue, index: int) -> bool:
+        """
+        Wait for a message without polling, and count the worker as busy once there is one.
+        :return: False if the worker left the pool, because the pool was stopped or stayed idle for `keepalive` seconds.
+        """
+        with source.not_empty:
+            deadline = time.monotonic() + self.keepalive
+            while not source._qsize():
+                remaining = deadline - time.monotonic()
+                if not self.running or remaining <= 0:
+                    if self.running:
+                        IDLE_WAKEUPS.labels(topic=self.topic).inc()
+                    # Leave while holding the queue lock, so a publisher sees either this worker or no worker
+                    self._exit(index)
+                    return False
+                source.not_empty.wait(remaining)
+            with self._lock:
+                self.busy += 1
+        return True
+
+    def _work(self, index: int):
+        """
+        Worker loop: take messages from the queue and dispatch them until the pool is stopped, shrunk or idle.
+        :param index: The index of the source consumed by this worker.
+        :return: None
+        """
+        source = self._sources()[index]
+        while self.running:
+            if self._retire(index):
+                return
+            if not self._claim(source, index):
+                return
+            try:
+                if self.batch_size > 1:
+                    messages = source.get_batch(self.batch_size, timeout=0, linger=self.linger)
+                else:
+                    messages = [source.get_nowait()]
+            except queue.Empty:
+                # Another worker was faster
+                IDLE_WAKEUPS.labels(topic=self.topic).inc()
+                with self._lock:
+                    self.busy -= 1
+                continue
+
+            started = time.perf_counter()
+            try:
+                self.dispatch(self.topic, messages)
+            finally:
+                elapsed = (time.perf_counter() - started) / len(messages)
+                with self._lock:
+                    self.busy -= 1
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        self._exit(index)
+
+
+class KeyedWorkerPool(TopicWorkerPool):
+    """
+    KeyedWorkerPool: Consumes a KeyedTopicQueue with at most one worker per lane.
+    Messages with the same key are handled one after another in publish order, while different keys
+    are handled in parallel. The pool cannot be resized, as that would move keys to other lanes.
+    """
+
+    def __init__(self, topic: str, source: KeyedTopicQueue, dispatch: Callable[[str, Sequence[Message]], None],
+                 batch_size: int = 1, linger: float = 0.0, keepalive: float = 5.0,
+                 notify: Optional[Callable[[TopicWorkerPool, int], None]] = None):
+        """
+        Initialize the worker pool.
+        :param topic: The topic consumed by this pool.
+        :param source: The keyed queue whose lanes the workers consume.
+        :param dispatch: A callable invoked with the topic and each list of messages taken from a lane.
+        :param batch_size: Maximum number of messages passed to a single dispatch call.
+        :param linger: Maximum time in seconds to wait for a batch to fill up.
+        :param keepalive: Time in seconds an idle lane worker waits for further messages before it exits.
+        :param notify: See TopicWorkerPool.
+        """
+        super().__init__(topic, source, dispatch, size=len(source.lanes), batch_size=batch_size, linger=linger,
+                         keepalive=keepalive, notify=notify)
+
+    def _sources(self) -> List[queue.Queue]:
+        return self.source.lanes
+
+    def _limit(self, index: int) -> int:
+        return 1
+
+    def resize(self, size: int):
+        """
+        The size of a keyed pool equals the number of lanes and cannot be changed.
+        :param size: The number of lanes.
+        :return: None
+        """
+        if size != len(self.source.lanes):
+            raise ValueError(f"Keyed worker pool for '{self.topic}' has a fixed size of {len(self.source.lanes)}")
+
+
+class AdaptiveScaler:
+    """
+    AdaptiveScaler: Periodically resizes topic worker pools based on queue depth and handler latency.
+    The expected time to drain a queue is estimated as `depth * latency / workers`. Pools grow while
+    this estimate exceeds `target_backlog` seconds and shrink while their queue is empty and workers are idle.
+    """
+
+    def __init__(self, pools: Callable[[], List[TopicWorkerPool]], min_workers: int = 1, max_workers: int = 16,
+                 target_backlog: float = 0.5, interval: float = 1.0):
+        """
+        Initialize the scaler.
+        :param pools: A callable returning the pools to supervise.
+        :param min_workers: Lower bound for the number of workers per topic.
+        :param max_workers: Upper bound for the number of workers per topic.
+        :param target_backlog: Maximum acceptable estimated time in seconds to drain a topic queue.
+        :param interval: Time in seconds between two scaling decisions.
+        """
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(f"Invalid worker bounds: min_workers={min_workers}, max_workers={max_workers}")
+
+        self.pools = pools
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_backlog = target_backlog
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Start the supervising thread.
+        :return: None
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="soma-adaptive-scaler")
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the supervising thread.
+        :return: None
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def adjust(self, pool: TopicWorkerPool) -> int:
+        """
+        Compute and apply the new size for a single pool.
+        :param pool: The pool to resize.
+        :return: The new number of workers.
+        """
+        depth = pool.source.qsize()
+        size = pool.size
+
+        if depth > 0:
+            latency = pool.latency or 0.0
+            if depth * latency / size > self.target_backlog:
+                size = min(size * 2, self.max_workers)
+        elif pool.busy < size:
+            size = max(size - 1, self.min_workers)
+
+        size = max(size, self.min_workers)
+        if size != pool.size:
+            pool.resize(size)
+        return size
+
+    def _run(self):
+        """
+        Scaling loop.
+        :return: None
+        """
+        while not self._stopped.wait(self.interval):
+            for pool in self.pools():
+                self.adjust(pool)
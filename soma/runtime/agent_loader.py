@@ -9,7 +9,8 @@ from soma.core.contracts.event_bus import EventBus
 def load_agents_from_config(config_path: str, event_bus: EventBus) -> AgentRegistry:
     """
     Load and register agents from a YAML config file.
-    Supports 'topics' (list) or 'topic_filter' (regex) for dynamic topic subscription.
+    Supports 'topics' (list of topics or wildcard patterns like 'github.*') or 'topic_filter' (regex)
+    for dynamic topic subscription.
     """
     registry = AgentRegistry()
 
@@ -33,9 +34,8 @@ def load_agents_from_config(config_path: str, event_bus: EventBus) -> AgentRegis
             for topic in topics:
                 event_bus.subscribe(topic, instance)
         elif topic_filter:
-            for topic in event_bus.queues.keys():
-                if re.match(topic_filter, topic):
-                    event_bus.subscribe(topic, instance)
+            # Subscribe to the pattern, so topics created after loading are matched as well
+            event_bus.subscribe(re.compile(topic_filter), instance)
         else:
             print(f"[AgentLoader] Warning: No topics or topic_filter specified for '{name}'")
 
@@ -5,11 +5,12 @@ from importlib import import_module
 from soma.eventbus.memory_bus import InMemoryEventBus
 import structlog
 
-def ingest(config, event_bus, logger=None):
+def ingest(config, event_bus, logger=None, deduplicator=None):
     """
     Ingest messages from various connectors and send them to a Kafka topic.
     :param config:
     :param event_bus:
+    :param deduplicator: Optional Deduplicator dropping messages that were ingested before, e.g. re-read mails.
     :return: None
     """
     registry = ConnectorRegistry()
@@ -28,12 +29,15 @@ def ingest(config, event_bus, logger=None):
         messages = connector.read()
         # noinspection PyTypeChecker
         logger.info("Reading messages", agent="ingest", connector=name, count=len(messages))
-        for msg in messages:
-            event_bus.publish(
-                topic=name.split(".")[0],
-                message=msg,
-                key="raw"
-            )
+        if deduplicator is not None:
+            messages = deduplicator.filter(messages, scope=name)
+            if not messages:
+                continue
+        event_bus.publish_many(
+            topic=name.split(".")[0],
+            messages=messages,
+            keys=["raw"] * len(messages)
+        )
 
 
 if __name__ == "__main__":
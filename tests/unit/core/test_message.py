@@ -0,0 +1,99 @@
+# Message unit tests
+import pickle
+
+import pytest
+from pydantic import ValidationError
+
+from soma.core.contracts.message import Message, FrozenMessage, FrozenDict
+from soma.eventbus.codec import JsonCodec
+
+
+def _message() -> Message:
+    return Message(agent_name="agent1", source_type="email", source_id="<1@example.com>", subject="Subject",
+                   content="content", timestamp="2025-06-01T12:00:00Z", metadata={"folder": "INBOX"})
+
+
+@pytest.mark.describe("Message")
+class TestMessage:
+    @pytest.mark.it("clones all fields, including the agent name, and copies the metadata")
+    def test_clone(self):
+        message = _message()
+        clone = message.clone()
+        clone.metadata["folder"] = "Archive"
+
+        assert clone.agent_name == "agent1"
+        assert clone.model_dump(exclude={"metadata"}) == message.model_dump(exclude={"metadata"})
+        assert message.metadata == {"folder": "INBOX"}
+
+    @pytest.mark.it("adds metadata to a copy")
+    def test_with_metadata(self):
+        message = _message()
+        copy = message.with_metadata(uid=1)
+
+        assert type(copy) is Message
+        assert copy.metadata == {"folder": "INBOX", "uid": 1}
+        assert message.metadata == {"folder": "INBOX"}
+
+
+@pytest.mark.describe("Frozen message")
+class TestFrozenMessage:
+    @pytest.mark.it("is a snapshot not affected by later changes of the original message")
+    def test_freeze(self):
+        message = _message()
+        frozen = message.freeze()
+        message.metadata["folder"] = "Archive"
+        message.content = "changed"
+
+        assert isinstance(frozen, Message)
+        assert frozen.content == "content"
+        assert frozen.metadata == {"folder": "INBOX"}
+        assert frozen.freeze() is frozen
+
+    @pytest.mark.it("rejects changes of its fields and metadata")
+    def test_immutable(self):
+        frozen = _message().freeze()
+        with pytest.raises(ValidationError):
+            frozen.content = "changed"
+        with pytest.raises(TypeError):
+            frozen.metadata["folder"] = "Archive"
+        with pytest.raises(TypeError):
+            frozen.metadata.update(folder="Archive")
+
+    @pytest.mark.it("shares unchanged fields with copies carrying other metadata")
+    def test_with_metadata(self):
+        frozen = _message().freeze()
+        copy = frozen.with_metadata(uid=1)
+
+        assert isinstance(copy.metadata, FrozenDict)
+        assert copy.metadata == {"folder": "INBOX", "uid": 1}
+        assert frozen.metadata == {"folder": "INBOX"}
+        assert copy.content is frozen.content
+
+    @pytest.mark.it("equals a validated message with the same fields, built by the trusted path")
+    def test_trusted(self):
+        fields = _message().model_dump()
+        trusted = FrozenMessage.trusted(**fields)
+        validated = FrozenMessage(**fields)
+
+        assert trusted == validated
+        assert isinstance(validated.metadata, FrozenDict)
+        assert trusted.model_fields_set == validated.model_fields_set
+
+    @pytest.mark.it("serializes like a mutable message and survives pickling")
+    def test_serialize(self):
+        message = _message()
+        frozen = message.freeze()
+        codec = JsonCodec()
+
+        assert codec.encode(frozen) == codec.encode(message)
+        assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+    @pytest.mark.it("returns a mutable message when cloned")
+    def test_clone(self):
+        clone = _message().freeze().clone()
+        clone.metadata["uid"] = 1
+        clone.content = "changed"
+
+        assert type(clone) is Message
+        assert type(clone.metadata) is dict
+
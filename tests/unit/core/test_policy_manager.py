@@ -0,0 +1,360 @@
+# Policy manager and rate limiter unit tests
+import os
+import re
+import signal
+import threading
+import time
+
+import pytest
+import yaml
+
+from soma.core.contracts.policy import AccessPolicy
+from soma.core.governance.policy_store import PolicyStore
+from soma.core.policy_manager import PolicyManager
+from soma.core.rate_limiter import RateLimiter, TokenBucket
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+POLICIES = os.path.join(os.path.dirname(__file__), "..", "..", "fixtures", "config", "policies.yml")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+def _write(path, rate: int, topics: str = "[email]"):
+    path.write_text(f"""policies:
+  - agent_name: agent1
+    allowed_publish_topics: {topics}
+    rate_limit_per_topic:
+      email: {rate}
+""")
+    # Make sure the modification time differs on file systems with a coarse resolution
+    mtime = time.time() + rate
+    os.utime(path, (mtime, mtime))
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.describe("Token bucket")
+class TestTokenBucket:
+    @pytest.mark.it("starts full with one second worth of tokens")
+    def test_full(self):
+        bucket = TokenBucket(5, now=0.0)
+
+        assert bucket.available(0.0) == 5
+        assert bucket.usage(0.0) == 0.0
+
+    @pytest.mark.it("refills at its rate up to its capacity")
+    def test_refill(self):
+        bucket = TokenBucket(5, now=0.0)
+        bucket.tokens = 0
+
+        assert bucket.available(0.6) == 3
+        assert bucket.available(10.0) == 5
+
+    @pytest.mark.it("holds at least one token for rates below one per second")
+    def test_slow_rate(self):
+        bucket = TokenBucket(0.5, now=0.0)
+        bucket.tokens = 0
+
+        assert bucket.available(1.0) == 0
+        assert bucket.available(2.0) == 1
+
+
+@pytest.mark.describe("Rate limiter")
+class TestRateLimiter:
+    @pytest.mark.it("grants a burst up to the rate, then one event per refilled token")
+    def test_burst(self):
+        clock = _Clock()
+        limiter = RateLimiter({("agent1", "email"): 3}, clock=clock)
+
+        assert limiter.acquire("agent1", "email", 5) == 3
+        assert limiter.acquire("agent1", "email") == 0
+        clock.now += 1 / 3
+        assert limiter.acquire("agent1", "email", 5) == 1
+
+    @pytest.mark.it("does not limit agents and topics without a configured rate")
+    def test_unlimited(self):
+        limiter = RateLimiter({("agent1", "email"): 3}, clock=_Clock())
+
+        assert limiter.acquire("agent1", "github", 100) == 100
+        assert limiter.acquire("agent2", "email", 100) == 100
+        assert limiter.usage("agent2", "email") == 0.0
+
+    @pytest.mark.it("limits an agent across all topics, together with the topic limits")
+    def test_agent_rate(self):
+        limiter = RateLimiter({("agent1", "email"): 2}, {"agent1": 5}, clock=_Clock())
+
+        assert limiter.acquire("agent1", "email", 5) == 2
+        assert limiter.acquire("agent1", "github", 5) == 3
+        assert limiter.acquire("agent1", "other", 1) == 0
+        assert limiter.usage("agent1", "github") == 1.0
+
+    @pytest.mark.it("reports the usage of the burst capacity")
+    def test_usage(self):
+        limiter = RateLimiter({("agent1", "email"): 4}, clock=_Clock())
+        limiter.acquire("agent1", "email", 1)
+
+        assert limiter.usage("agent1", "email") == pytest.approx(0.25)
+
+    @pytest.mark.it("grants no more tokens than available to concurrent threads")
+    def test_concurrency(self):
+        limiter = RateLimiter({("agent1", "email"): 1000}, {"agent1": 1000}, clock=_Clock())
+        granted = []
+
+        def publish():
+            granted.append(sum(limiter.acquire("agent1", "email") for _ in range(500)))
+
+        threads = [threading.Thread(target=publish) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sum(granted) == 1000
+
+
+@pytest.mark.describe("Policy manager")
+class TestPolicyManager:
+    @pytest.mark.it("merges several policies of the same agent")
+    def test_merge(self):
+        manager = PolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"], rate_limit_per_topic={"email": 5}),
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["github"], rate_limit_per_topic={"email": 2},
+                         max_publish_rate_per_second=10),
+        ])
+
+        assert manager.is_allowed("agent1", "email", "publish")
+        assert manager.is_allowed("agent1", "github", "publish")
+        assert manager.rate_limits == {("agent1", "email"): 2}
+        assert manager.agent_rate_limits == {"agent1": 10}
+
+    @pytest.mark.it("loads the per-topic and per-agent rates from policies.yml")
+    def test_from_yaml(self):
+        manager = PolicyManager.from_yaml(POLICIES)
+
+        assert manager.rate_limits[("github_mail_agent", "security_alert")] == 1
+        assert manager.agent_rate_limits == {"github_mail_agent": 5}
+
+    @pytest.mark.it("enforces the rate limits per message and per batch")
+    def test_enforce(self):
+        clock = _Clock()
+        manager = PolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"], rate_limit_per_topic={"email": 3}),
+        ], clock=clock)
+
+        assert manager.enforce_rate_limit("agent1", "email")
+        assert manager.enforce_rate_limit_batch("agent1", "email", 5) == 2
+        assert not manager.enforce_rate_limit("agent1", "email")
+        assert manager.get_usage_ratio("agent1", "email") == 1.0
+        clock.now += 1.0
+        assert manager.get_usage_ratio("agent1", "email") == 0.0
+
+
+@pytest.mark.describe("Policy topic patterns")
+class TestPolicyPatterns:
+    @pytest.mark.it("matches allowed topics with wildcards like subscriptions")
+    @pytest.mark.parametrize("pattern, topic, expected", [
+        ("email", "email", True),
+        ("email", "email.raw", False),
+        ("github.*", "github.ci_activity", True),
+        ("github.*", "github", False),
+        ("github.*", "github.state_change.pr", False),
+        ("github.*", "gitlab.ci_activity", False),
+        ("github.#", "github", True),
+        ("github.#", "github.state_change.pr.closed", True),
+        ("github.#", "githubx", False),
+        ("*.ci_activity", "github.ci_activity", True),
+        ("#", "anything.at.all", True),
+    ])
+    def test_wildcards(self, pattern, topic, expected):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1", allowed_publish_topics=[pattern])])
+
+        assert manager.is_allowed("agent1", topic, "publish") is expected
+
+    @pytest.mark.it("allows a pattern subscription only if an allowed topic covers all topics it matches")
+    @pytest.mark.parametrize("pattern, expected", [
+        ("#", False),
+        ("github.#", False),
+        ("*", True),
+        ("github.*", True),
+        ("github.ci_activity", True),
+        ("*.*", False),
+        ("email.#", True),
+        ("email.*.raw", True),
+    ])
+    def test_subscribe_patterns(self, pattern, expected):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1",
+                                              allowed_subscribe_topics=["*", "github.*", "email.#"])])
+
+        assert manager.is_allowed("agent1", pattern, "subscribe") is expected
+
+    @pytest.mark.it("allows a regular expression subscription only if the policy lists it")
+    def test_subscribe_regex(self):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1", allowed_subscribe_topics=["#", r"github\..*"])])
+
+        assert manager.is_allowed("agent1", re.compile(r"github\..*"), "subscribe")
+        assert not manager.is_allowed("agent1", re.compile(r"secret\..*"), "subscribe")
+
+    @pytest.mark.it("does not deliver topics the policy denies to a pattern subscription")
+    def test_subscribe_escape(self):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1", allowed_subscribe_topics=["*", "github.*"])])
+        bus = InMemoryEventBus(policy_manager=manager)
+        received = []
+
+        def agent1(msg):
+            received.append(msg.source_id)
+
+        bus.subscribe("#", agent1)
+        bus.subscribe("github.#", agent1)
+
+        assert bus.subscribers_for("secret.x") == ()
+        assert bus.subscribers_for("github.a.b") == ()
+
+    @pytest.mark.it("keeps the directions and agents apart")
+    def test_directions(self):
+        manager = PolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["github.#"], allowed_subscribe_topics=["email"]),
+            AccessPolicy(agent_name="agent2", allowed_publish_topics=["email"]),
+        ])
+
+        assert manager.is_allowed("agent1", "email", "subscribe")
+        assert not manager.is_allowed("agent1", "email", "publish")
+        assert not manager.is_allowed("agent2", "github.ci_activity", "publish")
+        assert not manager.is_allowed("unknown", "email", "publish")
+        assert not manager.is_allowed("agent1", "email", "delete")
+
+    @pytest.mark.it("allows the github.* entries of policies.yml")
+    def test_fixture(self):
+        manager = PolicyManager.from_yaml(POLICIES)
+
+        assert manager.is_allowed("github_mail_agent", "github.ci_activity", "publish")
+        assert manager.is_allowed("github_mail_agent", "security_alert", "publish")
+
+    @pytest.mark.it("keeps a bounded cache of the most recent decisions")
+    def test_decision_cache(self):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1", allowed_publish_topics=["github.*"])],
+                                decision_cache_size=2)
+
+        assert manager.is_allowed("agent1", "github.a", "publish")
+        assert not manager.is_allowed("agent1", "gitlab.a", "publish")
+        assert manager.is_allowed("agent1", "github.a", "publish")
+        assert manager.is_allowed("agent1", "github.b", "publish")
+        assert list(manager.snapshot.decisions) == [("agent1", "github.a", "publish"), ("agent1", "github.b", "publish")]
+
+
+@pytest.mark.describe("Policy reload")
+class TestPolicyReload:
+    @pytest.mark.it("swaps in a new snapshot of the policies")
+    def test_reload(self):
+        manager = PolicyManager([AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"])])
+        snapshot = manager.snapshot
+        assert manager.is_allowed("agent1", "email", "publish")
+
+        manager.reload([AccessPolicy(agent_name="agent1", allowed_publish_topics=["github.#"])])
+
+        assert manager.snapshot is not snapshot
+        assert not manager.is_allowed("agent1", "email", "publish")
+        assert manager.is_allowed("agent1", "github.ci_activity", "publish")
+        assert snapshot.is_allowed("agent1", "email", "publish")
+
+    @pytest.mark.it("carries the rate limit state over for unchanged limits")
+    def test_rate_limit_state(self):
+        clock = _Clock()
+        manager = PolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["#"], rate_limit_per_topic={"email": 3}),
+            AccessPolicy(agent_name="agent2", allowed_publish_topics=["#"], rate_limit_per_topic={"email": 3,
+                                                                                                 "github": 3}),
+        ], clock=clock)
+        assert manager.enforce_rate_limit_batch("agent1", "email", 3) == 3
+        assert manager.enforce_rate_limit_batch("agent2", "email", 3) == 3
+        assert manager.enforce_rate_limit_batch("agent2", "github", 3) == 3
+
+        manager.reload([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["#"], rate_limit_per_topic={"email": 3}),
+            AccessPolicy(agent_name="agent2", allowed_publish_topics=["#"], rate_limit_per_topic={"email": 3,
+                                                                                                 "github": 5}),
+        ])
+
+        assert manager.enforce_rate_limit_batch("agent1", "email", 3) == 0
+        assert manager.enforce_rate_limit_batch("agent2", "email", 3) == 0
+        assert manager.enforce_rate_limit_batch("agent2", "github", 5) == 5
+
+    @pytest.mark.it("reloads the policies from their file, keeping them if the file is invalid")
+    def test_reload_file(self, tmp_path):
+        path = tmp_path / "policies.yml"
+        _write(path, 1)
+        manager = PolicyManager.from_yaml(str(path))
+
+        _write(path, 2)
+        assert manager.reload()
+        assert manager.rate_limits == {("agent1", "email"): 2}
+
+        path.write_text("policies: [{allowed_publish_topics: [email]}]")
+        assert not manager.reload()
+        assert manager.rate_limits == {("agent1", "email"): 2}
+
+    @pytest.mark.it("reloads the policies when the file changes")
+    def test_watch(self, tmp_path):
+        path = tmp_path / "policies.yml"
+        _write(path, 1)
+        manager = PolicyManager.from_yaml(str(path))
+        manager.watch(interval=0.01)
+        try:
+            _write(path, 2, "[github.#]")
+            _wait(lambda: manager.rate_limits == {("agent1", "email"): 2}, 5)
+        finally:
+            manager.stop_watching()
+
+        assert manager.is_allowed("agent1", "github.ci_activity", "publish")
+
+    @pytest.mark.it("reloads the policies on a signal")
+    def test_signal(self, tmp_path):
+        path = tmp_path / "policies.yml"
+        _write(path, 1)
+        manager = PolicyManager.from_yaml(str(path))
+        previous = signal.getsignal(signal.SIGUSR1)
+        manager.watch(interval=3600, signum=signal.SIGUSR1)
+        try:
+            snapshot = manager.snapshot
+            os.kill(os.getpid(), signal.SIGUSR1)
+            _wait(lambda: manager.snapshot is not snapshot, 5)
+        finally:
+            manager.stop_watching()
+            signal.signal(signal.SIGUSR1, previous)
+
+        assert manager.snapshot is not snapshot
+
+    @pytest.mark.it("loads and reloads the policy store")
+    def test_policy_store(self, tmp_path):
+        path = tmp_path / "policies.yml"
+        _write(path, 1)
+        store = PolicyStore(str(path))
+        assert store.get_policy("agent1").rate_limit_per_topic == {"email": 1}
+
+        _write(path, 2)
+        store.reload()
+
+        assert store.get_policy("agent1").rate_limit_per_topic == {"email": 2}
+
+    @pytest.mark.it("keeps the policies of the store when a reload fails")
+    def test_policy_store_invalid(self, tmp_path):
+        path = tmp_path / "policies.yml"
+        _write(path, 1)
+        store = PolicyStore(str(path))
+        policies = store.policies
+
+        path.write_text("policies:\n  - agent_name: [invalid\n")
+        with pytest.raises(yaml.YAMLError):
+            store.reload()
+
+        assert store.policies is policies
+        assert store.get_policy("agent1").rate_limit_per_topic == {"email": 1}
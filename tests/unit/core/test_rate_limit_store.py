@@ -0,0 +1,290 @@
+# Rate limit store unit tests
+import multiprocessing
+import os
+import time
+import uuid
+
+import pytest
+
+from soma.core.contracts.policy import AccessPolicy
+from soma.core.policy_manager import PolicyManager
+from soma.core import rate_limit_store
+from soma.core.rate_limit_store import (LocalRateLimitStore, NetworkRateLimitStore, RateLimitServer,
+                                        RateLimitStore, SharedMemoryRateLimitStore)
+from soma.core.rate_limiter import RateLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _CountingStore(LocalRateLimitStore):
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.calls = 0
+        self.usage_calls = 0
+
+    def take(self, key: str, rate: float, count: int) -> int:
+        self.calls += 1
+        return super().take(key, rate, count)
+
+    def usage(self, key: str, rate: float) -> float:
+        self.usage_calls += 1
+        return super().usage(key, rate)
+
+
+def _take_many(name: str, count: int, results):
+    store = SharedMemoryRateLimitStore(name)
+    try:
+        results.put(sum(store.take("agent1\0email", 100, 1) for _ in range(count)))
+    finally:
+        store.close()
+
+
+@pytest.fixture
+def shm_name():
+    return f"soma-test-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def server():
+    server = RateLimitServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.describe("Local rate limit store")
+class TestLocalRateLimitStore:
+    @pytest.mark.it("implements the abstract store")
+    def test_abstract(self):
+        with pytest.raises(TypeError):
+            RateLimitStore()
+
+    @pytest.mark.it("takes tokens from a full bucket that refills at its rate")
+    def test_take(self):
+        clock = _Clock()
+        store = LocalRateLimitStore(clock)
+
+        assert store.take("key", 10, 15) == 10
+        assert store.usage("key", 10) == 1.0
+        clock.now += 0.5
+        assert store.take("key", 10, 15) == 5
+
+    @pytest.mark.it("applies a changed rate to an existing bucket")
+    def test_rate_change(self):
+        store = LocalRateLimitStore(_Clock())
+        store.take("key", 10, 2)
+
+        assert store.take("key", 5, 10) == 5
+
+
+@pytest.mark.describe("Rate limiter with a store")
+class TestSharedRateLimiter:
+    @pytest.mark.it("shares the limits of several limiters")
+    def test_shared(self):
+        clock = _Clock()
+        store = LocalRateLimitStore(clock)
+        limiters = [RateLimiter({("agent1", "email"): 10}, clock=clock, store=store) for _ in range(3)]
+
+        granted = sum(limiter.acquire("agent1", "email") for _ in range(10) for limiter in limiters)
+
+        assert granted == 10
+
+    @pytest.mark.it("leases tokens from the store in batches")
+    def test_batches(self):
+        clock = _Clock()
+        store = _CountingStore(clock)
+        limiter = RateLimiter({("agent1", "email"): 100}, clock=clock, store=store, batch=0.1)
+
+        assert sum(limiter.acquire("agent1", "email") for _ in range(50)) == 50
+        assert store.calls == 5
+        assert limiter.acquire("agent1", "email", 30) == 30
+        assert store.calls == 6
+
+    @pytest.mark.it("keeps tokens leased for one bucket when the other one grants less")
+    def test_agent_and_topic(self):
+        clock = _Clock()
+        store = LocalRateLimitStore(clock)
+        limiter = RateLimiter({("agent1", "email"): 10}, {"agent1": 3}, clock=clock, store=store, batch=1.0)
+
+        assert limiter.acquire("agent1", "email", 5) == 3
+        assert limiter.acquire("agent1", "github", 5) == 0
+        assert store.usage("agent1\0email", 10) == 1.0
+
+    @pytest.mark.it("drops leased tokens after the lease expired")
+    def test_lease_ttl(self):
+        clock = _Clock()
+        store = _CountingStore(clock)
+        limiter = RateLimiter({("agent1", "email"): 100}, clock=clock, store=store, batch=0.5, lease_ttl=1.0)
+        limiter.acquire("agent1", "email")
+        clock.now += 2.0
+
+        assert limiter.acquire("agent1", "email")
+        assert store.calls == 2
+
+    @pytest.mark.it("does not ask an exhausted store again before the missing tokens were refilled")
+    def test_backoff(self):
+        clock = _Clock()
+        store = _CountingStore(clock)
+        limiter = RateLimiter({("agent1", "email"): 10}, clock=clock, store=store, batch=1.0)
+
+        assert sum(limiter.acquire("agent1", "email") for _ in range(20)) == 10
+        assert store.calls == 2
+        clock.now += 0.5
+        assert not limiter.acquire("agent1", "email")
+        clock.now += 0.5
+        assert limiter.acquire("agent1", "email")
+        assert store.calls == 3
+
+    @pytest.mark.it("estimates the usage of an exhausted store without asking it")
+    def test_usage(self):
+        clock = _Clock()
+        store = _CountingStore(clock)
+        limiter = RateLimiter({("agent1", "email"): 10}, clock=clock, store=store, batch=1.0)
+
+        assert limiter.usage("agent1", "email") == 0.0
+        assert sum(limiter.acquire("agent1", "email") for _ in range(20)) == 10
+        assert limiter.usage("agent1", "email") == 1.0
+        clock.now += 0.5
+        assert limiter.usage("agent1", "email") == pytest.approx(0.5)
+        assert store.usage_calls == 0
+
+    @pytest.mark.it("shares the limits of several policy managers")
+    def test_policy_managers(self):
+        clock = _Clock()
+        store = LocalRateLimitStore(clock)
+        policies = [AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"],
+                                 rate_limit_per_topic={"email": 10})]
+        managers = [PolicyManager(policies, clock=clock, rate_limit_store=store) for _ in range(2)]
+
+        assert managers[0].enforce_rate_limit_batch("agent1", "email", 6) == 6
+        assert managers[1].enforce_rate_limit_batch("agent1", "email", 6) == 4
+
+
+@pytest.mark.describe("Shared memory rate limit store")
+class TestSharedMemoryRateLimitStore:
+    @pytest.mark.it("shares the buckets between attached instances")
+    def test_attach(self, shm_name):
+        owner = SharedMemoryRateLimitStore(shm_name, slots=16, create=True)
+        other = SharedMemoryRateLimitStore(shm_name)
+        try:
+            assert owner.take("key", 10, 6) == 6
+            assert other.take("key", 10, 6) == 4
+            assert other.take("other", 10, 6) == 6
+            assert owner.usage("key", 10) > 0.9
+        finally:
+            other.close()
+            owner.close()
+
+    @pytest.mark.it("raises an error if all slots are in use")
+    def test_full(self, shm_name):
+        store = SharedMemoryRateLimitStore(shm_name, slots=2, create=True)
+        try:
+            store.take("a", 1, 1)
+            store.take("b", 1, 1)
+            with pytest.raises(RuntimeError):
+                store.take("c", 1, 1)
+        finally:
+            store.close()
+
+    @pytest.mark.it("enforces a limit across processes")
+    def test_processes(self, shm_name):
+        store = SharedMemoryRateLimitStore(shm_name, create=True)
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        try:
+            started = time.monotonic()
+            processes = [context.Process(target=_take_many, args=(shm_name, 100, results)) for _ in range(4)]
+            for process in processes:
+                process.start()
+            granted = sum(results.get(timeout=30) for _ in processes)
+            elapsed = time.monotonic() - started
+            for process in processes:
+                process.join()
+        finally:
+            store.close()
+
+        assert 100 <= granted <= 100 + 100 * elapsed + 1
+
+    @pytest.mark.it("removes the segment when its owner closes it")
+    def test_close(self, shm_name):
+        store = SharedMemoryRateLimitStore(shm_name, create=True)
+        store.close()
+
+        assert not os.path.exists(f"/dev/shm/{shm_name}")
+
+
+@pytest.mark.describe("Network rate limit store")
+class TestNetworkRateLimitStore:
+    @pytest.mark.it("shares the buckets of a server between clients")
+    def test_shared(self, server):
+        clients = [NetworkRateLimitStore(server.server_address) for _ in range(2)]
+        try:
+            assert clients[0].take("key", 10, 6) == 6
+            assert clients[1].take("key", 10, 6) == 4
+            assert clients[1].usage("key", 10) > 0.9
+        finally:
+            for client in clients:
+                client.close()
+
+    @pytest.mark.it("reconnects after the connection broke")
+    def test_reconnect(self, server):
+        client = NetworkRateLimitStore(server.server_address)
+        try:
+            assert client.take("key", 10, 1) == 1
+            client._socket.close()
+            assert client.take("key", 10, 1) == 1
+        finally:
+            client.close()
+
+    @pytest.mark.it("denies tokens while the server is unavailable, unless failing open")
+    def test_unavailable(self, server):
+        address = server.server_address
+        server.stop()
+
+        assert NetworkRateLimitStore(address, timeout=0.5).take("key", 10, 3) == 0
+        assert NetworkRateLimitStore(address, timeout=0.5, fail_open=True).take("key", 10, 3) == 3
+
+    @pytest.mark.it("does not try to reach an unavailable server again before the back-off passed")
+    def test_backoff(self, server, monkeypatch):
+        address = server.server_address
+        server.stop()
+        connects = []
+        create_connection = rate_limit_store.socket.create_connection
+
+        def counting(*args, **kwargs):
+            connects.append(args)
+            return create_connection(*args, **kwargs)
+
+        monkeypatch.setattr(rate_limit_store.socket, "create_connection", counting)
+        client = NetworkRateLimitStore(address, timeout=0.5, backoff=0.3)
+        assert client.take("key", 10, 3) == 0
+        assert len(connects) == 1
+
+        restarted = RateLimitServer(address)
+        restarted.start()
+        try:
+            assert client.take("key", 10, 3) == 0
+            assert client.usage("key", 10) == 1.0
+            assert len(connects) == 1
+            time.sleep(0.35)
+            assert client.take("key", 10, 3) == 3
+            assert len(connects) == 2
+        finally:
+            client.close()
+            restarted.stop()
+
+    @pytest.mark.it("serves a rate limiter leasing tokens in batches")
+    def test_rate_limiter(self, server):
+        store = NetworkRateLimitStore(server.server_address)
+        try:
+            limiter = RateLimiter({("agent1", "email"): 1000}, store=store)
+
+            assert sum(limiter.acquire("agent1", "email") for _ in range(500)) == 500
+        finally:
+            store.close()
@@ -0,0 +1,173 @@
+# Asyncio event bus unit tests
+import asyncio
+import threading
+import time
+
+import pytest
+
+from soma.core.contracts.event_bus import AsyncEventSubscriber, EventSubscriber
+from soma.core.contracts.message import Message
+from soma.eventbus.async_bus import AsyncEventBus
+from soma.eventbus.retry import RetryPolicy
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+class AsyncAgent(AsyncEventSubscriber):
+    def __init__(self):
+        self.name = "async_agent"
+        self.received = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, msg):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.02)
+        self.active -= 1
+        self.received.append(msg.source_id)
+
+
+class SyncAgent(EventSubscriber):
+    def __init__(self):
+        self.name = "sync_agent"
+        self.received = []
+        self.threads = set()
+
+    def handle(self, msg):
+        self.threads.add(threading.current_thread().name)
+        self.received.append(msg.source_id)
+
+
+@pytest.mark.describe("Async Event Bus")
+class TestAsyncEventBus:
+    @pytest.mark.it("delivers messages to async and sync subscribers")
+    def test_async_and_sync(self):
+        async_agent = AsyncAgent()
+        sync_agent = SyncAgent()
+        bus = AsyncEventBus()
+        bus.subscribe("email", async_agent)
+        bus.subscribe("email", sync_agent)
+        bus.start()
+        for i in range(5):
+            bus.publish("email", _message(i))
+
+        _wait(lambda: len(async_agent.received) == 5 and len(sync_agent.received) == 5, 3)
+        bus.stop()
+
+        assert sorted(async_agent.received) == [f"msg-{i}" for i in range(5)]
+        assert sorted(sync_agent.received) == [f"msg-{i}" for i in range(5)]
+        assert all(name.startswith("soma-async-sync") for name in sync_agent.threads)
+
+    @pytest.mark.it("bounds the concurrency per subscriber")
+    def test_concurrency(self):
+        agent = AsyncAgent()
+        bus = AsyncEventBus()
+        bus.subscribe("email", agent, concurrency=3)
+        bus.publish_many("email", [_message(i) for i in range(12)])
+        bus.start()
+
+        _wait(lambda: len(agent.received) == 12, 3)
+        bus.stop()
+
+        assert len(agent.received) == 12
+        assert agent.max_active == 3
+
+    @pytest.mark.it("does not hold up other subscribers while a subscriber is at its concurrency limit")
+    def test_slow_subscriber(self):
+        release = asyncio.Event()
+        slow_received = []
+
+        class SlowAgent(AsyncEventSubscriber):
+            name = "slow_agent"
+
+            async def handle(self, msg):
+                await release.wait()
+                slow_received.append(msg.source_id)
+
+        fast = SyncAgent()
+        bus = AsyncEventBus()
+        bus.subscribe("email", SlowAgent(), concurrency=1)
+        bus.subscribe("email", fast)
+        bus.start()
+        for i in range(5):
+            bus.publish("email", _message(i))
+
+        _wait(lambda: len(fast.received) == 5, 3)
+        fast_received = list(fast.received)
+        bus.loop.call_soon_threadsafe(release.set)
+        _wait(lambda: len(slow_received) == 5, 3)
+        bus.stop()
+
+        assert fast_received == [f"msg-{i}" for i in range(5)]
+        assert slow_received == [f"msg-{i}" for i in range(5)]
+
+    @pytest.mark.it("bounds the backlog per subscriber, leaving further messages in the topic queue")
+    def test_backlog(self):
+        release = asyncio.Event()
+        received = []
+
+        async def handler(msg):
+            await release.wait()
+            received.append(msg.source_id)
+
+        bus = AsyncEventBus(max_pending=2)
+        bus.subscribe("email", handler, concurrency=1)
+        bus.publish_many("email", [_message(i) for i in range(10)])
+        bus.start()
+        time.sleep(0.1)
+        backlog = bus.subscriptions[id(handler)].queue.qsize()
+        queued = bus.queues["email"].qsize()
+        bus.loop.call_soon_threadsafe(release.set)
+        _wait(lambda: len(received) == 10, 3)
+        bus.stop()
+
+        assert backlog == 2
+        assert queued == 6
+        assert received == [f"msg-{i}" for i in range(10)]
+
+    @pytest.mark.it("cancels retries waiting for room in the backlog when stopped")
+    def test_stop_waiting_retries(self):
+        blocked = asyncio.Event()
+
+        async def handler(msg):
+            if msg.source_id == "msg-0":
+                raise RuntimeError("failed")
+            await blocked.wait()
+
+        bus = AsyncEventBus(max_pending=1, retry=RetryPolicy(max_attempts=2, initial_backoff=0.05, jitter=0))
+        bus.subscribe("email", handler, concurrency=1)
+        bus.start()
+        for i in range(3):
+            bus.publish("email", _message(i))
+        _wait(lambda: bus._waiting, 2)
+        waiting = list(bus._waiting)
+        bus.stop(timeout=0.1)
+
+        assert len(waiting) == 1
+        assert waiting[0].cancelled()
+
+    @pytest.mark.it("consumes topics subscribed after start()")
+    def test_subscribe_after_start(self):
+        received = []
+
+        async def handler(msg):
+            received.append(msg.source_id)
+
+        bus = AsyncEventBus()
+        bus.start()
+        bus.subscribe("email", handler)
+        bus.publish("email", _message(0))
+
+        _wait(lambda: received, 3)
+        bus.stop()
+
+        assert received == ["msg-0"]
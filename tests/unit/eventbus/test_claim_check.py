@@ -0,0 +1,236 @@
+# Claim check unit tests
+import hashlib
+import os
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message, FrozenMessage
+from soma.eventbus.claim_check import BlobStore, ClaimCheck, ClaimedMessage, CLAIM_CHECK
+from soma.eventbus.codec import JsonCodec
+from soma.eventbus.dedupe import Deduplicator
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.topic_queue import BackpressureError
+
+
+def _message(i: int, size: int = 1000) -> Message:
+    return Message(agent_name="agent1", source_type="email", source_id=f"msg-{i}", content=f"{i}:" + "x" * size,
+                   metadata={"folder": "INBOX"})
+
+
+def _digest(i: int, size: int = 1000) -> str:
+    return hashlib.sha256(f"{i}:{'x' * size}".encode()).hexdigest()
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    yield store
+    store.close()
+
+
+@pytest.mark.describe("Blob store")
+class TestBlobStore:
+    @pytest.mark.it("stores equal content once and counts its references")
+    def test_put(self, store):
+        first = store.put(b"content")
+        second = store.put(b"content")
+
+        assert first == second
+        assert store.read(first) == b"content"
+        assert store.refs(first) == 2
+
+    @pytest.mark.it("removes blobs without references after the grace period")
+    def test_collect(self, store):
+        digest = store.put(b"content")
+        kept = store.put(b"other")
+        store.release([digest])
+
+        assert store.collect(grace=60) == 0
+        assert store.collect(grace=0) == 1
+        assert not os.path.exists(store.path(digest))
+        assert store.read(kept) == b"other"
+
+    @pytest.mark.it("removes referenced blobs after the maximum age")
+    def test_max_age(self, store):
+        digest = store.put(b"content")
+        time.sleep(0.01)
+
+        assert store.collect(max_age=0) == 1
+        assert not os.path.exists(store.path(digest))
+
+    @pytest.mark.it("releases a named reference only once")
+    def test_release_once(self, store):
+        digest = store.put(b"content")
+        store.retain(digest)
+        store.release([digest, digest], ["first", "first"])
+        store.release([digest], ["first"])
+
+        assert store.refs(digest) == 1
+
+
+@pytest.mark.describe("Claim check")
+class TestClaimCheck:
+    @pytest.mark.it("replaces content above the threshold by a reference")
+    def test_check_in(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        small, large = claim_check.check_in([_message(1, size=10), _message(2)])
+
+        assert small.content == "1:" + "x" * 10
+        assert large.content == ""
+        assert large.metadata["folder"] == "INBOX"
+        assert store.read(large.metadata[CLAIM_CHECK]["digest"]) == ("2:" + "x" * 1000).encode()
+        assert len(JsonCodec().encode(large)) < 300
+
+    @pytest.mark.it("reads the content when it is accessed for the first time")
+    def test_lazy(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        claimed = claim_check.check_out(claim_check.check_in([_message(1)]))[0]
+
+        assert isinstance(claimed, ClaimedMessage)
+        assert not claimed.is_loaded
+        assert claimed.source_id == "msg-1"
+        assert not claimed.is_loaded
+        assert claimed.content == "1:" + "x" * 1000
+        assert claimed.is_loaded
+
+    @pytest.mark.it("keeps the reference when a claimed message is serialized or published again")
+    def test_republish(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        checked = claim_check.check_in([_message(1)])[0]
+        claimed = claim_check.check_out([checked])[0]
+        digest = checked.metadata[CLAIM_CHECK]["digest"]
+
+        assert JsonCodec().encode(claimed) == JsonCodec().encode(checked)
+        assert claim_check.check_in([claimed.with_metadata(seen=True)])[0].content == ""
+        assert store.refs(digest) == 2
+        assert not claimed.is_loaded
+
+    @pytest.mark.it("releases the reference of a message delivered twice once")
+    def test_redelivery(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        checked = claim_check.check_in([_message(1)])[0]
+        republished = claim_check.check_in([claim_check.check_out([checked])[0]])[0]
+        claim_check.release([checked])
+        claim_check.release([checked])
+
+        assert store.refs(_digest(1)) == 1
+        claim_check.release([republished])
+        assert store.refs(_digest(1)) == 0
+
+    @pytest.mark.it("resolves the content when a claimed message is cloned or frozen with changes")
+    def test_clone(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        claimed = claim_check.check_out(claim_check.check_in([_message(1)]))[0]
+        clone = claimed.clone()
+        frozen = claimed.freeze(subject="changed")
+
+        assert type(clone) is Message
+        assert clone.content == "1:" + "x" * 1000
+        assert CLAIM_CHECK not in clone.metadata
+        assert type(frozen) is FrozenMessage
+        assert frozen.content == clone.content
+
+    @pytest.mark.it("carries large content by reference through the in-memory bus and releases it after delivery")
+    def test_memory_bus(self, store, tmp_path):
+        claim_check = ClaimCheck(store, threshold=100, grace=0, collect_interval=0)
+        received = []
+        bus = InMemoryEventBus(claim_check=claim_check, log_dir=str(tmp_path / "log"))
+        bus.subscribe("claim.topic", lambda msg: received.append(msg.content))
+        bus.start()
+        bus.publish("claim.topic", _message(1))
+        bus.publish("claim.topic", _message(2, size=10))
+        _wait(lambda: len(received) == 2, 2.0)
+        bus.stop()
+        bus.log.close()
+
+        assert sorted(received) == ["1:" + "x" * 1000, "2:" + "x" * 10]
+        assert not os.path.exists(store.path(_digest(1)))
+
+    @pytest.mark.it("keeps the reference of a message until its retry is done")
+    def test_retry(self, store):
+        claim_check = ClaimCheck(store, threshold=100, grace=0, collect_interval=0)
+        refs = []
+
+        def handler(msg):
+            refs.append(store.refs(_digest(1)))
+            if len(refs) == 1:
+                raise RuntimeError("first attempt fails")
+
+        bus = InMemoryEventBus(claim_check=claim_check, retry=RetryPolicy(initial_backoff=0.05, jitter=0))
+        bus.subscribe("claim.retry", handler)
+        bus.start()
+        try:
+            bus.publish("claim.retry", _message(1))
+            _wait(lambda: len(refs) == 2 and store.refs(_digest(1)) == 0, 2.0)
+        finally:
+            bus.stop()
+
+        assert refs == [1, 1]
+        assert store.refs(_digest(1)) == 0
+
+    @pytest.mark.it("passes the reference on to the dead letter of a message")
+    def test_dead_letter(self, store):
+        claim_check = ClaimCheck(store, threshold=100, grace=0, collect_interval=0)
+        dead_letters = []
+
+        def handler(msg):
+            raise RuntimeError("always fails")
+
+        bus = InMemoryEventBus(claim_check=claim_check,
+                               retry=RetryPolicy(max_attempts=2, initial_backoff=0.01, jitter=0))
+        bus.subscribe("claim.failing", handler)
+        bus.subscribe("dead_letter.claim.failing", lambda msg: dead_letters.append(msg.content))
+        bus.start()
+        try:
+            bus.publish("claim.failing", _message(1))
+            _wait(lambda: dead_letters and store.refs(_digest(1)) == 0, 2.0)
+        finally:
+            bus.stop()
+
+        assert dead_letters == ["1:" + "x" * 1000]
+        assert store.refs(_digest(1)) == 0
+
+    @pytest.mark.it("releases the references of messages dropped by the overflow policy or as duplicates")
+    def test_dropped(self, store):
+        claim_check = ClaimCheck(store, threshold=100)
+        received = []
+        bus = InMemoryEventBus(claim_check=claim_check, max_queue_size=2, overflow="drop_newest",
+                               dedupe=Deduplicator(capacity=100))
+        bus.publish("claim.dropped", _message(1))
+        bus.publish("claim.dropped", _message(1))
+        bus.publish("claim.dropped", _message(2))
+
+        assert store.refs(_digest(1)) == 2
+        assert store.refs(_digest(2)) == 0
+
+        bus.subscribe("claim.dropped", lambda msg: received.append(msg.source_id))
+        bus.start()
+        try:
+            _wait(lambda: store.refs(_digest(1)) == 0, 2.0)
+        finally:
+            bus.stop()
+
+        assert received == ["msg-1"]
+        assert store.refs(_digest(1)) == 0
+
+    @pytest.mark.it("releases the references of messages rejected by the overflow policy")
+    def test_rejected(self, store, tmp_path):
+        claim_check = ClaimCheck(store, threshold=100)
+        bus = InMemoryEventBus(claim_check=claim_check, max_queue_size=1, overflow="raise",
+                               log_dir=str(tmp_path / "log"))
+        bus.publish("claim.rejected", _message(1))
+        with pytest.raises(BackpressureError):
+            bus.publish_many("claim.rejected", [_message(2), _message(3)])
+        bus.log.close()
+
+        assert store.refs(_digest(1)) == 1
+        assert store.refs(_digest(2)) == 0
+        assert store.refs(_digest(3)) == 0
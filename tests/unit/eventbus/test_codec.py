@@ -0,0 +1,93 @@
+# Message codec unit tests
+import json
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus import codec as codec_module
+from soma.eventbus.codec import FORMAT_MSGPACK, JsonCodec, MsgpackCodec, get_codec, msgpack, orjson
+from soma.eventbus.segment_log import SegmentLog
+
+
+def _message() -> Message:
+    return Message(agent_name="agent1", source_type="email", source_id="<1@example.com>", subject="Hällo",
+                   content="content", metadata={"folder": "INBOX", "uid": 7, "flags": ["seen"]})
+
+
+_available = ["json"] + (["orjson"] if orjson else []) + (["msgpack"] if msgpack else [])
+
+
+@pytest.mark.describe("Message codecs")
+class TestCodec:
+    @pytest.mark.it("restores the encoded message")
+    @pytest.mark.parametrize("name", _available)
+    def test_round_trip(self, name):
+        codec = get_codec(name)
+        assert codec.decode(codec.encode(_message())) == _message()
+
+    @pytest.mark.it("decodes messages written by any available codec")
+    @pytest.mark.parametrize("writer", _available)
+    @pytest.mark.parametrize("reader", _available)
+    def test_mixed(self, writer, reader):
+        assert get_codec(reader).decode(get_codec(writer).encode(_message())) == _message()
+
+    @pytest.mark.it("decodes plain JSON written before codecs were introduced")
+    def test_legacy_json(self):
+        data = json.dumps(_message().model_dump()).encode("utf-8")
+        assert JsonCodec().decode(data) == _message()
+
+    @pytest.mark.it("prefixes binary formats with their format byte")
+    def test_format_byte(self):
+        assert JsonCodec().encode(_message())[:1] == b"{"
+        if msgpack is not None:
+            assert MsgpackCodec().encode(_message())[0] == MsgpackCodec.format
+
+    @pytest.mark.it("rejects unknown formats and codec names")
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            JsonCodec().decode(b"\x7f\x00")
+        with pytest.raises(ValueError):
+            get_codec("xml")
+
+
+@pytest.mark.describe("MessagePack codec")
+class TestMsgpackCodec:
+    @pytest.mark.it("restores a message encoded as MessagePack behind its format byte")
+    def test_round_trip(self):
+        packer = pytest.importorskip("msgpack")
+        data = MsgpackCodec().encode(_message())
+
+        assert data[0] == FORMAT_MSGPACK == 0x01
+        assert packer.unpackb(data[1:])["source_id"] == "<1@example.com>"
+        assert MsgpackCodec().decode(data) == _message()
+
+    @pytest.mark.it("decodes JSON and MessagePack records with either codec")
+    def test_cross_format(self):
+        pytest.importorskip("msgpack")
+        json_data = JsonCodec().encode(_message())
+        msgpack_data = MsgpackCodec().encode(_message())
+
+        assert JsonCodec().decode(msgpack_data) == _message()
+        assert MsgpackCodec().decode(json_data) == _message()
+
+    @pytest.mark.it("reads a segment log written with JSON after switching to MessagePack")
+    def test_segment_log(self, tmp_path):
+        pytest.importorskip("msgpack")
+        log = SegmentLog(str(tmp_path), codec="json")
+        log.append("email", [_message()])
+        log.close()
+        log = SegmentLog(str(tmp_path), codec="msgpack")
+        log.append("email", [_message()])
+
+        assert [message for _, _, message in log.read("email", 0)] == [_message(), _message()]
+        log.close()
+
+    @pytest.mark.it("rejects MessagePack records if msgpack is not installed")
+    def test_missing_package(self, monkeypatch):
+        monkeypatch.setattr(codec_module, "msgpack", None)
+        monkeypatch.setattr(codec_module, "_decoders", {})
+
+        with pytest.raises(ValueError, match="MessagePack"):
+            JsonCodec().decode(bytes((FORMAT_MSGPACK,)) + b"\x80")
+        with pytest.raises(ImportError):
+            get_codec("msgpack")
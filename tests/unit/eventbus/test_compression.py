@@ -0,0 +1,151 @@
+# Compression unit tests
+import base64
+import os
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message, FrozenMessage
+from soma.eventbus.claim_check import ClaimCheck, CLAIM_CHECK
+from soma.eventbus.codec import JsonCodec
+from soma.eventbus.compression import Compression, CompressedMessage, COMPRESSION, zstandard
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.metrics import COMPRESSION_RATIO, COMPRESSION_CPU_SECONDS
+
+TEXT = "Received: from mail.example.com by mx.example.org with ESMTPS; a line of a raw email\n" * 200
+
+
+def _message(i: int, content: str = TEXT) -> Message:
+    return Message(agent_name="agent1", source_type="email", source_id=f"msg-{i}", content=content,
+                   metadata={"folder": "INBOX"})
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Compression")
+class TestCompression:
+    @pytest.mark.it("compresses content above the threshold and decompresses it when it is accessed")
+    def test_roundtrip(self):
+        compression = Compression(codec="zlib", threshold=1000)
+        small, large = compression.compress([_message(1, "short"), _message(2)])
+        delivered = Compression.decompress([small, large])
+
+        assert small.content == "short"
+        assert large.metadata[COMPRESSION] == {"codec": "zlib", "size": len(TEXT)}
+        assert len(JsonCodec().encode(large)) < len(TEXT) / 5
+        assert isinstance(delivered[1], CompressedMessage)
+        assert not delivered[1].is_loaded
+        assert delivered[1].content == TEXT
+        assert delivered[1].metadata["folder"] == "INBOX"
+
+    @pytest.mark.it("leaves content that does not compress well as it is")
+    def test_min_ratio(self):
+        random_text = base64.b64encode(os.urandom(3000)).decode()
+        compressed, = Compression(codec="zlib", threshold=1000, min_ratio=1.25).compress([_message(1, random_text)])
+
+        assert compressed.content == random_text
+        assert COMPRESSION not in compressed.metadata
+
+    @pytest.mark.it("records the compression ratio and the CPU time")
+    def test_metrics(self):
+        ratio = COMPRESSION_RATIO.labels(topic="compression.metrics")
+        before = ratio._sum.get()
+        cpu = COMPRESSION_CPU_SECONDS.labels(operation="decompress")._value.get()
+        compressed, = Compression(codec="zlib", threshold=1000).compress([_message(1)], topic="compression.metrics")
+        _ = Compression.decompress([compressed])[0].content
+
+        assert ratio._sum.get() - before > 5
+        assert COMPRESSION_CPU_SECONDS.labels(operation="decompress")._value.get() > cpu
+
+    @pytest.mark.it("publishes a decompressed message again without compressing it twice")
+    def test_republish(self):
+        compression = Compression(codec="zlib", threshold=1000)
+        compressed, = compression.compress([_message(1)])
+        delivered = Compression.decompress([compressed])[0]
+        _ = delivered.content
+        again, = compression.compress([delivered.with_metadata(seen=True)])
+
+        assert type(again) is FrozenMessage
+        assert again.content == compressed.content
+        assert again.metadata["seen"] is True
+
+    @pytest.mark.it("resolves the content when a compressed message is cloned")
+    def test_clone(self):
+        compressed, = Compression(codec="zlib", threshold=1000).compress([_message(1)])
+        clone = Compression.decompress([compressed])[0].clone()
+
+        assert type(clone) is Message
+        assert clone.content == TEXT
+        assert COMPRESSION not in clone.metadata
+
+    @pytest.mark.it("uses zstd if available")
+    def test_auto(self):
+        assert Compression().codec == ("zstd" if zstandard is not None else "zlib")
+        if zstandard is None:
+            with pytest.raises(ImportError):
+                Compression(codec="zstd")
+        with pytest.raises(ValueError):
+            Compression(codec="lz4")
+
+
+@pytest.mark.describe("zstd compression")
+class TestZstdCompression:
+    @pytest.mark.it("compresses content with zstd and decompresses it when it is accessed")
+    def test_roundtrip(self):
+        zstd = pytest.importorskip("zstandard")
+        compressed, = Compression(codec="zstd", threshold=1000).compress([_message(1)])
+        delivered, = Compression.decompress([compressed])
+
+        assert compressed.metadata[COMPRESSION] == {"codec": "zstd", "size": len(TEXT)}
+        assert zstd.decompress(base64.b64decode(compressed.content)).decode("utf-8") == TEXT
+        assert delivered.content == TEXT
+
+    @pytest.mark.it("is used by default, and decompresses messages compressed with zlib")
+    def test_auto(self):
+        pytest.importorskip("zstandard")
+        compression = Compression(threshold=1000)
+        zlib_compressed, = Compression(codec="zlib", threshold=1000).compress([_message(1)])
+        zstd_compressed, = compression.compress([_message(2)])
+
+        assert compression.codec == "zstd"
+        assert zstd_compressed.metadata[COMPRESSION]["codec"] == "zstd"
+        assert [message.content for message in Compression.decompress([zlib_compressed, zstd_compressed])] == \
+               [TEXT, TEXT]
+
+
+@pytest.mark.describe("Compressing buses")
+class TestCompressingBus:
+    @pytest.mark.it("keeps messages compressed in the queue and the log of the in-memory bus")
+    def test_memory_bus(self, tmp_path):
+        received = []
+        bus = InMemoryEventBus(compression=Compression(codec="zlib", threshold=1000), log_dir=str(tmp_path))
+        bus.publish("compression.topic", _message(1))
+        logged = bus.log.read("compression.topic", 0)[0][2]
+        bus.subscribe("compression.topic", lambda msg: received.append(msg.content))
+        bus.start()
+        _wait(lambda: received, 2.0)
+        bus.stop()
+        bus.log.close()
+
+        assert COMPRESSION in logged.metadata
+        assert received == [TEXT]
+
+    @pytest.mark.it("passes compressed messages on when republished through a claim check")
+    def test_claim_check(self, tmp_path):
+        compression = Compression(codec="zlib", threshold=1000)
+        received = []
+        bus = InMemoryEventBus(compression=compression,
+                               claim_check=ClaimCheck(str(tmp_path / "blobs"), threshold=1000))
+        bus.subscribe("compression.first", lambda msg: bus.publish("compression.second", msg))
+        bus.subscribe("compression.second", lambda msg: received.append(msg))
+        bus.start()
+        bus.publish("compression.first", _message(1))
+        _wait(lambda: received, 2.0)
+        bus.stop()
+
+        assert CLAIM_CHECK in received[0].metadata
+        assert received[0].content == TEXT
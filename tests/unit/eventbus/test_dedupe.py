@@ -0,0 +1,141 @@
+# Deduplication unit tests
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.async_bus import AsyncEventBus
+from soma.eventbus.dedupe import BloomFilter, Deduplicator, SqliteDedupeStore
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def _message(i: int, source_type: str = "test") -> Message:
+    return Message(agent_name="agent1", source_type=source_type, source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.describe("Bloom filter")
+class TestBloomFilter:
+    @pytest.mark.it("contains all added entries")
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"id-{i}")
+        assert all(f"id-{i}" in bloom for i in range(1000))
+
+    @pytest.mark.it("keeps the false positive rate near the configured rate")
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10_000, 0.01)
+        for i in range(10_000):
+            bloom.add(f"id-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10_000))
+        assert false_positives < 200
+
+
+@pytest.mark.describe("Deduplicator")
+class TestDeduplicator:
+    @pytest.mark.it("drops messages seen before, including repetitions within a batch")
+    def test_filter(self):
+        dedupe = Deduplicator(capacity=100)
+        first = dedupe.filter([_message(1), _message(2), _message(1)])
+        second = dedupe.filter([_message(2), _message(3)])
+
+        assert [msg.source_id for msg in first] == ["msg-1", "msg-2"]
+        assert [msg.source_id for msg in second] == ["msg-3"]
+
+    @pytest.mark.it("distinguishes source types and scopes, and passes messages with an empty source_id")
+    def test_key(self):
+        dedupe = Deduplicator(capacity=100)
+        assert not dedupe.is_duplicate(_message(1, "email"))
+        assert not dedupe.is_duplicate(_message(1, "mastodon"))
+        assert not dedupe.is_duplicate(_message(1, "email"), scope="other")
+        assert dedupe.is_duplicate(_message(1, "email"))
+
+        anonymous = Message(agent_name="agent1", source_type="test", source_id="", content="no id")
+        assert not dedupe.is_duplicate(anonymous)
+        assert not dedupe.is_duplicate(anonymous)
+
+    @pytest.mark.it("does not record messages as seen until they are remembered")
+    def test_remember(self):
+        dedupe = Deduplicator(capacity=100)
+        assert dedupe.filter([_message(1)], remember=False)
+        assert dedupe.filter([_message(1)], remember=False)
+        dedupe.remember([_message(1)])
+        assert not dedupe.filter([_message(1)])
+
+    @pytest.mark.it("forgets messages after two windows")
+    def test_window(self):
+        clock = _Clock()
+        dedupe = Deduplicator(window=60, capacity=100, clock=clock)
+        dedupe.is_duplicate(_message(1))
+
+        clock.now += 90
+        assert dedupe.is_duplicate(_message(1))
+        clock.now += 60
+        assert not dedupe.is_duplicate(_message(1))
+
+    @pytest.mark.it("passes messages evicted from the LRU set without a store")
+    def test_lru(self):
+        dedupe = Deduplicator(capacity=100, lru_size=2)
+        dedupe.filter([_message(1), _message(2), _message(3)])
+        assert not dedupe.is_duplicate(_message(1))
+        assert dedupe.is_duplicate(_message(3))
+
+    @pytest.mark.it("detects duplicates across restarts with the SQLite store")
+    def test_store(self, tmp_path):
+        path = str(tmp_path / "dedupe" / "seen.db")
+        store = SqliteDedupeStore(path)
+        Deduplicator(capacity=100, lru_size=1, store=store).filter([_message(1), _message(2)])
+        store.close()
+
+        store = SqliteDedupeStore(path)
+        dedupe = Deduplicator(capacity=100, lru_size=1, store=store)
+        passed = dedupe.filter([_message(1), _message(2), _message(3)])
+        store.close()
+
+        assert [msg.source_id for msg in passed] == ["msg-3"]
+
+
+@pytest.mark.describe("Deduplicating buses")
+class TestDeduplicatingBus:
+    @pytest.mark.it("delivers a message published twice only once")
+    def test_memory_bus(self):
+        received = []
+        bus = InMemoryEventBus(dedupe=Deduplicator(capacity=100))
+        bus.subscribe("dedupe.topic", received.append)
+        bus.start()
+        bus.publish("dedupe.topic", _message(1))
+        bus.publish_many("dedupe.topic", [_message(1), _message(2)])
+        _wait(lambda: len(received) >= 2, 2.0)
+        time.sleep(0.1)
+        bus.stop()
+
+        assert sorted(msg.source_id for msg in received) == ["msg-1", "msg-2"]
+
+    @pytest.mark.it("delivers a message published twice only once on the async bus")
+    def test_async_bus(self):
+        received = []
+        bus = AsyncEventBus(dedupe=Deduplicator(capacity=100))
+        bus.subscribe("dedupe.async", received.append)
+        bus.start()
+        bus.publish("dedupe.async", _message(1))
+        bus.publish("dedupe.async", _message(1))
+        bus.publish("dedupe.async", _message(2))
+        _wait(lambda: len(received) >= 2, 2.0)
+        time.sleep(0.1)
+        bus.stop()
+
+        assert sorted(msg.source_id for msg in received) == ["msg-1", "msg-2"]
@@ -0,0 +1,86 @@
+# Dispatcher unit tests
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.metrics import IDLE_WAKEUPS
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+def _wakeups(topic: str) -> float:
+    return IDLE_WAKEUPS.labels(topic=topic)._value.get()
+
+
+@pytest.mark.describe("Event-driven dispatch")
+class TestDispatcher:
+    @pytest.mark.it("starts no worker threads for topics without messages")
+    def test_no_idle_threads(self):
+        bus = InMemoryEventBus()
+        for i in range(50):
+            bus.subscribe(f"dispatch.idle.t{i}", lambda msg: None)
+        bus.start()
+        threads = sum(pool.threads for pool in bus.pools.values())
+        bus.stop()
+
+        assert threads == 0
+
+    @pytest.mark.it("lets idle workers exit after the keepalive, counting one idle wakeup each")
+    def test_keepalive(self):
+        received = []
+        bus = InMemoryEventBus(worker_keepalive=0.1)
+        bus.subscribe("dispatch.keepalive", lambda msg: received.append(msg.source_id))
+        bus.start()
+        before = _wakeups("dispatch.keepalive")
+        bus.publish("dispatch.keepalive", _message(1))
+
+        pool = bus.pools["dispatch.keepalive"]
+        _wait(lambda: received and pool.threads == 0, 2)
+        wakeups = _wakeups("dispatch.keepalive") - before
+        time.sleep(0.3)
+        later = _wakeups("dispatch.keepalive") - before
+
+        bus.publish("dispatch.keepalive", _message(2))
+        _wait(lambda: len(received) == 2, 2)
+        bus.stop()
+
+        assert wakeups == 1
+        assert later == 1
+        assert received == ["msg-1", "msg-2"]
+
+    @pytest.mark.it("consumes topics first subscribed after start()")
+    def test_subscribe_after_start(self):
+        received = []
+        bus = InMemoryEventBus()
+        bus.start()
+        bus.publish("dispatch.late", _message(1))
+        bus.subscribe("dispatch.late", lambda msg: received.append(msg.source_id))
+        bus.publish("dispatch.late", _message(2))
+
+        _wait(lambda: len(received) == 2, 2)
+        bus.stop()
+
+        assert received == ["msg-1", "msg-2"]
+
+    @pytest.mark.it("stops without waiting for blocked workers to time out")
+    def test_fast_stop(self):
+        bus = InMemoryEventBus(worker_keepalive=60)
+        bus.subscribe("dispatch.stop", lambda msg: None)
+        bus.start()
+        bus.publish("dispatch.stop", _message(1))
+        _wait(lambda: bus.pools["dispatch.stop"].threads == 1 and bus.pools["dispatch.stop"].busy == 0, 2)
+
+        started = time.perf_counter()
+        bus.stop()
+
+        assert time.perf_counter() - started < 0.5
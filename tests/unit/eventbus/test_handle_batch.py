@@ -0,0 +1,79 @@
+# Batched delivery unit tests
+import time
+
+import pytest
+
+from soma.core.contracts.event_bus import EventSubscriber
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+class BatchAgent(EventSubscriber):
+    def __init__(self):
+        self.batches = []
+
+    def handle(self, msg):
+        self.batches.append([msg.source_id])
+
+    def handle_batch(self, messages):
+        self.batches.append([msg.source_id for msg in messages])
+
+
+class SingleAgent(EventSubscriber):
+    def __init__(self):
+        self.received = []
+
+    def handle(self, msg):
+        self.received.append(msg.source_id)
+
+
+@pytest.mark.describe("Batched delivery")
+class TestHandleBatch:
+    @pytest.mark.it("delivers up to batch_size messages to handle_batch()")
+    def test_batches(self):
+        agent = BatchAgent()
+        bus = InMemoryEventBus(batch_size=4, batch_linger_ms=200)
+        bus.subscribe("email", agent)
+        bus.publish_many("email", [_message(i) for i in range(10)])
+        bus.start()
+
+        _wait(lambda: sum(len(b) for b in agent.batches) == 10, 3)
+        bus.stop()
+
+        assert agent.batches == [
+            ["msg-0", "msg-1", "msg-2", "msg-3"],
+            ["msg-4", "msg-5", "msg-6", "msg-7"],
+            ["msg-8", "msg-9"],
+        ]
+
+    @pytest.mark.it("falls back to handle() for subscribers without handle_batch()")
+    def test_fallback(self):
+        agent = SingleAgent()
+        received = []
+        bus = InMemoryEventBus(batch_size=4, batch_linger_ms=50)
+        bus.subscribe("email", agent)
+        bus.subscribe("email", lambda msg: received.append(msg.source_id))
+        bus.publish_many("email", [_message(i) for i in range(6)])
+        bus.start()
+
+        _wait(lambda: len(agent.received) == 6 and len(received) == 6, 3)
+        bus.stop()
+
+        assert agent.received == [f"msg-{i}" for i in range(6)]
+        assert received == [f"msg-{i}" for i in range(6)]
+
+    @pytest.mark.it("detects subscribers overriding handle_batch()")
+    def test_handles_batches(self):
+        assert EventSubscriber.handles_batches(BatchAgent())
+        assert not EventSubscriber.handles_batches(SingleAgent())
+        assert not EventSubscriber.handles_batches(lambda msg: None)
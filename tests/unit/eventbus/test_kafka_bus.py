@@ -0,0 +1,556 @@
+# KafkaEventBus unit tests, using an in-process stand-in for the Kafka client
+import re
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+from kafka import TopicPartition
+from kafka.errors import KafkaTimeoutError
+from kafka.future import Future
+
+from soma.core.contracts.event_bus import EventSubscriber
+from soma.core.contracts.message import Message
+from soma.eventbus import kafka_bus
+from soma.eventbus.claim_check import ClaimCheck, CLAIM_CHECK
+from soma.eventbus.compression import Compression, COMPRESSION
+from soma.eventbus.kafka_bus import KafkaEventBus
+from soma.eventbus.metrics import PRODUCED_MESSAGES, PRODUCE_ERRORS, UNCOMMITTED_MESSAGES, CONSUMER_LAG, \
+    REBALANCES, KAFKA_RECORDS_IN_RATE, KAFKA_PRODUCER_QUEUE, KAFKA_SEND_LATENCY
+from soma.eventbus.retry import RetryPolicy
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+_Record = namedtuple("_Record", "topic partition offset key value")
+
+
+class _Broker:
+    """
+    Topics with their partitions, shared by the consumers of a test.
+    """
+
+    def __init__(self, partitions: int = 1):
+        self.partitions = partitions
+        self.logs = {}
+        self.committed = {}
+        self.consumers = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic: str, message: Message, partition: int = 0):
+        with self.lock:
+            log = self.logs.setdefault(TopicPartition(topic, partition), [])
+            log.append(_Record(topic, partition, len(log), None, message.model_dump_json().encode("utf-8")))
+
+
+class _Consumer:
+    """
+    Consumer reading the partitions of all matching topics of the broker, like the only member of a group.
+    """
+
+    broker: _Broker = None
+
+    def __init__(self, *topics, **config):
+        self.config = config
+        self.topics = list(topics)
+        self.pattern = None
+        self.positions = {}
+        self.paused = set()
+        self.pauses = 0
+        self.closed = False
+        self.broker.consumers.append(self)
+
+    def subscribe(self, topics=(), pattern=None, listener=None):
+        self.topics = list(topics)
+        self.pattern = re.compile(pattern) if pattern else None
+        if listener:
+            listener.on_partitions_assigned(self.assignment())
+
+    def assignment(self):
+        with self.broker.lock:
+            return {tp for tp in self.broker.logs if self._matches(tp.topic)}
+
+    def highwater(self, tp):
+        with self.broker.lock:
+            return len(self.broker.logs.get(tp, []))
+
+    def position(self, tp):
+        return self.positions.get(tp, 0)
+
+    def metrics(self):
+        return {"consumer-fetch-manager-metrics": {"records-consumed-rate": 12.5, "bytes-consumed-rate": 1024.0}}
+
+    def commit(self, offsets):
+        with self.broker.lock:
+            self.broker.committed.update({tp: offset.offset for tp, offset in offsets.items()})
+
+    def commit_async(self, offsets, callback=None):
+        self.commit(offsets)
+        if callback:
+            callback(offsets, None)
+
+    def unsubscribe(self):
+        self.topics = []
+        self.pattern = None
+
+    def pause(self, *partitions):
+        self.paused.update(partitions)
+        self.pauses += 1
+
+    def resume(self, *partitions):
+        self.paused.difference_update(partitions)
+
+    def _matches(self, topic: str) -> bool:
+        return topic in self.topics or bool(self.pattern and self.pattern.match(topic))
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records = {}
+        count = 0
+        with self.broker.lock:
+            for tp, log in self.broker.logs.items():
+                if not self._matches(tp.topic) or tp in self.paused:
+                    continue
+                position = self.positions.get(tp, 0)
+                batch = log[position:position + (max_records - count)]
+                if batch:
+                    records[tp] = batch
+                    self.positions[tp] = position + len(batch)
+                    count += len(batch)
+                if count >= max_records:
+                    break
+        if not records:
+            time.sleep(timeout_ms / 1000)
+        return records
+
+    def close(self):
+        self.closed = True
+
+
+class _RecordFuture(Future):
+    def __init__(self, producer):
+        super().__init__()
+        self.producer = producer
+
+    def get(self, timeout=None):
+        if not self.is_done:
+            self.producer.flush()
+        if self.exception:
+            raise self.exception
+        return self.value
+
+
+class _Producer:
+    """
+    Buffers records until flush(), like KafkaProducer with a long linger. Records for `failing` topics fail.
+    """
+
+    def __init__(self, **config):
+        self.config = config
+        self.pending = []
+        self.sent = []
+        self.flushes = 0
+        self.failing = set()
+
+    def metrics(self):
+        return {"producer-metrics": {"record-send-rate": 3.0, "outgoing-byte-rate": 300.0,
+                                     "record-queue-time-avg": 4.0, "request-latency-avg": 6.0}}
+
+    def send(self, topic, value=None, key=None):
+        future = _RecordFuture(self)
+        self.pending.append((topic, value, key, future))
+        return future
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+        pending, self.pending = self.pending, []
+        for topic, value, key, future in pending:
+            if topic in self.failing:
+                future.failure(KafkaTimeoutError(f"no leader for {topic}"))
+            else:
+                self.sent.append((topic, value, key))
+                future.success(None)
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(kafka_bus, "KafkaProducer", _Producer)
+    return KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test")
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = _Broker()
+    monkeypatch.setattr(_Consumer, "broker", broker)
+    monkeypatch.setattr(kafka_bus, "KafkaProducer", _Producer)
+    monkeypatch.setattr(kafka_bus, "KafkaConsumer", _Consumer)
+    return broker
+
+
+@pytest.mark.describe("KafkaEventBus producer")
+class TestKafkaProducer:
+    @pytest.mark.it("configures batching and compression of the producer")
+    def test_config(self, monkeypatch):
+        monkeypatch.setattr(kafka_bus, "KafkaProducer", _Producer)
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", linger_ms=20,
+                            producer_batch_size=65536, compression_type="gzip", producer_config={"acks": "all"})
+
+        assert bus.producer.config["linger_ms"] == 20
+        assert bus.producer.config["batch_size"] == 65536
+        assert bus.producer.config["compression_type"] == "gzip"
+        assert bus.producer.config["acks"] == "all"
+
+    @pytest.mark.it("does not flush after each message in async mode")
+    def test_async(self, bus):
+        for i in range(10):
+            bus.publish("kafka.async", _message(i))
+
+        assert bus.producer.flushes == 0
+        assert len(bus.producer.pending) == 10
+
+    @pytest.mark.it("sends buffered messages when stopped")
+    def test_flush_on_stop(self, bus):
+        before = PRODUCED_MESSAGES.labels(topic="kafka.stop")._value.get()
+        bus.publish("kafka.stop", _message(1))
+        bus.publish_many("kafka.stop", [_message(2), _message(3)])
+        bus.stop()
+
+        assert [value.source_id for _, value, _ in bus.producer.sent] == ["msg-1", "msg-2", "msg-3"]
+        assert PRODUCED_MESSAGES.labels(topic="kafka.stop")._value.get() - before == 3
+
+    @pytest.mark.it("counts messages the producer failed to send")
+    def test_errors(self, bus):
+        before = PRODUCE_ERRORS.labels(topic="kafka.failing")._value.get()
+        bus.producer.failing.add("kafka.failing")
+        bus.publish("kafka.failing", _message(1))
+        bus.flush()
+
+        assert PRODUCE_ERRORS.labels(topic="kafka.failing")._value.get() - before == 1
+
+    @pytest.mark.it("waits for each message and raises send errors in sync mode")
+    def test_sync(self, monkeypatch):
+        monkeypatch.setattr(kafka_bus, "KafkaProducer", _Producer)
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", producer_mode="sync")
+        bus.publish("kafka.sync", _message(1))
+        assert len(bus.producer.sent) == 1
+
+        bus.producer.failing.add("kafka.sync")
+        with pytest.raises(KafkaTimeoutError):
+            bus.publish("kafka.sync", _message(2))
+
+    @pytest.mark.it("sends large content by reference and reads it when a subscriber accesses it")
+    def test_claim_check(self, broker, tmp_path):
+        received = []
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test",
+                            claim_check=ClaimCheck(str(tmp_path / "blobs"), threshold=100))
+        bus.subscribe("kafka.claim", lambda msg: received.append(msg.content))
+        bus.publish("kafka.claim", Message(source_type="email", source_id="large", content="x" * 10000))
+        bus.flush()
+        (_, value, _), = bus.producer.sent
+
+        bus.start()
+        broker.produce("kafka.claim", value)
+        _wait(lambda: received, 2.0)
+        bus.stop()
+
+        assert value.content == ""
+        assert CLAIM_CHECK in value.metadata
+        assert len(bus.codec.encode(value)) < 300
+        assert received == ["x" * 10000]
+
+    @pytest.mark.it("sends large content compressed and decompresses it when a subscriber accesses it")
+    def test_compression(self, broker):
+        received = []
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test",
+                            compression=Compression(codec="zlib", threshold=100))
+        bus.subscribe("kafka.compressed", lambda msg: received.append(msg.content))
+        bus.publish("kafka.compressed", Message(source_type="email", source_id="large", content="x" * 10000))
+        bus.flush()
+        (_, value, _), = bus.producer.sent
+
+        bus.start()
+        broker.produce("kafka.compressed", value)
+        _wait(lambda: received, 2.0)
+        bus.stop()
+
+        assert COMPRESSION in value.metadata
+        assert len(bus.codec.encode(value)) < 500
+        assert received == ["x" * 10000]
+
+
+@pytest.mark.describe("KafkaEventBus consumer")
+class TestKafkaConsumer:
+    @pytest.mark.it("consumes all subscribed topics and patterns with a single consumer")
+    def test_single_consumer(self, broker):
+        received = []
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10)
+        for i in range(20):
+            bus.subscribe(f"github.repo{i}", lambda msg: received.append(msg.source_id))
+        bus.subscribe("mastodon.*", lambda msg: received.append(msg.source_id))
+        bus.start()
+        broker.produce("github.repo3", _message(1))
+        broker.produce("mastodon.mentions", _message(2))
+        broker.produce("other", _message(3))
+        _wait(lambda: len(received) == 2, 2.0)
+        bus.stop()
+
+        assert len(broker.consumers) == 1
+        assert sorted(received) == ["msg-1", "msg-2"]
+        assert broker.consumers[0].closed
+
+    @pytest.mark.it("picks up subscriptions added after start")
+    def test_late_subscription(self, broker):
+        received = []
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10)
+        bus.start()
+        broker.produce("late", _message(1))
+        bus.subscribe("late", lambda msg: received.append(msg))
+        _wait(lambda: received, 2.0)
+        bus.stop()
+
+        assert len(received) == 1
+
+    @pytest.mark.it("delivers the records of a poll in batches of batch_size")
+    def test_batches(self, broker):
+        batches = []
+
+        class BatchAgent(EventSubscriber):
+            name = "batch_agent"
+
+            def handle(self, msg):
+                batches.append([msg])
+
+            def handle_batch(self, messages):
+                batches.append(list(messages))
+
+        for i in range(5):
+            broker.produce("batched", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10, batch_size=2)
+        bus.subscribe("batched", BatchAgent())
+        bus.start()
+        _wait(lambda: sum(len(batch) for batch in batches) == 5, 2.0)
+        bus.stop()
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+@pytest.mark.describe("KafkaEventBus offset commits")
+class TestKafkaCommits:
+    @pytest.mark.it("disables auto commit in manual mode")
+    def test_config(self, broker):
+        assert KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test").consumer_config["enable_auto_commit"]
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", commit_mode="manual")
+        assert not bus.consumer_config["enable_auto_commit"]
+
+    @pytest.mark.it("commits offsets only after the records were handled")
+    def test_commit_after_handling(self, broker):
+        release = threading.Event()
+        received = []
+
+        def handler(msg):
+            release.wait(2.0)
+            received.append(msg)
+
+        for i in range(5):
+            broker.produce("commits", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            commit_mode="manual", commit_every=3)
+        bus.subscribe("commits", handler)
+        bus.start()
+        time.sleep(0.1)
+        committed_while_handling = dict(broker.committed)
+        uncommitted = UNCOMMITTED_MESSAGES.labels(topic="commits", partition=0)._value.get()
+        release.set()
+        _wait(lambda: broker.committed, 2.0)
+        bus.stop()
+
+        assert committed_while_handling == {}
+        assert uncommitted == 5
+        assert broker.committed == {TopicPartition("commits", 0): 5}
+        assert UNCOMMITTED_MESSAGES.labels(topic="commits", partition=0)._value.get() == 0
+
+    @pytest.mark.it("commits failed records only after their retry is done")
+    @pytest.mark.parametrize("workers", [0, 1])
+    @pytest.mark.parametrize("recovers", [True, False])
+    def test_commit_after_retry(self, broker, workers, recovers):
+        attempts = []
+
+        def handler(msg):
+            attempts.append(msg.source_id)
+            if msg.source_id == "msg-0" and (not recovers or attempts.count("msg-0") == 1):
+                raise RuntimeError("failed")
+
+        for i in range(2):
+            broker.produce("commits.retry", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            commit_mode="manual", commit_every=1, partition_workers=workers,
+                            retry=RetryPolicy(max_attempts=2, initial_backoff=0.3, jitter=0))
+        bus.subscribe("commits.retry", handler)
+        bus.start()
+        _wait(lambda: "msg-1" in attempts, 2.0)
+        time.sleep(0.1)
+        committed_while_waiting = dict(broker.committed)
+        _wait(lambda: broker.committed, 2.0)
+        bus.stop()
+
+        assert committed_while_waiting == {}
+        assert attempts.count("msg-0") == 2
+        assert broker.committed == {TopicPartition("commits.retry", 0): 2}
+
+    @pytest.mark.it("commits handled offsets when stopped")
+    def test_commit_on_stop(self, broker):
+        received = []
+        broker.produce("commits.stop", _message(1))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            commit_mode="manual", commit_every=100, commit_interval_ms=60000)
+        bus.subscribe("commits.stop", received.append)
+        bus.start()
+        _wait(lambda: received, 2.0)
+        time.sleep(0.05)
+        committed_before_stop = dict(broker.committed)
+        bus.stop()
+
+        assert committed_before_stop == {}
+        assert broker.committed == {TopicPartition("commits.stop", 0): 1}
+
+
+@pytest.mark.describe("KafkaEventBus partition workers")
+class TestKafkaPartitionWorkers:
+    @pytest.mark.it("handles partitions in parallel, keeping the order within each partition")
+    def test_parallel(self, broker):
+        barrier = threading.Barrier(3, timeout=2.0)
+        received = {}
+        lock = threading.Lock()
+
+        def handler(msg):
+            partition = msg.metadata["partition"]
+            if msg.metadata["index"] == 0:
+                # Passes only if the first records of all partitions are handled at the same time
+                barrier.wait()
+            with lock:
+                received.setdefault(partition, []).append(msg.metadata["index"])
+
+        for i in range(10):
+            for partition in range(3):
+                message = _message(i)
+                message.metadata = {"partition": partition, "index": i}
+                broker.produce("parallel", message, partition=partition)
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            max_poll_records=4, partition_workers=3)
+        bus.subscribe("parallel", handler)
+        bus.start()
+        _wait(lambda: sum(len(indexes) for indexes in received.values()) == 30, 3.0)
+        bus.stop()
+
+        assert not barrier.broken
+        assert received == {partition: list(range(10)) for partition in range(3)}
+
+    @pytest.mark.it("pauses a partition while its worker is behind, and resumes it afterwards")
+    def test_pause(self, broker):
+        release = threading.Event()
+        received = []
+
+        def handler(msg):
+            release.wait(2.0)
+            received.append(msg.source_id)
+
+        for i in range(40):
+            broker.produce("paused", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            max_poll_records=4, partition_workers=2, max_pending_records=8,
+                            commit_mode="manual", commit_every=1)
+        bus.subscribe("paused", handler)
+        bus.start()
+        time.sleep(0.2)
+        consumer = broker.consumers[0]
+        fetched_while_blocked = consumer.positions[TopicPartition("paused", 0)]
+        paused_while_blocked = set(consumer.paused)
+        release.set()
+        _wait(lambda: len(received) == 40, 3.0)
+        _wait(lambda: broker.committed.get(TopicPartition("paused", 0)) == 40, 2.0)
+        bus.stop()
+
+        assert paused_while_blocked == {TopicPartition("paused", 0)}
+        assert fetched_while_blocked <= 12
+        assert received == [f"msg-{i}" for i in range(40)]
+        assert consumer.paused == set()
+        assert broker.committed == {TopicPartition("paused", 0): 40}
+
+    @pytest.mark.it("keeps handling and committing a partition after a delivery error")
+    def test_delivery_error(self, broker):
+        received = []
+
+        def handler(msg):
+            if msg.source_id == "msg-1":
+                raise RuntimeError("handler failure")
+            received.append(msg.source_id)
+
+        for i in range(12):
+            broker.produce("failing", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            max_poll_records=4, partition_workers=1, max_pending_records=4,
+                            commit_mode="manual", commit_every=1)
+        deliver = bus.deliver
+
+        def failing_deliver(topic, messages, on_done=None):
+            if any(message.source_id == "msg-4" for message in messages):
+                raise RuntimeError("delivery failure")
+            deliver(topic, messages, on_done)
+
+        bus.deliver = failing_deliver
+        bus.subscribe("failing", handler)
+        bus.start()
+        _wait(lambda: broker.committed.get(TopicPartition("failing", 0)) == 12, 3.0)
+        bus.stop()
+
+        assert broker.committed == {TopicPartition("failing", 0): 12}
+        # The records of the failed job after msg-4 are skipped, the worker handles the following jobs
+        assert received == ["msg-0", "msg-2", "msg-3"] + [f"msg-{i}" for i in range(8, 12)]
+        assert broker.consumers[0].paused == set()
+
+
+@pytest.mark.describe("KafkaEventBus metrics")
+class TestKafkaMetrics:
+    @pytest.mark.it("exports the lag of each assigned partition")
+    def test_lag(self, broker):
+        release = threading.Event()
+        for i in range(10):
+            broker.produce("lagging", _message(i))
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", batch_linger_ms=10,
+                            max_poll_records=4, partition_workers=1, max_pending_records=3, metrics_interval=0.02)
+        bus.subscribe("lagging", lambda msg: release.wait(2.0))
+        rebalances = REBALANCES._value.get()
+        bus.start()
+        time.sleep(0.1)
+        lag_while_blocked = CONSUMER_LAG.labels(topic="lagging", partition="0")._value.get()
+        release.set()
+        _wait(lambda: CONSUMER_LAG.labels(topic="lagging", partition="0")._value.get() == 0, 2.0)
+        bus.stop()
+
+        assert lag_while_blocked == 6
+        assert CONSUMER_LAG.labels(topic="lagging", partition="0")._value.get() == 0
+        assert REBALANCES._value.get() - rebalances == 1
+        assert KAFKA_RECORDS_IN_RATE.labels(consumer="0")._value.get() == 12.5
+
+    @pytest.mark.it("exports the queue depth and send latency of the producer")
+    def test_producer(self, broker):
+        bus = KafkaEventBus(bootstrap_servers="localhost:9092", group_id="test", metrics_interval=0.02)
+        bus.start()
+        for i in range(3):
+            bus.publish("queued", _message(i))
+        _wait(lambda: KAFKA_PRODUCER_QUEUE._value.get() == 3, 2.0)
+        queued = KAFKA_PRODUCER_QUEUE._value.get()
+        bus.flush()
+        _wait(lambda: KAFKA_PRODUCER_QUEUE._value.get() == 0, 2.0)
+        bus.stop()
+
+        assert queued == 3
+        assert KAFKA_PRODUCER_QUEUE._value.get() == 0
+        assert KAFKA_SEND_LATENCY._value.get() == pytest.approx(0.01)
@@ -0,0 +1,131 @@
+# Key lane unit tests
+import threading
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.topic_queue import KeyedTopicQueue
+from soma.eventbus.worker_pool import KeyedWorkerPool
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Keyed Topic Queue")
+class TestKeyedTopicQueue:
+    @pytest.mark.it("puts messages with the same key into the same lane")
+    def test_same_lane(self):
+        q = KeyedTopicQueue("github", 4)
+        for i in range(8):
+            q.put(_message(i), key="nibra/soma")
+
+        lane = q.lanes[q.lane("nibra/soma")]
+        assert lane.qsize() == 8
+        assert [lane.get().source_id for _ in range(8)] == [f"msg-{i}" for i in range(8)]
+
+    @pytest.mark.it("distributes messages without key round-robin")
+    def test_round_robin(self):
+        q = KeyedTopicQueue("github", 4)
+        q.put_many([_message(i) for i in range(8)])
+
+        assert [lane.qsize() for lane in q.lanes] == [2, 2, 2, 2]
+        assert q.qsize() == 8
+
+    @pytest.mark.it("can be drained like a single queue")
+    def test_drain(self):
+        q = KeyedTopicQueue("github", 3)
+        q.put_many([_message(i) for i in range(5)], keys=[f"repo-{i}" for i in range(5)])
+
+        drained = []
+        while not q.empty():
+            drained.append(q.get().source_id)
+
+        assert sorted(drained) == [f"msg-{i}" for i in range(5)]
+
+
+@pytest.mark.describe("InMemoryEventBus with key lanes")
+class TestKeyLanes:
+    @pytest.mark.it("handles messages with the same key in publish order")
+    def test_order_per_key(self):
+        received = {}
+        lock = threading.Lock()
+
+        def handler(msg):
+            time.sleep(0.001)
+            with lock:
+                received.setdefault(msg.metadata["repo"], []).append(msg.source_id)
+
+        bus = InMemoryEventBus(key_lanes=4)
+        bus.subscribe("github", handler)
+        bus.start()
+        for i in range(40):
+            repo = f"repo-{i % 5}"
+            message = _message(i)
+            message.metadata = {"repo": repo}
+            bus.publish("github", message, key=repo)
+
+        _wait(lambda: sum(len(ids) for ids in received.values()) == 40, 3)
+        bus.stop()
+
+        for r in range(5):
+            assert received[f"repo-{r}"] == [f"msg-{i}" for i in range(r, 40, 5)]
+
+    @pytest.mark.it("handles messages with different keys in parallel")
+    def test_parallel_keys(self):
+        bus = InMemoryEventBus(key_lanes=8)
+        q = bus._queue("github")
+        keys = ["repo-0"]
+        keys.append(next(f"repo-{i}" for i in range(1, 100) if q.lane(f"repo-{i}") != q.lane("repo-0")))
+
+        barrier = threading.Barrier(2, timeout=2)
+        passed = []
+
+        def handler(msg):
+            barrier.wait()
+            passed.append(msg.source_id)
+
+        bus.subscribe("github", handler)
+        bus.start()
+        for i, key in enumerate(keys):
+            bus.publish("github", _message(i), key=key)
+
+        _wait(lambda: len(passed) == 2, 3)
+        bus.stop()
+
+        assert sorted(passed) == ["msg-0", "msg-1"]
+
+    @pytest.mark.it("keeps the key order of batches published with publish_many()")
+    def test_publish_many(self):
+        received = []
+        bus = InMemoryEventBus(key_lanes=4)
+        bus.subscribe("github", lambda msg: received.append(msg.source_id))
+        bus.start()
+        bus.publish_many("github", [_message(i) for i in range(10)], keys=["nibra/soma"] * 10)
+
+        _wait(lambda: len(received) == 10, 3)
+        bus.stop()
+
+        assert received == [f"msg-{i}" for i in range(10)]
+
+    @pytest.mark.it("uses one worker per lane, which the adaptive scaler does not resize")
+    def test_fixed_pool(self):
+        bus = InMemoryEventBus(key_lanes=3, adaptive=True, max_workers=8)
+        bus.subscribe("github", lambda msg: None, workers=6)
+        bus.start()
+        pool = bus.pools["github"]
+        bus.stop()
+
+        assert isinstance(pool, KeyedWorkerPool)
+        assert pool.size == 3
+        assert pool not in bus.scaler.pools()
+        with pytest.raises(ValueError):
+            pool.resize(4)
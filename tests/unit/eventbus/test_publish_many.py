@@ -0,0 +1,66 @@
+# Batch publish unit tests
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.core.contracts.policy import AccessPolicy
+from soma.core.policy_manager import PolicyManager
+from soma.eventbus.memory_bus import InMemoryEventBus
+
+
+def _message(i: int, agent_name: str = "agent1") -> Message:
+    return Message(agent_name=agent_name, source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _drain(bus: InMemoryEventBus, topic: str) -> list[str]:
+    items = []
+    while not bus.queues[topic].empty():
+        items.append(bus.queues[topic].get().source_id)
+    return items
+
+
+class CountingPolicyManager(PolicyManager):
+    def __init__(self, policies):
+        super().__init__(policies)
+        self.checks = 0
+
+    def is_allowed(self, agent: str, topic: str, direction: str) -> bool:
+        self.checks += 1
+        return super().is_allowed(agent, topic, direction)
+
+
+@pytest.mark.describe("Batch publish")
+class TestPublishMany:
+    @pytest.mark.it("enqueues all messages of a batch in order")
+    def test_publish_many(self):
+        bus = InMemoryEventBus()
+        bus.publish_many("email", [_message(i) for i in range(5)], keys=["raw"] * 5)
+
+        assert _drain(bus, "email") == [f"msg-{i}" for i in range(5)]
+
+    @pytest.mark.it("checks the publish policy once per agent instead of once per message")
+    def test_policy_checked_once(self):
+        policy_manager = CountingPolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"]),
+        ])
+        bus = InMemoryEventBus(policy_manager=policy_manager)
+        bus.publish_many("email", [_message(i) for i in range(3)] + [_message(3, "intruder")])
+
+        assert policy_manager.checks == 2
+        assert _drain(bus, "email") == ["msg-0", "msg-1", "msg-2"]
+
+    @pytest.mark.it("admits only as many messages as the rate limit allows")
+    def test_rate_limit(self):
+        policy_manager = PolicyManager([
+            AccessPolicy(agent_name="agent1", allowed_publish_topics=["email"], rate_limit_per_topic={"email": 3}),
+        ])
+        bus = InMemoryEventBus(policy_manager=policy_manager)
+        bus.publish_many("email", [_message(i) for i in range(5)])
+
+        assert _drain(bus, "email") == ["msg-0", "msg-1", "msg-2"]
+
+    @pytest.mark.it("rejects batches with a mismatching number of keys")
+    def test_key_mismatch(self):
+        bus = InMemoryEventBus()
+
+        with pytest.raises(ValueError):
+            bus.publish_many("email", [_message(0), _message(1)], keys=["raw"])
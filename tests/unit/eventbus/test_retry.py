@@ -0,0 +1,194 @@
+# Retry, delayed delivery and dead-letter unit tests
+import random
+import threading
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.async_bus import AsyncEventBus
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.timing_wheel import TimingWheel, Scheduler
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+def _fast_policy(**kwargs) -> RetryPolicy:
+    return RetryPolicy(initial_backoff=0.02, jitter=0, **kwargs)
+
+
+class _Flaky:
+    """
+    Handler failing the first `failures` calls.
+    """
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+        self.handled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, msg: Message):
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise RuntimeError(f"failure {self.calls}")
+        self.handled.append(msg)
+
+
+@pytest.mark.describe("Timing wheel")
+class TestTimingWheel:
+    @pytest.mark.it("returns entries in order of their expiry, across all levels")
+    def test_order(self):
+        wheel = TimingWheel(tick=1.0, slots=4, levels=3, start=0.0)
+        delays = list(range(1, 200))
+        random.Random(1).shuffle(delays)
+        for delay in delays:
+            wheel.schedule(delay, delay)
+
+        due = []
+        for now in range(1, 201):
+            expired = wheel.advance(now)
+            assert all(item <= now for item in expired)
+            due.extend(expired)
+
+        assert due == sorted(delays)
+        assert len(wheel) == 0
+
+    @pytest.mark.it("reports no deadline while empty")
+    def test_next_deadline(self):
+        wheel = TimingWheel(tick=1.0, slots=8, levels=2, start=0.0)
+        assert wheel.next_deadline() is None
+        wheel.schedule(3, "x")
+        assert wheel.next_deadline() == 3.0
+
+    @pytest.mark.it("runs callbacks of the scheduler after their delay")
+    def test_scheduler(self):
+        scheduler = Scheduler(tick=0.005)
+        fired = []
+        started = time.monotonic()
+        scheduler.call_later(0.1, lambda: fired.append(("late", time.monotonic() - started)))
+        scheduler.call_later(0.02, lambda: fired.append(("early", time.monotonic() - started)))
+        _wait(lambda: len(fired) == 2, 2.0)
+        scheduler.stop()
+
+        assert [name for name, _ in fired] == ["early", "late"]
+        assert fired[1][1] >= 0.1
+
+
+@pytest.mark.describe("Retry policy")
+class TestRetryPolicy:
+    @pytest.mark.it("grows the backoff exponentially up to the maximum")
+    def test_backoff(self):
+        policy = RetryPolicy(initial_backoff=1.0, max_backoff=5.0, multiplier=2.0, jitter=0)
+        assert [policy.backoff(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+    @pytest.mark.it("shortens the backoff by at most the jitter")
+    def test_jitter(self):
+        policy = RetryPolicy(initial_backoff=1.0, jitter=0.5)
+        assert all(0.5 <= policy.backoff(1) <= 1.0 for _ in range(100))
+
+
+@pytest.mark.describe("Retries and dead letters")
+class TestRetries:
+    @pytest.mark.it("delivers a message again until the handler succeeds")
+    def test_retry_succeeds(self):
+        handler = _Flaky(failures=2)
+        bus = InMemoryEventBus(retry=_fast_policy(max_attempts=3))
+        bus.subscribe("retry.ok", handler)
+        bus.start()
+        bus.publish("retry.ok", _message(1))
+        _wait(lambda: handler.handled, 2.0)
+        bus.stop()
+
+        assert handler.calls == 3
+        assert [msg.source_id for msg in handler.handled] == ["msg-1"]
+
+    @pytest.mark.it("shuts down the retry executor when the bus is stopped")
+    def test_stop_executor(self):
+        for bus in [InMemoryEventBus(), AsyncEventBus()]:
+            received = []
+            bus.subscribe("retry.stop", lambda msg: received.append(msg))
+            bus.start()
+            bus.publish("retry.stop", _message(1), delay=0.01)
+            _wait(lambda: received, 2.0)
+            executor = bus._executor
+            bus.stop()
+
+            assert executor is not None and executor._shutdown
+            assert bus._executor is None
+
+    @pytest.mark.it("publishes the message to the dead-letter topic after the last attempt")
+    def test_dead_letter(self):
+        handler = _Flaky(failures=10)
+        other = []
+        dead = []
+        bus = InMemoryEventBus()
+        bus.subscribe("retry.dead", handler, retry=_fast_policy(max_attempts=2))
+        bus.subscribe("retry.dead", other.append)
+        bus.subscribe("dead_letter.retry.dead", dead.append)
+        bus.start()
+        bus.publish("retry.dead", _message(1))
+        _wait(lambda: dead, 2.0)
+        bus.stop()
+
+        assert handler.calls == 2
+        assert len(other) == 1
+        assert len(dead) == 1
+        assert dead[0].metadata["dead_letter"]["topic"] == "retry.dead"
+        assert dead[0].metadata["dead_letter"]["attempts"] == 2
+        assert dead[0].metadata["dead_letter"]["error"] == "failure 2"
+
+    @pytest.mark.it("drops failed messages without a retry policy")
+    def test_no_policy(self):
+        handler = _Flaky(failures=1)
+        bus = InMemoryEventBus()
+        bus.subscribe("retry.none", handler)
+        bus.start()
+        bus.publish("retry.none", _message(1))
+        _wait(lambda: handler.calls, 2.0)
+        time.sleep(0.1)
+        bus.stop()
+
+        assert handler.calls == 1
+        assert handler.handled == []
+
+    @pytest.mark.it("retries async subscribers on the event loop")
+    def test_async_retry(self):
+        handler = _Flaky(failures=1)
+        bus = AsyncEventBus(retry=_fast_policy(max_attempts=2))
+        bus.subscribe("retry.async", handler)
+        bus.start()
+        bus.publish("retry.async", _message(1))
+        _wait(lambda: handler.handled, 2.0)
+        bus.stop()
+
+        assert handler.calls == 2
+
+
+@pytest.mark.describe("Delayed delivery")
+class TestDelayedDelivery:
+    @pytest.mark.it("enqueues a delayed message after the delay")
+    def test_delay(self):
+        received = []
+        bus = InMemoryEventBus()
+        bus.subscribe("delay.topic", lambda msg: received.append(time.monotonic()))
+        bus.start()
+        published = time.monotonic()
+        bus.publish("delay.topic", _message(1), delay=0.1)
+        time.sleep(0.05)
+        early = len(received)
+        _wait(lambda: received, 2.0)
+        bus.stop()
+
+        assert early == 0
+        assert received[0] - published >= 0.1
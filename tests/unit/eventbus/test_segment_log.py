@@ -0,0 +1,221 @@
+# Segment log unit tests
+import os
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.retry import RetryPolicy
+from soma.eventbus.segment_log import SegmentLog
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Segment Log")
+class TestSegmentLog:
+    @pytest.mark.it("reads messages from any offset across segments")
+    def test_read_from_offset(self, tmp_path):
+        log = SegmentLog(str(tmp_path), segment_bytes=1024)
+        offsets = log.append("github", [_message(i) for i in range(40)], keys=[f"repo-{i % 2}" for i in range(40)])
+
+        assert list(offsets) == list(range(40))
+        assert len(os.listdir(tmp_path / "github")) > 4
+        records = log.read("github", 17, max_messages=5)
+        assert [(offset, key, message.source_id) for offset, key, message in records] == [
+            (i, f"repo-{i % 2}", f"msg-{i}") for i in range(17, 22)
+        ]
+        assert log.read("github", 40) == []
+        log.close()
+
+    @pytest.mark.it("recovers messages that were not indexed yet when the process died")
+    def test_recover_unindexed(self, tmp_path):
+        log = SegmentLog(str(tmp_path), fsync_messages=0, fsync_interval=None)
+        log.append("github", [_message(i) for i in range(10)])
+
+        # Not closed: the index is still buffered, the records are in the memory mapping
+        reopened = SegmentLog(str(tmp_path))
+
+        assert reopened.end_offset("github") == 10
+        assert reopened.read("github", 9)[0][2].source_id == "msg-9"
+
+    @pytest.mark.it("discards a torn record at the end of a segment")
+    def test_torn_record(self, tmp_path):
+        log = SegmentLog(str(tmp_path))
+        log.append("github", [_message(i) for i in range(3)])
+        log.close()
+
+        segment = tmp_path / "github" / f"{0:020d}.log"
+        with open(segment, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write(b"\x40\x00\x00\x00\x01\x02\x03\x04partial")
+
+        reopened = SegmentLog(str(tmp_path))
+        assert reopened.end_offset("github") == 3
+        reopened.append("github", [_message(3)])
+        reopened.close()
+
+        assert [message.source_id for _, _, message in SegmentLog(str(tmp_path)).read("github", 0)] == [
+            f"msg-{i}" for i in range(4)
+        ]
+
+    @pytest.mark.it("advances the committed offset over messages acknowledged out of order")
+    def test_ack_out_of_order(self, tmp_path):
+        log = SegmentLog(str(tmp_path))
+        log.append("github", [_message(i) for i in range(4)])
+        for offset in (1, 2, 0):
+            log.ack("github", offset)
+
+        assert log.committed("github") == 3
+
+    @pytest.mark.it("removes segments beyond the retention once their messages are committed")
+    def test_retention(self, tmp_path):
+        log = SegmentLog(str(tmp_path), segment_bytes=1024, retain_segments=2)
+        log.append("github", [_message(i) for i in range(40)])
+        for offset in range(40):
+            log.ack("github", offset)
+        log.sync()
+
+        assert len([name for name in os.listdir(tmp_path / "github") if name.endswith(".log")]) == 2
+        with pytest.raises(ValueError):
+            log.read("github", 0)
+
+
+    @pytest.mark.it("does not create files when reading an unknown topic")
+    def test_unknown_topic(self, tmp_path):
+        log = SegmentLog(str(tmp_path))
+
+        assert log.read("unknown", 0) == []
+        assert log.committed("unknown") == 0
+        assert log.end_offset("unknown") == 0
+        log.ack("unknown", 0)
+        assert os.listdir(tmp_path) == []
+
+    @pytest.mark.it("flushes writes to disk once the interval passed, while the log is idle")
+    def test_idle_sync(self, tmp_path):
+        log = SegmentLog(str(tmp_path), fsync_messages=0, fsync_interval=0.1)
+        try:
+            log.append("github", [_message(i) for i in range(2)])
+            log.ack("github", 0)
+            topic_log = log._topics["github"]
+            dirty = topic_log.dirty
+            _wait(lambda: not topic_log.dirty, 2.0)
+
+            assert dirty
+            assert not topic_log.dirty
+            with open(topic_log.committed_path, "rb") as f:
+                assert f.read() == (1).to_bytes(8, "little")
+        finally:
+            log.close()
+
+    @pytest.mark.it("unmaps its segments on close and ignores late acknowledgements")
+    def test_close(self, tmp_path):
+        log = SegmentLog(str(tmp_path))
+        log.append("github", [_message(i) for i in range(2)])
+        topic_log = log._topics["github"]
+        log.close()
+
+        assert all(segment.map.closed and segment.file.closed for segment in topic_log.segments)
+        log.ack("github", 0)
+        with pytest.raises(ValueError):
+            log.append("github", [_message(2)])
+        log.reopen()
+        assert log.committed("github") == 0
+        assert log.end_offset("github") == 2
+
+
+@pytest.mark.describe("InMemoryEventBus with a log")
+class TestLoggedEventBus:
+    @pytest.mark.it("delivers messages that were not handled before a restart")
+    def test_resume(self, tmp_path):
+        bus = InMemoryEventBus(log_dir=str(tmp_path))
+        for i in range(5):
+            bus.publish("github", _message(i))
+        bus.log.close()
+
+        received = []
+        restarted = InMemoryEventBus(log_dir=str(tmp_path))
+        restarted.subscribe("github", lambda msg: received.append(msg.source_id))
+        restarted.start()
+        _wait(lambda: len(received) == 5, 2)
+        restarted.stop()
+        restarted.log.close()
+
+        assert received == [f"msg-{i}" for i in range(5)]
+        assert "github" not in InMemoryEventBus(log_dir=str(tmp_path)).queues
+
+    @pytest.mark.it("replays logged messages from an offset")
+    def test_replay(self, tmp_path):
+        bus = InMemoryEventBus(log_dir=str(tmp_path))
+        bus.publish_many("github", [_message(i) for i in range(10)])
+        replayed = []
+
+        next_offset = bus.replay("github", lambda msg: replayed.append(msg.source_id), from_offset=4, to_offset=7)
+
+        assert replayed == ["msg-4", "msg-5", "msg-6"]
+        assert next_offset == 7
+
+    @pytest.mark.it("does not deliver dropped messages again after a restart")
+    def test_dropped(self, tmp_path):
+        bus = InMemoryEventBus(log_dir=str(tmp_path), max_queue_size=2, overflow="drop_oldest")
+        for i in range(5):
+            bus.publish("github", _message(i))
+
+        assert bus.log.committed("github") == 3
+
+    @pytest.mark.it("acknowledges a failed message only after its last retry")
+    def test_retry(self, tmp_path):
+        calls = []
+
+        def flaky(msg):
+            calls.append(time.monotonic())
+            if len(calls) < 3:
+                raise RuntimeError("failure")
+
+        bus = InMemoryEventBus(log_dir=str(tmp_path), retry=RetryPolicy(max_attempts=3, initial_backoff=0.2, jitter=0))
+        bus.subscribe("github", flaky)
+        bus.start()
+        bus.publish("github", _message(0))
+        _wait(lambda: len(calls) == 1, 2)
+        time.sleep(0.05)
+
+        assert bus.log.committed("github") == 0
+        _wait(lambda: bus.log.committed("github") == 1, 3)
+        assert len(calls) == 3
+        bus.stop()
+
+    @pytest.mark.it("acknowledges a message once it was moved to the dead-letter topic")
+    def test_dead_letter(self, tmp_path):
+        dead = []
+
+        def failing(msg):
+            raise RuntimeError("failure")
+
+        bus = InMemoryEventBus(log_dir=str(tmp_path), retry=RetryPolicy(max_attempts=2, initial_backoff=0.01, jitter=0))
+        bus.subscribe("github", failing)
+        bus.subscribe("dead_letter.github", lambda msg: dead.append(msg))
+        bus.start()
+        bus.publish("github", _message(0))
+        _wait(lambda: bus.log.committed("github") == 1, 3)
+        _wait(lambda: dead, 2)
+        bus.stop()
+
+        assert len(dead) == 1
+
+    @pytest.mark.it("closes the log when it is stopped")
+    def test_stop(self, tmp_path):
+        bus = InMemoryEventBus(log_dir=str(tmp_path))
+        bus.publish("github", _message(0))
+        bus.start()
+        bus.stop()
+
+        assert bus.log.closed
+        assert bus.log._topics == {}
@@ -0,0 +1,220 @@
+# Shared memory event bus unit tests
+import time
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.shm_bus import SharedMemoryEventBus
+from soma.eventbus.shm_ring import Doorbell, ShmRingBuffer
+from soma.eventbus.topic_queue import BackpressureError
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Shared Memory Ring Buffer")
+class TestShmRingBuffer:
+    @pytest.mark.it("returns records in order across the wrap-around of the ring")
+    def test_wrap_around(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        consumer = ShmRingBuffer(name, capacity=64, create=True)
+        producer = ShmRingBuffer(name)
+        try:
+            received = []
+            for i in range(20):
+                producer.put(f"record-{i:02d}".encode())
+                received.extend(consumer.get_many())
+
+            assert received == [f"record-{i:02d}".encode() for i in range(20)]
+        finally:
+            producer.close()
+            consumer.close()
+
+    @pytest.mark.it("returns records in order with counters accessed under a lock")
+    def test_fenced(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        consumer = ShmRingBuffer(name, capacity=64, create=True, fenced=True)
+        producer = ShmRingBuffer(name, fenced=True)
+        try:
+            received = []
+            for i in range(20):
+                producer.put(f"record-{i:02d}".encode())
+                received.extend(consumer.get_many())
+
+            assert received == [f"record-{i:02d}".encode() for i in range(20)]
+        finally:
+            producer.close()
+            consumer.close()
+
+    @pytest.mark.it("replaces a stale segment with one of the requested capacity")
+    def test_stale_segment(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        # Left over by a crashed process, which does not remove it on exit
+        stale = shared_memory.SharedMemory(name=name, create=True, size=256)
+        stale.buf[:16] = b"\xff" * 16
+        stale.close()
+        resource_tracker.unregister(f"/{name}", "shared_memory")
+
+        ring = ShmRingBuffer(name, capacity=64, create=True)
+        try:
+            assert ring.capacity == 64
+            assert ring.get_many() == []
+            ring.put(b"record")
+            assert ring.get_many() == [b"record"]
+        finally:
+            ring.close()
+
+    @pytest.mark.it("raises BackpressureError when the ring stays full")
+    def test_full(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        ring = ShmRingBuffer(name, capacity=32, create=True)
+        try:
+            ring.put(b"x" * 20)
+            with pytest.raises(BackpressureError):
+                ring.put(b"y" * 20, timeout=0.01)
+            with pytest.raises(ValueError):
+                ring.put(b"z" * 40)
+        finally:
+            ring.close()
+
+
+@pytest.mark.describe("Doorbell")
+class TestDoorbell:
+    @pytest.mark.it("keeps a wake-up that arrives before the consumer waits")
+    def test_wake_up(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        consumer = Doorbell(name, create=True)
+        producer = Doorbell(name)
+        try:
+            assert not consumer.wait(0.01)
+            for _ in range(3):
+                producer.ring()
+
+            assert consumer.wait(5.0)
+            assert not consumer.wait(0.01)
+        finally:
+            producer.close()
+            consumer.close()
+
+    @pytest.mark.it("ignores rings without a consumer")
+    def test_no_consumer(self):
+        Doorbell(f"soma-test-{uuid.uuid4().hex[:8]}").ring()
+
+
+@pytest.mark.describe("Shared Memory Event Bus")
+class TestSharedMemoryEventBus:
+    @pytest.mark.it("routes messages with the same key to the same node")
+    def test_keyed_routing(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        received = {0: [], 1: []}
+        buses = [SharedMemoryEventBus(name, node_id=i, nodes=2) for i in range(2)]
+        try:
+            for i, bus in enumerate(buses):
+                bus.subscribe("email", lambda msg, node=i: received[node].append(msg.source_id))
+                bus.start()
+
+            keys = ["nibra/soma", "nibra/other"]
+            for i in range(10):
+                buses[0].publish("email", _message(i), key=keys[i % 2])
+
+            _wait(lambda: len(received[0]) + len(received[1]) == 10, 3)
+
+            for first, key in enumerate(keys):
+                ids = [f"msg-{i}" for i in range(first, 10, 2)]
+                node = buses[0]._route(key)
+                assert [source_id for source_id in received[node] if source_id in ids] == ids
+            assert sorted(received[0] + received[1]) == sorted(f"msg-{i}" for i in range(10))
+        finally:
+            for bus in buses:
+                bus.close()
+
+    @pytest.mark.it("distributes messages without key round-robin over all nodes")
+    def test_round_robin(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        received = {0: [], 1: []}
+        buses = [SharedMemoryEventBus(name, node_id=i, nodes=2) for i in range(2)]
+        try:
+            for i, bus in enumerate(buses):
+                bus.subscribe("email", lambda msg, node=i: received[node].append(msg.source_id))
+                bus.start()
+
+            buses[1].publish_many("email", [_message(i) for i in range(10)])
+
+            _wait(lambda: len(received[0]) + len(received[1]) == 10, 3)
+
+            assert len(received[0]) == 5
+            assert len(received[1]) == 5
+        finally:
+            for bus in buses:
+                bus.close()
+
+    @pytest.mark.it("keeps the message key when passing a message through a ring")
+    def test_encode_key(self):
+        for key in ["nibra/soma", None, ""]:
+            topic, decoded_key, message = SharedMemoryEventBus.decode(
+                SharedMemoryEventBus.encode("github.ci_activity", _message(1), key))
+
+            assert topic == "github.ci_activity"
+            assert decoded_key == key
+            assert message.source_id == "msg-1"
+
+    @pytest.mark.it("wakes up an idle receiver without waiting for max_idle_sleep")
+    def test_wake_up(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        received = []
+        buses = [SharedMemoryEventBus(name, node_id=i, nodes=2, max_idle_sleep=30.0) for i in range(2)]
+        try:
+            buses[1].subscribe("email", lambda msg: received.append(msg.source_id))
+            for bus in buses:
+                bus.start()
+            time.sleep(0.1)
+
+            started = time.monotonic()
+            buses[0]._send(1, "email", [_message(1)], [None])
+            _wait(lambda: received, 5)
+
+            assert received == ["msg-1"]
+            assert time.monotonic() - started < 5
+        finally:
+            for bus in buses:
+                bus.close()
+
+    @pytest.mark.it("keeps receiving after messages of a topic could not be enqueued")
+    def test_enqueue_error(self):
+        name = f"soma-test-{uuid.uuid4().hex[:8]}"
+        received = []
+        buses = [SharedMemoryEventBus(name, node_id=i, nodes=2) for i in range(2)]
+        enqueue = buses[1].local._enqueue
+
+        def failing(topic, messages, keys):
+            if topic == "full":
+                raise BackpressureError("Queue 'full' is full")
+            enqueue(topic, messages, keys)
+
+        buses[1].local._enqueue = failing
+        try:
+            buses[1].subscribe("email", lambda msg: received.append(msg.source_id))
+            for bus in buses:
+                bus.start()
+
+            buses[0]._send(1, "full", [_message(0)], [None])
+            buses[0]._send(1, "email", [_message(1)], [None])
+            _wait(lambda: received, 3)
+            buses[0]._send(1, "full", [_message(2)], [None])
+            buses[0]._send(1, "email", [_message(3)], [None])
+            _wait(lambda: len(received) == 2, 3)
+
+            assert received == ["msg-1", "msg-3"]
+            assert buses[1]._receiver.is_alive()
+        finally:
+            for bus in buses:
+                bus.close()
@@ -0,0 +1,124 @@
+# Topic matcher unit tests
+import re
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.topic_matcher import TopicMatcher
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Topic Matcher")
+class TestTopicMatcher:
+    @pytest.mark.it("matches '*' against exactly one segment")
+    @pytest.mark.parametrize("topic, expected", [
+        ("github.ci_activity", True),
+        ("github", False),
+        ("github.state_change.pr", False),
+        ("gitlab.ci_activity", False),
+    ])
+    def test_star(self, topic, expected):
+        matcher = TopicMatcher()
+        matcher.add("github.*", "agent")
+
+        assert (matcher.match(topic) == ("agent",)) is expected
+        assert bool(re.match(TopicMatcher.to_regex("github.*"), topic)) is expected
+
+    @pytest.mark.it("matches '#' against zero or more segments")
+    @pytest.mark.parametrize("topic, expected", [
+        ("github", True),
+        ("github.ci_activity", True),
+        ("github.state_change.pr.closed", True),
+        ("githubx", False),
+    ])
+    def test_hash(self, topic, expected):
+        matcher = TopicMatcher()
+        matcher.add("github.#", "agent")
+
+        assert (matcher.match(topic) == ("agent",)) is expected
+        assert bool(re.match(TopicMatcher.to_regex("github.#"), topic)) is expected
+
+    @pytest.mark.it("combines literal, wildcard and regex subscriptions in subscription order")
+    def test_combined(self):
+        matcher = TopicMatcher()
+        matcher.add("github.#", "a")
+        matcher.add("github.ci_activity", "b")
+        matcher.add(re.compile(r"github\.ci_"), "c")
+        matcher.add("github.*", "a")
+
+        assert matcher.match("github.ci_activity") == ("a", "b", "c", "a")
+        assert matcher.match("github.security_alert") == ("a", "a")
+        assert matcher.match("email") == ()
+
+    @pytest.mark.it("returns a value once per matching subscription")
+    def test_subscriptions(self):
+        matcher = TopicMatcher()
+        matcher.add("email", "a")
+        matcher.add("email", "a")
+        matcher.add("#.#", "b")
+
+        assert matcher.match("email") == ("a", "a", "b")
+
+    @pytest.mark.it("keeps the flags of compiled regular expressions")
+    def test_regex_flags(self):
+        regex = TopicMatcher.to_regex(re.compile(r"github\.CI_.*", re.IGNORECASE))
+
+        assert re.match(regex, "github.ci_activity")
+        assert re.match(f"(?:{regex})|(?:email)", "github.ci_activity")
+
+    @pytest.mark.it("invalidates cached matches when subscriptions are added")
+    def test_cache_invalidation(self):
+        matcher = TopicMatcher()
+        matcher.add("github.*", "a")
+        assert matcher.match("github.ci_activity") == ("a",)
+
+        matcher.add("#", "b")
+
+        assert matcher.match("github.ci_activity") == ("a", "b")
+
+
+@pytest.mark.describe("Pattern containment")
+class TestCovers:
+    @pytest.mark.it("checks whether a pattern matches all topics of another pattern")
+    @pytest.mark.parametrize("pattern, topic, expected", [
+        ("#", "#", True),
+        ("#", "github.*.x", True),
+        ("*", "#", False),
+        ("*", "*", True),
+        ("github.*", "github.#", False),
+        ("github.#", "github.*", True),
+        ("github.#", "github.#", True),
+        ("github.#", "github", True),
+        ("github.*", "github.ci_activity", True),
+        ("github.ci_activity", "github.*", False),
+        ("#.closed", "github.*.closed", True),
+        ("#.closed", "github.#", False),
+        ("*.*.#", "a.#", False),
+        ("*.#", "a.#", True),
+    ])
+    def test_covers(self, pattern, topic, expected):
+        assert TopicMatcher.covers(pattern, topic) is expected
+
+
+@pytest.mark.describe("Pattern subscriptions")
+class TestPatternSubscriptions:
+    @pytest.mark.it("delivers messages of topics created after start() to pattern subscribers")
+    def test_runtime_topics(self):
+        received = []
+        bus = InMemoryEventBus()
+        bus.subscribe("github.#", lambda msg: received.append(msg.source_id))
+        bus.start()
+        bus.publish("github.state_change.pr.closed", Message(source_type="test", source_id="closed", content=""))
+        bus.publish("email", Message(source_type="test", source_id="email", content=""))
+
+        _wait(lambda: received, 3)
+        bus.stop()
+
+        assert received == ["closed"]
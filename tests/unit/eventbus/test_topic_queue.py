@@ -0,0 +1,113 @@
+# Topic queue unit tests
+import threading
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.topic_queue import TopicQueue, MemoryBudget, BackpressureError, message_size
+
+
+def _message(i: int, content: str = "") -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=content)
+
+
+def _drain(q: TopicQueue) -> list[str]:
+    items = []
+    while not q.empty():
+        items.append(q.get().source_id)
+    return items
+
+
+@pytest.mark.describe("Topic Queue")
+class TestTopicQueue:
+    @pytest.mark.it("discards the oldest messages with the drop_oldest policy")
+    def test_drop_oldest(self):
+        q = TopicQueue("test", maxsize=2, overflow="drop_oldest")
+        for i in range(4):
+            q.put(_message(i))
+
+        assert _drain(q) == ["msg-2", "msg-3"]
+
+    @pytest.mark.it("discards new messages with the drop_newest policy")
+    def test_drop_newest(self):
+        q = TopicQueue("test", maxsize=2, overflow="drop_newest")
+        for i in range(4):
+            q.put(_message(i))
+
+        assert _drain(q) == ["msg-0", "msg-1"]
+
+    @pytest.mark.it("raises BackpressureError with the raise policy")
+    def test_raise(self):
+        q = TopicQueue("test", maxsize=1, overflow="raise")
+        q.put(_message(0))
+
+        with pytest.raises(BackpressureError):
+            q.put(_message(1))
+
+    @pytest.mark.it("blocks until a consumer makes room and gives up after the timeout")
+    def test_block(self):
+        q = TopicQueue("test", maxsize=1, overflow="block", put_timeout=0.1)
+        q.put(_message(0))
+
+        with pytest.raises(BackpressureError):
+            q.put(_message(1))
+
+        threading.Timer(0.05, q.get).start()
+        q.put(_message(2), timeout=2)
+
+        assert _drain(q) == ["msg-2"]
+
+    @pytest.mark.it("shares a byte budget between queues")
+    def test_memory_budget(self):
+        size = message_size(_message(0, "x" * 100))
+        budget = MemoryBudget(2 * size)
+        q1 = TopicQueue("one", overflow="raise", budget=budget)
+        q2 = TopicQueue("two", overflow="raise", budget=budget)
+
+        q1.put(_message(0, "x" * 100))
+        q2.put(_message(1, "x" * 100))
+        with pytest.raises(BackpressureError):
+            q1.put(_message(2, "x" * 100))
+
+        q2.get()
+        q1.put(_message(3, "x" * 100))
+
+        assert budget.used == 2 * size
+        assert q1.bytes == 2 * size
+
+    @pytest.mark.it("never exceeds the byte budget with concurrent producers")
+    def test_memory_budget_concurrent(self):
+        size = message_size(_message(0, "x" * 100))
+        budget = MemoryBudget(10 * size)
+        queues = [TopicQueue(f"topic-{i}", overflow="drop_newest", budget=budget) for i in range(8)]
+        peak = []
+
+        def produce(q: TopicQueue):
+            for i in range(200):
+                q.put(_message(i, "x" * 100))
+                peak.append(budget.used)
+                if i % 3 == 0 and not q.empty():
+                    q.get()
+
+        threads = [threading.Thread(target=produce, args=(q,)) for q in queues]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert max(peak) <= budget.limit
+        assert budget.used == sum(q.bytes for q in queues)
+
+    @pytest.mark.it("rejects unknown overflow policies")
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            TopicQueue("test", overflow="ignore")
+
+    @pytest.mark.it("is used by InMemoryEventBus with the configured limits")
+    def test_bus_configuration(self):
+        bus = InMemoryEventBus(max_queue_size=1, overflow="raise")
+        bus.publish("email", _message(0))
+
+        with pytest.raises(BackpressureError):
+            bus.publish("email", _message(1))
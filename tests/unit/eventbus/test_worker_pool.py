@@ -0,0 +1,84 @@
+# Topic worker pool unit tests
+import queue
+import threading
+import time
+
+import pytest
+
+from soma.core.contracts.message import Message
+from soma.eventbus.memory_bus import InMemoryEventBus
+from soma.eventbus.worker_pool import TopicWorkerPool, AdaptiveScaler
+
+
+def _message(i: int) -> Message:
+    return Message(agent_name="agent1", source_type="test", source_id=f"msg-{i}", content=f"content {i}")
+
+
+def _wait(condition, timeout_seconds):
+    timeout = time.time() + timeout_seconds
+    while not condition() and time.time() < timeout:
+        time.sleep(0.01)
+
+
+@pytest.mark.describe("Topic Worker Pool")
+class TestTopicWorkerPool:
+    @pytest.mark.it("handles messages of one topic concurrently when configured with several workers")
+    def test_concurrent_workers(self):
+        barrier = threading.Barrier(4, timeout=2)
+        passed = []
+
+        def slow_handler(msg):
+            barrier.wait()
+            passed.append(msg.source_id)
+
+        bus = InMemoryEventBus(workers={"email": 4})
+        bus.subscribe("email", slow_handler)
+        bus.start()
+        for i in range(4):
+            bus.publish("email", _message(i))
+
+        _wait(lambda: len(passed) == 4, 3)
+        bus.stop()
+
+        assert sorted(passed) == [f"msg-{i}" for i in range(4)]
+
+    @pytest.mark.it("lets subscribe() override the configured number of workers")
+    def test_subscribe_overrides_workers(self):
+        bus = InMemoryEventBus(workers={"email": 2})
+        bus.subscribe("email", lambda msg: None, workers=8)
+        bus.start()
+        size = bus.pools["email"].size
+        bus.stop()
+
+        assert size == 8
+
+    @pytest.mark.it("rejects pools without workers")
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            TopicWorkerPool("email", queue.Queue(), lambda topic, msg: None, size=0)
+
+
+@pytest.mark.describe("Adaptive Scaler")
+class TestAdaptiveScaler:
+    @pytest.mark.it("grows a pool when the queue backlog exceeds the target drain time")
+    def test_grows_on_backlog(self):
+        source = queue.Queue()
+        for i in range(100):
+            source.put(_message(i))
+        pool = TopicWorkerPool("email", source, lambda topic, msg: None, size=2)
+        pool.latency = 0.1
+
+        scaler = AdaptiveScaler(lambda: [pool], min_workers=1, max_workers=16, target_backlog=0.5)
+
+        assert scaler.adjust(pool) == 4
+        assert scaler.adjust(pool) == 8
+        assert scaler.adjust(pool) == 16
+        assert scaler.adjust(pool) == 16
+
+    @pytest.mark.it("shrinks an idle pool down to the minimum size")
+    def test_shrinks_when_idle(self):
+        pool = TopicWorkerPool("email", queue.Queue(), lambda topic, msg: None, size=3)
+        scaler = AdaptiveScaler(lambda: [pool], min_workers=2, max_workers=16)
+
+        assert scaler.adjust(pool) == 2
+        assert scaler.adjust(pool) == 2